@@ -1,5 +1,55 @@
 from django.apps import AppConfig
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+
+
+def install_triggers(sender, using, **kwargs):
+    from wallet_base.partitions import is_partitioned, partition_transactions
+    from wallet_base.triggers import install_balance_trigger
+
+    connection = connections[using]
+
+    if connection.vendor != "postgresql":
+        return
+
+    # Also covers databases built without migrations (pytest --no-migrations)
+    if not is_partitioned(connection):
+        with transaction.atomic(using=using):
+            partition_transactions(connection)
+
+    install_balance_trigger(connection)
 
 
 class WalletConfig(AppConfig):
     name = "wallet_base"
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from rest_framework.authtoken.models import Token
+
+        from wallet_base.cache import (
+            invalidate_payment,
+            invalidate_token,
+            invalidate_user_tokens,
+            invalidate_user_wallet,
+            invalidate_wallet_balance,
+        )
+
+        post_migrate.connect(install_triggers, sender=self)
+
+        WalletTransaction = self.get_model("WalletTransaction")
+        post_save.connect(invalidate_wallet_balance, sender=WalletTransaction)
+        post_delete.connect(invalidate_wallet_balance, sender=WalletTransaction)
+
+        Wallet = self.get_model("Wallet")
+        post_save.connect(invalidate_user_wallet, sender=Wallet)
+        post_delete.connect(invalidate_user_wallet, sender=Wallet)
+        LeadPayment = self.get_model("LeadPayment")
+        post_save.connect(invalidate_payment, sender=LeadPayment)
+        post_delete.connect(invalidate_payment, sender=LeadPayment)
+
+        post_save.connect(invalidate_token, sender=Token)
+        post_delete.connect(invalidate_token, sender=Token)
+        User = get_user_model()
+        post_save.connect(invalidate_user_tokens, sender=User)
+        post_delete.connect(invalidate_user_tokens, sender=User)
@@ -0,0 +1,20 @@
+from rest_framework.authentication import TokenAuthentication
+
+from wallet_base.cache import cache_token, get_cached_token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that looks the token and its user up in the local
+    and shared caches first (see cache.get_cached_token), so most requests
+    don't query them. Entries are dropped when the token or the user is
+    saved or deleted."""
+
+    def authenticate_credentials(self, key):
+        cached = get_cached_token(key)
+
+        if cached is not None:
+            return cached
+
+        user, token = super().authenticate_credentials(key)
+        cache_token(key, user, token)
+        return user, token
@@ -0,0 +1,421 @@
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django_redis import get_redis_connection
+
+logger = logging.getLogger("wallet")
+
+WALLET_VERSION_KEY = "wallet_version_%(wallet_id)s"
+USER_WALLET_TIMEOUT = 60 * 60 * 24
+WALLET_TIMEOUT = 60 * 60 * 24
+PAYMENT_TIMEOUT = 60 * 60 * 24
+USER_TOKEN_TIMEOUT = 60 * 60 * 24
+BALANCE_KEY = "wallet_balance_%(wallet_id)s_%(version)s_%(name)s"
+BALANCE_TIMEOUT = 60 * 60 * 24
+INVALIDATION_CHANNEL = "wallet_cache_invalidation"
+
+balance_cache_stats = {"hit": 0, "miss": 0}
+# TwoTierCache instances by prefix, for the invalidation listener
+two_tier_caches = {}
+invalidation_listener = {"pid": None, "thread": None}
+invalidation_listener_lock = threading.Lock()
+
+
+class LocalCache:
+    """In-process LRU whose entries expire after timeout seconds, in front
+    of the shared cache for values read on every request. Nothing tells
+    other processes about a delete: their entries just expire."""
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            value, expires = entry
+
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.timeout)
+            self.entries.move_to_end(key)
+
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def _invalidate_local(message):
+    data = json.loads(message["data"])
+    two_tier_cache = two_tier_caches.get(data["prefix"])
+
+    if two_tier_cache is not None:
+        for key in data["keys"]:
+            two_tier_cache.local.delete(key)
+
+
+def _stop_invalidation_listener(exception, pubsub, thread):
+    logger.warning("cache invalidation listener stopped", exc_info=exception)
+    thread.stop()
+    # Started again by the next local set
+    invalidation_listener["pid"] = None
+
+
+def start_invalidation_listener():
+    """Subscribe this process to INVALIDATION_CHANNEL in a thread, once per
+    process (again after a fork, threads don't survive it)."""
+
+    if invalidation_listener["pid"] == os.getpid():
+        return
+
+    with invalidation_listener_lock:
+        if invalidation_listener["pid"] == os.getpid():
+            return
+
+        try:
+            pubsub = get_redis_connection("default").pubsub(
+                ignore_subscribe_messages=True
+            )
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: _invalidate_local})
+            invalidation_listener["thread"] = pubsub.run_in_thread(
+                sleep_time=1,
+                daemon=True,
+                exception_handler=_stop_invalidation_listener,
+            )
+        except Exception:
+            # Local entries still expire after their timeout
+            logger.warning("cache invalidation listener failed", exc_info=True)
+            return
+
+        invalidation_listener["pid"] = os.getpid()
+
+
+class TwoTierCache:
+    """A LocalCache in front of the shared cache, for values read on every
+    request. invalidate() deletes keys from both and publishes them on
+    INVALIDATION_CHANNEL, so every process drops its local entry right away
+    instead of when it expires. Values are pickled, so each call gets its
+    own instances, and None isn't cached."""
+
+    def __init__(self, prefix, timeout, local_timeout, local_size):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.local = LocalCache(local_size, local_timeout)
+        two_tier_caches[prefix] = self
+
+    def make_key(self, key):
+        return f"{self.prefix}_{key}"
+
+    def get(self, key):
+        key = self.make_key(key)
+        value = self.local.get(key)
+
+        if value is None:
+            value = cache.get(key)
+
+            if value is None:
+                return None
+
+            self.set_local(key, value)
+
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        key = self.make_key(key)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        cache.set(key, value, self.timeout)
+        self.set_local(key, value)
+
+    def get_or_set(self, key, default):
+        value = self.get(key)
+
+        if value is None:
+            value = default()
+
+            if value is not None:
+                self.set(key, value)
+
+        return value
+
+    def set_local(self, key, value):
+        start_invalidation_listener()
+        self.local.set(key, value)
+
+    def delete_many(self, keys):
+        keys = [self.make_key(key) for key in keys]
+        cache.delete_many(keys)
+
+        for key in keys:
+            self.local.delete(key)
+
+        get_redis_connection("default").publish(
+            INVALIDATION_CHANNEL,
+            json.dumps({"prefix": self.prefix, "keys": keys}),
+        )
+
+    def invalidate(self, keys):
+        keys = list(keys)
+
+        if not keys:
+            return
+
+        self.delete_many(keys)
+        # Again after commit, a request reading the value meanwhile could
+        # have cached it as it was before the change
+        transaction.on_commit(lambda: self.delete_many(keys))
+
+    def clear(self):
+        """Clear this process' entries only."""
+
+        self.local.clear()
+
+
+# Fields of each token and its user (see cache_token). Entries under the old
+# "auth_token" prefix were whole instances and are left to expire.
+token_cache = TwoTierCache(
+    "auth_token_fields",
+    settings.TOKEN_CACHE_TIMEOUT,
+    settings.TOKEN_LOCAL_CACHE_TIMEOUT,
+    settings.TOKEN_LOCAL_CACHE_SIZE,
+)
+user_wallet_cache = TwoTierCache(
+    "user_wallet",
+    USER_WALLET_TIMEOUT,
+    settings.LOCAL_CACHE_TIMEOUT,
+    settings.LOCAL_CACHE_SIZE,
+)
+# Token key of each user, for logins
+user_token_cache = TwoTierCache(
+    "user_token",
+    USER_TOKEN_TIMEOUT,
+    settings.LOCAL_CACHE_TIMEOUT,
+    settings.LOCAL_CACHE_SIZE,
+)
+# Wallet field values, without the balance
+wallet_cache = TwoTierCache(
+    "wallet",
+    WALLET_TIMEOUT,
+    settings.LOCAL_CACHE_TIMEOUT,
+    settings.LOCAL_CACHE_SIZE,
+)
+# Censored nro and payment type, never the whole nro
+payment_cache = TwoTierCache(
+    "censored_payment",
+    PAYMENT_TIMEOUT,
+    settings.LOCAL_CACHE_TIMEOUT,
+    settings.LOCAL_CACHE_SIZE,
+)
+
+
+def get_balance_cache_stats():
+    return dict(balance_cache_stats)
+
+
+def get_wallet_version(wallet_id):
+    key = WALLET_VERSION_KEY % {"wallet_id": wallet_id}
+    version = cache.get(key)
+
+    if version is None:
+        # Start from the clock instead of 0 so a version key lost to an
+        # eviction or restart never points back at entries cached before it
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+
+    return version
+
+
+def _bump_wallet_versions(wallet_ids):
+    for wallet_id in wallet_ids:
+        try:
+            cache.incr(WALLET_VERSION_KEY % {"wallet_id": wallet_id})
+        except ValueError:
+            # Missing key, next get_wallet_version starts a new one
+            pass
+
+
+def bump_wallet_versions(wallet_ids):
+    wallet_ids = set(wallet_ids)
+
+    if not wallet_ids:
+        return
+
+    _bump_wallet_versions(wallet_ids)
+    # Bump again once the write is visible, otherwise a concurrent reader
+    # could cache pre-commit totals under the new version
+    transaction.on_commit(lambda: _bump_wallet_versions(wallet_ids))
+
+
+def bump_wallet_version(wallet_id):
+    bump_wallet_versions([wallet_id])
+
+
+def cached_balance(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if args or kwargs:
+            return method(self, *args, **kwargs)
+
+        key = BALANCE_KEY % {
+            "wallet_id": self.pk,
+            "version": get_wallet_version(self.pk),
+            "name": method.__name__,
+        }
+        value = cache.get(key)
+
+        if value is not None:
+            balance_cache_stats["hit"] += 1
+            return value
+
+        balance_cache_stats["miss"] += 1
+        value = method(self)
+        cache.set(key, value, BALANCE_TIMEOUT)
+        return value
+
+    return wrapper
+
+
+def invalidate_wallet_balance(sender, instance, **kwargs):
+    bump_wallet_version(instance.wallet_id)
+
+
+def get_user_wallet_id(user_id):
+    from wallet_base.models import Wallet
+
+    return user_wallet_cache.get_or_set(
+        user_id,
+        lambda: Wallet.objects.filter(user_id=user_id)
+        .values_list("id", flat=True)
+        .first(),
+    )
+
+
+def get_wallet(wallet_id):
+    """An unsaved-looking Wallet built from the cached field values of
+    wallet_id, for reading. Writes should fetch the row."""
+
+    from wallet_base.models import Wallet
+
+    values = wallet_cache.get_or_set(
+        wallet_id,
+        lambda: Wallet.objects.filter(pk=wallet_id)
+        .values(*[field.attname for field in Wallet._meta.concrete_fields])
+        .first(),
+    )
+
+    if values is None:
+        raise Wallet.DoesNotExist
+
+    return Wallet(**values)
+
+
+def get_censored_payment(payment_id):
+    """(censored nro, payment_type) of a LeadPayment."""
+
+    from wallet_base.models import LeadPayment
+
+    def get_payment():
+        payment = LeadPayment.objects.get(pk=payment_id)
+        return payment.get_censored_nro(), payment.payment_type
+
+    return payment_cache.get_or_set(payment_id, get_payment)
+
+
+def invalidate_user_wallet(sender, instance, **kwargs):
+    user_wallet_cache.invalidate([instance.user_id])
+    wallet_cache.invalidate([instance.pk])
+
+
+def invalidate_payment(sender, instance, **kwargs):
+    payment_cache.invalidate([instance.pk])
+
+
+# What token authenticated requests use of the user, the password hash and
+# the other fields stay in the database
+CACHED_USER_FIELDS = ["id", "username", "is_active"]
+CACHED_TOKEN_FIELDS = ["key", "user_id", "created"]
+
+
+def get_cached_token(key):
+    """(user, token) cached for a token key by cache_token, or None. Both
+    are built like instances fetched with .only() the cached fields, other
+    fields are loaded on access and save() only writes the cached ones."""
+
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+
+    cached = token_cache.get(key)
+
+    if cached is None:
+        return None
+
+    user_values, token_values = cached
+    user = User.from_db(DEFAULT_DB_ALIAS, CACHED_USER_FIELDS, user_values)
+    token = Token.from_db(DEFAULT_DB_ALIAS, CACHED_TOKEN_FIELDS, token_values)
+    token.user = user
+    return user, token
+
+
+def cache_token(key, user, token):
+    token_cache.set(
+        key,
+        (
+            [getattr(user, field) for field in CACHED_USER_FIELDS],
+            [getattr(token, field) for field in CACHED_TOKEN_FIELDS],
+        ),
+    )
+
+
+def get_user_token_key(user):
+    from rest_framework.authtoken.models import Token
+
+    key = user_token_cache.get(user.pk)
+
+    if key is None:
+        key = Token.objects.get_or_create(user=user)[0].key
+        # Not a token that could still be rolled back
+        transaction.on_commit(lambda: user_token_cache.set(user.pk, key))
+
+    return key
+
+
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.invalidate([instance.key])
+    user_token_cache.invalidate([instance.user_id])
+
+
+def invalidate_user_tokens(sender, instance, **kwargs):
+    # Any change (is_active, password, deletion) of the user drops its token
+    from rest_framework.authtoken.models import Token
+
+    token_cache.invalidate(
+        Token.objects.filter(user_id=instance.pk).values_list("key", flat=True)
+    )
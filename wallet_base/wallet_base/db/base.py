@@ -0,0 +1,54 @@
+import os
+
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.base import IsolationLevel
+from django.utils.asyncio import async_unsafe
+
+from wallet_base.db.creation import DatabaseCreation
+from wallet_base.db.pool import get_pool, inherited
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """The postgresql backend taking connections from a pool of the process
+    (settings POOL: min_size, max_size, timeout, max_idle, max_lifetime and
+    check_after of ConnectionPool) and giving them back instead of closing.
+    With CONN_MAX_AGE 0, a request or task holds one only while it runs."""
+
+    creation_class = DatabaseCreation
+
+    def get_pool(self):
+        settings_dict = self.settings_dict
+        key = (
+            self.alias,
+            settings_dict["HOST"],
+            settings_dict["PORT"],
+            settings_dict["NAME"],
+            settings_dict["USER"],
+        )
+        return get_pool(key, **settings_dict.get("POOL", {}))
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        # As the parent sets it, pooled connections skip it
+        isolation_level = self.settings_dict["OPTIONS"].get("isolation_level")
+        self.isolation_level = (
+            IsolationLevel.READ_COMMITTED
+            if isolation_level is None
+            else IsolationLevel(isolation_level)
+        )
+        self.pid = os.getpid()
+        return self.get_pool().get(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        )
+
+    def _close(self):
+        if self.connection is None:
+            return
+
+        if self.pid != os.getpid():
+            # The parent's, from before a fork (Celery closes its socket)
+            inherited.append(self.connection)
+            return
+
+        with self.wrap_database_errors:
+            self.get_pool().put(self.connection)
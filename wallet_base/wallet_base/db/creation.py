@@ -0,0 +1,10 @@
+from django.db.backends.postgresql import creation
+
+from wallet_base.db.pool import close_pools
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep the database in use
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
@@ -0,0 +1,206 @@
+import os
+import threading
+import time
+from collections import deque
+
+from psycopg2 import Error, extensions
+
+pools = {}
+pools_lock = threading.Lock()
+# Pools and connections made before a fork (gunicorn --preload, Celery
+# prefork). Children keep them referenced: a collected connection would close
+# the parent's session
+inherited = []
+
+
+class PoolTimeout(Error):
+    pass
+
+
+class ConnectionPool:
+    """A thread safe pool of up to max_size connections.
+
+    Connections idle for max_idle seconds are closed, down to min_size, and
+    any older than max_lifetime is closed when returned. A connection idle
+    for check_after seconds is checked with a query before being handed out.
+    """
+
+    def __init__(
+        self,
+        min_size=1,
+        max_size=10,
+        timeout=10,
+        max_idle=300,
+        max_lifetime=3600,
+        check_after=30,
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.pid = os.getpid()
+        self.size = 0
+        # (connection, returned) pairs, most recently returned last
+        self.idle = deque()
+        self.created = {}
+        self.condition = threading.Condition()
+
+    def get(self, connect):
+        """An idle connection, or a new one from connect() if there's room,
+        waiting up to timeout seconds for one to be returned otherwise."""
+
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            connection, returned = self._checkout(deadline)
+
+            if connection is None:
+                return self._connect(connect)
+
+            if (
+                time.monotonic() - returned < self.check_after
+                or self._is_usable(connection)
+            ):
+                return connection
+
+            self._discard(connection)
+
+    def put(self, connection):
+        status = connection.info.transaction_status
+
+        if status not in (
+            extensions.TRANSACTION_STATUS_IDLE,
+            extensions.TRANSACTION_STATUS_INTRANS,
+            extensions.TRANSACTION_STATUS_INERROR,
+        ) or (time.monotonic() - self.created[connection] > self.max_lifetime):
+            self._discard(connection)
+            return
+
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except Error:
+                self._discard(connection)
+                return
+
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+        self._close_idle()
+
+    def close(self):
+        with self.condition:
+            connections = [connection for connection, _ in self.idle]
+            self.idle.clear()
+
+        for connection in connections:
+            self._discard(connection)
+
+    def stats(self):
+        with self.condition:
+            return {"size": self.size, "idle": len(self.idle)}
+
+    def _checkout(self, deadline):
+        with self.condition:
+            while True:
+                if self.idle:
+                    # The most recent, so the rest can go idle and be closed
+                    return self.idle.pop()
+
+                if self.size < self.max_size:
+                    self.size += 1
+                    return None, None
+
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    if not self.idle and self.size >= self.max_size:
+                        raise PoolTimeout(
+                            f"No connection available in {self.timeout}s "
+                            f"({self.max_size} in use)"
+                        )
+
+    def _connect(self, connect):
+        try:
+            connection = connect()
+        except BaseException:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+        with self.condition:
+            self.created[connection] = time.monotonic()
+
+        return connection
+
+    def _is_usable(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+            connection.rollback()
+        except Error:
+            return False
+
+        return True
+
+    def _discard(self, connection):
+        with self.condition:
+            self.size -= 1
+            self.created.pop(connection, None)
+            self.condition.notify()
+
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def _close_idle(self):
+        limit = time.monotonic() - self.max_idle
+        expired = []
+
+        with self.condition:
+            # Least recently returned first
+            while (
+                self.idle
+                and self.idle[0][1] < limit
+                and self.size - len(expired) > self.min_size
+            ):
+                expired.append(self.idle.popleft()[0])
+
+        for connection in expired:
+            self._discard(connection)
+
+
+def get_pool(key, **options):
+    """The ConnectionPool of key in this process, created on first use."""
+
+    pool = pools.get(key)
+
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+
+    with pools_lock:
+        pool = pools.get(key)
+
+        if pool is not None and pool.pid != os.getpid():
+            inherited.append(pools.pop(key))
+            pool = None
+
+        if pool is None:
+            pool = pools[key] = ConnectionPool(**options)
+
+        return pool
+
+
+def close_pools():
+    with pools_lock:
+        for pool in pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
+
+        pools.clear()
@@ -0,0 +1,99 @@
+"""
+gunicorn configuration: gunicorn -c python:wallet_base.gunicorn_conf
+
+GUNICORN_PROFILE picks the worker type, each sized from the CPUs this
+process may use:
+
+- sync: one request at a time per worker, 2 * CPUs + 1 workers.
+- gthread: GUNICORN_THREADS threads per worker, CPUs + 1 workers.
+- async: uvicorn workers serving wallet_base.asgi with the async read
+  views (wallet_base.urls_async), CPUs + 1 workers.
+
+The app is preloaded and warmed up (wallet_base.warmup) in the master, so
+workers are forked with Django, DRF and the serializers already imported
+and share that memory copy-on-write. Code changes then need a restart, a
+HUP only restarts the workers.
+"""
+
+import gc
+import os
+
+
+def get_cpus():
+    # The CPUs of the container or cgroup, not of the host
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+cpus = get_cpus()
+profile = os.getenv("GUNICORN_PROFILE", "sync")
+
+PROFILES = {
+    "sync": {
+        "worker_class": "sync",
+        "workers": 2 * cpus + 1,
+        "wsgi_app": "wallet_base.wsgi:application",
+    },
+    "gthread": {
+        "worker_class": "gthread",
+        "workers": cpus + 1,
+        "wsgi_app": "wallet_base.wsgi:application",
+    },
+    "async": {
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "workers": cpus + 1,
+        "wsgi_app": "wallet_base.asgi:application",
+    },
+}
+
+if profile not in PROFILES:
+    raise RuntimeError(
+        f"Unknown GUNICORN_PROFILE {profile!r}, use one of "
+        f"{', '.join(PROFILES)}"
+    )
+
+if profile == "async":
+    os.environ.setdefault("DJANGO_ROOT_URLCONF", "wallet_base.urls_async")
+
+worker_class = PROFILES[profile]["worker_class"]
+workers = int(os.getenv("GUNICORN_WORKERS", PROFILES[profile]["workers"]))
+threads = int(os.getenv("GUNICORN_THREADS", "4")) if profile == "gthread" else 1
+wsgi_app = PROFILES[profile]["wsgi_app"]
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8080")
+
+preload_app = True
+# Workers are restarted after max_requests (+ up to the jitter, so not all
+# at once), bounding what a leak can grow to
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "200"))
+# A worker silent for timeout seconds is killed and replaced
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Heartbeat files in memory, a disk backed /tmp can stall them in containers
+worker_tmp_dir = os.getenv("GUNICORN_WORKER_TMP_DIR", "/dev/shm")
+
+
+def when_ready(server):
+    # After the preload, before the first fork
+    from wallet_base.warmup import warmup
+
+    warmup()
+    # Objects from now on are left out of the collections, which would
+    # otherwise write to (and so copy) every page they're in in each worker
+    gc.freeze()
+    server.log.info("Warmed up (%s profile)", profile)
+
+
+def post_worker_init(worker):
+    # Connections can't be shared across the fork, each worker opens its own
+    # before its first request
+    from django.core.cache import cache
+    from django.db import connection
+
+    connection.ensure_connection()
+    # Kept for CONN_MAX_AGE, or given back to the pool (DB_POOL)
+    connection.close_if_unusable_or_obsolete()
+    cache.get("warmup")
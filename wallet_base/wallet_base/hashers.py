@@ -0,0 +1,78 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from rest_framework import exceptions, status
+
+from wallet_base.metrics import login_hashing_rejected
+
+hashing_pools = {}
+hashing_pools_lock = threading.Lock()
+
+
+class HashingBusy(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many logins in progress, try again later."
+    default_code = "hashing_busy"
+
+
+class HashingPool:
+    """Runs at most workers hashes at a time, with up to queue more waiting
+    for one. Any other is refused (HashingBusy) at once instead of holding
+    one more request thread. hashlib releases the GIL while hashing, so the
+    other threads keep serving requests meanwhile."""
+
+    def __init__(self, workers, queue):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="hashing"
+        )
+        self.slots = threading.BoundedSemaphore(workers + queue)
+
+    def run(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            login_hashing_rejected.inc()
+            raise HashingBusy
+
+        try:
+            return self.executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+
+def get_hashing_pool():
+    """The HashingPool of this process for LOGIN_HASH_WORKERS and
+    LOGIN_HASH_QUEUE, None if LOGIN_HASH_WORKERS is 0."""
+
+    if not settings.LOGIN_HASH_WORKERS:
+        return None
+
+    # A new one after a fork, the executor's threads don't survive it
+    key = (os.getpid(), settings.LOGIN_HASH_WORKERS, settings.LOGIN_HASH_QUEUE)
+    pool = hashing_pools.get(key)
+
+    if pool is None:
+        with hashing_pools_lock:
+            pool = hashing_pools.get(key)
+
+            if pool is None:
+                pool = hashing_pools[key] = HashingPool(
+                    settings.LOGIN_HASH_WORKERS, settings.LOGIN_HASH_QUEUE
+                )
+
+    return pool
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2PasswordHasher, same algorithm and hashes, hashing in the
+    HashingPool: logins (and the dummy hash of unknown users) can't take
+    more than LOGIN_HASH_WORKERS cores of a process."""
+
+    def encode(self, password, salt, iterations=None):
+        pool = get_hashing_pool()
+
+        if pool is None:
+            return super().encode(password, salt, iterations)
+
+        return pool.run(super().encode, password, salt, iterations)
@@ -0,0 +1,226 @@
+import csv
+import io
+import json
+import time
+from contextlib import nullcontext
+
+from django.db import connection, transaction
+from django.utils.timezone import now as utcnow
+
+from wallet_base.cache import bump_wallet_versions
+from wallet_base.models import DueTransition, Wallet, WalletTransaction
+from wallet_base.triggers import BULK_SETTING, add_balances_sql
+
+STAGING_TABLE = "wallet_credit_staging"
+COLUMNS = ["wallet_number", "amount", "delta_days", "description"]
+CHUNK_SIZE = 50000
+EXPIRATION_DELTA_YEARS = 3
+
+
+def _values(row):
+    values = [row.get(column) for column in COLUMNS]
+    # delta_days is optional
+    values[2] = values[2] or 0
+    return values
+
+
+def read_csv(stream):
+    """(wallet_number, amount, delta_days, description) rows of a CSV file
+    whose header names those columns."""
+
+    for row in csv.DictReader(stream):
+        yield _values(row)
+
+
+def read_ndjson(stream):
+    for line in stream:
+        if line.strip():
+            yield _values(json.loads(line))
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson}
+
+
+def _create_staging_sql():
+    return f"""
+        CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} (
+            line bigint NOT NULL,
+            wallet_number text,
+            amount double precision NOT NULL,
+            delta_days integer NOT NULL DEFAULT 0,
+            description varchar(250)
+        )
+    """
+
+
+def ingest_credits_sql():
+    wallet_table = Wallet._meta.db_table
+    transaction_table = WalletTransaction._meta.db_table
+    due_table = DueTransition._meta.db_table
+    # Same values as Wallet.add_available/add_pending give each row, and the
+    # same timers DueTransition.get_transitions schedules for them. Balances
+    # get one upsert per wallet, the per row trigger is off (BULK_SETTING).
+    return f"""
+        WITH inserted AS (
+            INSERT INTO {transaction_table} (
+                wallet_id, code, description, object_id, status, currency,
+                amount, datetime_available, datetime_expiration,
+                datetime_added
+            )
+            SELECT
+                w.id,
+                replace(gen_random_uuid()::text, '-', ''),
+                s.description,
+                0,
+                %(status)s,
+                %(currency)s,
+                s.amount,
+                %(now)s + s.delta_days * interval '1 day',
+                %(now)s + %(years)s * interval '1 year'
+                    + CASE WHEN %(status)s = %(pending)s
+                        THEN s.delta_days * interval '1 day'
+                        ELSE interval '0'
+                    END,
+                %(now)s
+            FROM {STAGING_TABLE} s
+            JOIN {wallet_table} w ON w.wallet_number = s.wallet_number
+            ORDER BY s.line
+            RETURNING id, wallet_id, status, amount, datetime_available,
+                datetime_expiration
+        ),
+        balances AS ({add_balances_sql("inserted")}),
+        scheduled AS (
+            INSERT INTO {due_table} (wallet_transaction_id, kind, datetime_due)
+            SELECT
+                id,
+                CASE
+                    WHEN amount < 0 THEN %(settle)s
+                    ELSE %(make_available)s
+                END,
+                datetime_available
+            FROM inserted
+            WHERE status = %(pending)s
+            UNION ALL
+            SELECT id, %(expire)s, datetime_expiration
+            FROM inserted
+            WHERE status = %(available)s
+                OR (status = %(pending)s AND amount >= 0)
+        )
+        SELECT wallet_id, COUNT(*) FROM inserted GROUP BY wallet_id
+    """
+
+
+def _copy(cursor, rows, first_line):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    for line, row in enumerate(rows, first_line):
+        writer.writerow([line] + row)
+
+    buffer.seek(0)
+
+    # copy_expert isn't wrapped by Django like execute
+    with connection.wrap_database_errors:
+        cursor.copy_expert(
+            f"COPY {STAGING_TABLE} (line, {', '.join(COLUMNS)}) "
+            f"FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+
+
+def _insert(cursor, status, now):
+    cursor.execute(f"SET LOCAL {BULK_SETTING} = on")
+    cursor.execute(
+        ingest_credits_sql(),
+        {
+            "status": status,
+            "currency": WalletTransaction.CURRENCY_ARS,
+            "now": now,
+            "years": EXPIRATION_DELTA_YEARS,
+            "pending": WalletTransaction.STATUS_PENDING,
+            "available": WalletTransaction.STATUS_AVAILABLE,
+            "settle": DueTransition.KIND_SETTLE,
+            "make_available": DueTransition.KIND_AVAILABLE,
+            "expire": DueTransition.KIND_EXPIRE,
+        },
+    )
+    inserted = dict(cursor.fetchall())
+    cursor.execute(f"SET LOCAL {BULK_SETTING} = off")
+    # Rows whose wallet_number matched no wallet
+    cursor.execute(
+        f"""
+        SELECT s.line FROM {STAGING_TABLE} s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {Wallet._meta.db_table} w
+            WHERE w.wallet_number = s.wallet_number
+        )
+        ORDER BY s.line
+        """
+    )
+    unknown = [row[0] for row in cursor.fetchall()]
+    cursor.execute(f"TRUNCATE {STAGING_TABLE}")
+    bump_wallet_versions(inserted)
+    return sum(inserted.values()), unknown
+
+
+def _chunks(rows, chunk_size):
+    chunk = []
+
+    for row in rows:
+        chunk.append(row)
+
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def ingest_credits(
+    rows,
+    status=WalletTransaction.STATUS_AVAILABLE,
+    chunk_size=CHUNK_SIZE,
+    atomic=True,
+    now=None,
+):
+    """Add a credit per (wallet_number, amount, delta_days, description) row,
+    as Wallet.add_available (or add_pending, for the pending status) would,
+    without a query or model instance per row. Rows are copied chunk by chunk
+    into a staging table and inserted in one statement, either once at the
+    end (atomic) or per chunk, each chunk committed on its own. Rows of
+    unknown wallets are skipped and reported by line number (from 1)."""
+
+    now = now or utcnow()
+    start = time.perf_counter()
+    summary = {"rows": 0, "inserted": 0, "unknown": []}
+
+    def insert(cursor):
+        inserted, unknown = _insert(cursor, status, now)
+        summary["inserted"] += inserted
+        summary["unknown"].extend(unknown)
+
+    with transaction.atomic() if atomic else nullcontext():
+        with connection.cursor() as cursor:
+            cursor.execute(_create_staging_sql())
+            cursor.execute(f"TRUNCATE {STAGING_TABLE}")
+
+            for chunk in _chunks(rows, chunk_size):
+                if atomic:
+                    _copy(cursor, chunk, summary["rows"] + 1)
+                else:
+                    with transaction.atomic():
+                        _copy(cursor, chunk, summary["rows"] + 1)
+                        insert(cursor)
+
+                summary["rows"] += len(chunk)
+
+            if atomic:
+                insert(cursor)
+
+            cursor.execute(f"DROP TABLE {STAGING_TABLE}")
+
+    elapsed = time.perf_counter() - start
+    summary["seconds"] = elapsed
+    summary["rows_per_second"] = summary["rows"] / elapsed if elapsed else 0
+    return summary
@@ -0,0 +1,70 @@
+import copy
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.utils import load_backend
+
+from wallet_base.db.pool import close_pools
+
+MODES = {
+    "connect per request": ("django.db.backends.postgresql", 0),
+    "persistent (CONN_MAX_AGE)": ("django.db.backends.postgresql", 60),
+    "pooled (DB_POOL)": ("wallet_base.db", 0),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time a request's database work (one query) connecting per request, "
+        "with persistent connections and with the pool, opening and closing "
+        "connections as Django does around each request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--query", default="SELECT 1")
+
+    def get_wrapper(self, engine, conn_max_age):
+        settings_dict = copy.deepcopy(connection.settings_dict)
+        settings_dict["ENGINE"] = engine
+        settings_dict["CONN_MAX_AGE"] = conn_max_age
+        settings_dict["CONN_HEALTH_CHECKS"] = True
+        return load_backend(engine).DatabaseWrapper(settings_dict, "benchmark")
+
+    def request(self, wrapper, query):
+        start = time.perf_counter()
+        # What the request_started and request_finished signals do
+        wrapper.close_if_unusable_or_obsolete()
+
+        with wrapper.cursor() as cursor:
+            cursor.execute(query)
+            cursor.fetchall()
+
+        wrapper.close_if_unusable_or_obsolete()
+        return time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        baseline = None
+
+        for name, (engine, conn_max_age) in MODES.items():
+            wrapper = self.get_wrapper(engine, conn_max_age)
+            # Warm up: the first connection of a process
+            self.request(wrapper, options["query"])
+            times = sorted(
+                self.request(wrapper, options["query"]) * 1000
+                for i in range(options["requests"])
+            )
+            wrapper.close()
+
+            mean = statistics.mean(times)
+            baseline = baseline or mean
+            self.stdout.write(
+                f"{name}: mean {mean:.3f} ms, "
+                f"p50 {times[len(times) // 2]:.3f} ms, "
+                f"p99 {times[int(len(times) * 0.99)]:.3f} ms, "
+                f"saved {baseline - mean:.3f} ms/request"
+            )
+
+        close_pools()
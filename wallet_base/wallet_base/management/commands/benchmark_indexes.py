@@ -0,0 +1,298 @@
+import statistics
+import time
+from importlib import import_module
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils.timezone import now as utcnow
+from django.utils.timezone import timedelta
+
+from wallet_base.models import Wallet, WalletTransaction
+from wallet_base.pagination import KeysetPaginator
+from wallet_base.tasks.tasks import _update_transactions
+from wallet_base.triggers import rebuild_balances
+
+UNINDEXED_COLUMNS = import_module(
+    "wallet_base.migrations.0006_wallettransaction_indexes"
+).UNINDEXED_COLUMNS
+LIKE_COLUMNS = ["code", "currency", "object_name", "status"]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Time inserts and the hot WalletTransaction queries of models.py, "
+        "views.py and tasks.py on generated data, alternating the current "
+        "and the old indexes. Everything runs in a transaction that is rolled "
+        "back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--wallets", type=int, default=200)
+        parser.add_argument("--transactions", type=int, default=200000)
+        parser.add_argument("--inserts", type=int, default=500)
+        parser.add_argument("--bulk-rows", type=int, default=20000)
+        parser.add_argument("--repeat", type=int, default=25)
+        parser.add_argument(
+            "--without",
+            action="append",
+            default=[],
+            help="Also compare the current indexes without this one "
+            "(repeatable).",
+        )
+
+    def insert_bulk(self, wallet_ids, transactions):
+        table = WalletTransaction._meta.db_table
+        # Mostly settled history, some credits waiting and a few pending
+        # extractions, spread over a year. The balance trigger is left out
+        # (balances are rebuilt after the seed): within a single transaction
+        # its per-row upserts dominate whatever the indexes are.
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+            start = time.perf_counter()
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (
+                    wallet_id, code, object_id, status, currency, amount,
+                    datetime_available, datetime_expiration, datetime_added
+                )
+                SELECT
+                    (%(wallet_ids)s::bigint[])[1 + i %% %(wallets)s],
+                    md5(random()::text || i),
+                    0,
+                    (ARRAY['x', 'x', 'x', 'a', 'a', 'e', 'c', 'p'])[
+                        1 + (i / %(wallets)s) %% 8
+                    ],
+                    'ARS',
+                    CASE WHEN i %% 97 = 0 THEN -100 ELSE 10 END,
+                    now() + (i %% 720 - 360) * interval '1 day',
+                    now() + (i %% 1440 - 360) * interval '1 day',
+                    now() - (i %% 365) * interval '1 day'
+                FROM generate_series(1, %(transactions)s) i
+                """,
+                {
+                    "wallet_ids": wallet_ids,
+                    "wallets": len(wallet_ids),
+                    "transactions": transactions,
+                },
+            )
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            elapsed = time.perf_counter() - start
+            cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+            cursor.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+
+        return transactions / elapsed
+
+    def seed(self, wallets, transactions):
+        users = User.objects.bulk_create(
+            User(username=f"benchmark_indexes_{i}") for i in range(wallets)
+        )
+        wallet_ids = [
+            wallet.id
+            for wallet in Wallet.objects.bulk_create(
+                Wallet(user=user) for user in users
+            )
+        ]
+        self.insert_bulk(wallet_ids, transactions)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {WalletTransaction._meta.db_table}")
+
+        rebuild_balances(connection)
+        return wallet_ids
+
+    def use_indexes(self, indexes, without):
+        """Rebuild the hot-path indexes but those in without, or the
+        single-column ones they replaced (migration 0006) with
+        indexes="old", for the rest of the transaction.
+
+        Both sets are built afresh every round: indexes kept across rounds
+        would pile up the entries of the rows earlier rounds rolled back."""
+
+        table = WalletTransaction._meta.db_table
+
+        with connection.cursor() as cursor:
+            for index in WalletTransaction._meta.indexes:
+                cursor.execute(f"DROP INDEX {index.name}")
+
+            if indexes == "new":
+                with connection.schema_editor() as schema_editor:
+                    for index in WalletTransaction._meta.indexes:
+                        if index.name not in without:
+                            schema_editor.add_index(WalletTransaction, index)
+            else:
+                for column in UNINDEXED_COLUMNS:
+                    if column != "code":
+                        cursor.execute(
+                            f"CREATE INDEX {table}_{column}_idx "
+                            f"ON {table} ({column})"
+                        )
+
+                # And the LIKE indexes of the indexed varchar columns
+                for column in LIKE_COLUMNS:
+                    cursor.execute(
+                        f"CREATE INDEX {table}_{column}_like "
+                        f"ON {table} ({column} varchar_pattern_ops)"
+                    )
+
+            cursor.execute(f"ANALYZE {table}")
+
+    def insert_one_by_one(self, wallet_ids, inserts):
+        for i in range(inserts):
+            WalletTransaction.objects.create(
+                wallet_id=wallet_ids[i % len(wallet_ids)],
+                status=WalletTransaction.STATUS_AVAILABLE,
+                amount=1,
+                datetime_available=utcnow(),
+                datetime_expiration=utcnow() + timedelta(days=365),
+            )
+
+    def time(self, function):
+        start = time.perf_counter()
+
+        # Savepoint, so statements that write leave the data unchanged
+        try:
+            with transaction.atomic():
+                function()
+                raise Rollback
+        except Rollback:
+            pass
+
+        return (time.perf_counter() - start) * 1000
+
+    def format(self, values):
+        low, median, high = statistics.quantiles(values, n=4)
+        return f"{median:,.2f} (IQR {low:,.2f}-{high:,.2f})"
+
+    def get_queries(self, wallet):
+        history = WalletTransaction.objects.filter(
+            wallet__user=wallet.user,
+            status__in=[
+                WalletTransaction.STATUS_PENDING,
+                WalletTransaction.STATUS_AVAILABLE,
+                WalletTransaction.STATUS_EXPIRED,
+                WalletTransaction.STATUS_PROCESSED,
+            ],
+        ).order_by("-datetime_added", "-id")
+        paginator = KeysetPaginator(history, 50)
+        _, middle_cursor, _ = paginator.page()
+
+        for i in range(10):
+            _, middle_cursor, _ = paginator.page(middle_cursor)
+
+        return [
+            (
+                "models: Wallet.get_balance_summary",
+                lambda: Wallet.get_balance_summary.__wrapped__(wallet),
+            ),
+            (
+                "models: Wallet.get_available_credit",
+                lambda: Wallet.get_available_credit.__wrapped__(wallet),
+            ),
+            ("views: transaction list count", history.count),
+            ("views: transaction list page 1", lambda: list(history[:50])),
+            (
+                "views: transaction list page 20",
+                lambda: list(history[950:1000]),
+            ),
+            (
+                "views: transaction list cursor page 11",
+                lambda: paginator.page(middle_cursor),
+            ),
+            ("tasks: _update_transactions", _update_transactions),
+        ]
+
+    def run_round(self, variant, measurements, results, first):
+        indexes, without = variant
+
+        try:
+            with transaction.atomic():
+                self.use_indexes(indexes, without)
+
+                for name, function, rows in measurements:
+                    # Seconds each, a few runs are enough
+                    if function is _update_transactions and not first:
+                        continue
+
+                    elapsed = self.time(function)
+                    results[name].append(
+                        rows / elapsed * 1000 if rows else elapsed
+                    )
+
+                raise Rollback
+        except Rollback:
+            pass
+
+    def handle(self, *args, **options):
+        variants = {"new": ("new", []), "old": ("old", [])}
+
+        for name in options["without"]:
+            variants[f"new without {name}"] = ("new", [name])
+
+        with transaction.atomic():
+            wallet_ids = self.seed(options["wallets"], options["transactions"])
+            wallet = Wallet.objects.get(pk=wallet_ids[0])
+            measurements = [
+                (
+                    "bulk insert (rows/sec)",
+                    lambda: self.insert_bulk(wallet_ids, options["bulk_rows"]),
+                    options["bulk_rows"],
+                ),
+                (
+                    "single inserts (rows/sec)",
+                    lambda: self.insert_one_by_one(
+                        wallet_ids, options["inserts"]
+                    ),
+                    options["inserts"],
+                ),
+            ] + [
+                (f"{name} (ms)", function, None)
+                for name, function in self.get_queries(wallet)
+            ]
+            results = {
+                variant: {name: [] for name, _, _ in measurements}
+                for variant in variants
+            }
+
+            # The index sets take turns within every round (in a rotating
+            # order), so drift over the run affects them all alike and the
+            # rounds can be compared pairwise
+            for i in range(options["repeat"]):
+                names = list(variants)
+                names = names[i % len(names) :] + names[: i % len(names)]
+
+                for variant in names:
+                    self.run_round(
+                        variants[variant], measurements, results[variant], i < 5
+                    )
+
+                self.stderr.write(f"round {i + 1}/{options['repeat']}")
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"transactions={options['transactions']} "
+            f"wallets={options['wallets']} repeat={options['repeat']}"
+        )
+
+        for name, _, _ in measurements:
+            self.stdout.write(name)
+
+            for variant, values in results.items():
+                line = f"  {variant}: {self.format(values[name])}"
+
+                if variant != "new":
+                    # Median of the per-round ratios to the current indexes
+                    ratio = statistics.median(
+                        value / new
+                        for value, new in zip(
+                            values[name], results["new"][name]
+                        )
+                    )
+                    line += f", x{ratio:.2f} of new"
+
+                self.stdout.write(line)
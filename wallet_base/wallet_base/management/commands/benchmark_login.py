@@ -0,0 +1,148 @@
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from functools import partial
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from wallet_base.models import Wallet
+from wallet_base.views import LoginView, WalletViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Run logins and wallet reads side by side from threads, as a "
+        "threaded worker would, hashing in the request threads and then in "
+        "the hashing pool, and report the throughput and read latency of "
+        "each. A user is created for it and deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--login-threads", type=int, default=4)
+        parser.add_argument("--read-threads", type=int, default=4)
+        parser.add_argument("--seconds", type=float, default=5)
+
+    def get_client(self, token=None):
+        # A host of ALLOWED_HOSTS
+        client = APIClient(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+
+        if token is not None:
+            client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+        return client
+
+    def loop(self, send, deadline, results):
+        try:
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                status_code = send()
+                results.append((status_code, time.perf_counter() - start))
+        finally:
+            connection.close()
+
+    def post(self, client, url, data):
+        return client.post(url, data).status_code
+
+    def get(self, client, url):
+        return client.get(url).status_code
+
+    def run(self, user, password, token, options):
+        logins = []
+        reads = []
+        login_url = reverse("wallet-login")
+        wallet_url = reverse("wallet:wallet-detail", args=["x"])
+        deadline = time.monotonic() + options["seconds"]
+        threads = []
+
+        for i in range(options["login_threads"]):
+            send = partial(
+                self.post,
+                self.get_client(),
+                login_url,
+                {"username": user.username, "password": password},
+            )
+            threads.append(
+                threading.Thread(
+                    target=self.loop, args=(send, deadline, logins)
+                )
+            )
+
+        for i in range(options["read_threads"]):
+            send = partial(self.get, self.get_client(token), wallet_url)
+            threads.append(
+                threading.Thread(target=self.loop, args=(send, deadline, reads))
+            )
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return logins, reads
+
+    def report(self, name, results, seconds):
+        if not results:
+            return f"{name}: none"
+
+        times = sorted(elapsed * 1000 for status_code, elapsed in results)
+        status_codes = Counter(status_code for status_code, _ in results)
+        ok = status_codes[200]
+        counts = ", ".join(
+            f"{code}: {count}" for code, count in sorted(status_codes.items())
+        )
+        return (
+            f"{name}: {ok / seconds:.1f}/sec ok, "
+            f"p50 {statistics.median(times):.1f} ms, "
+            f"p99 {times[int(len(times) * 0.99)]:.1f} ms "
+            f"({counts})"
+        )
+
+    def handle(self, *args, **options):
+        password = uuid.uuid4().hex
+        user = User.objects.create_user(
+            f"benchmark_login_{uuid.uuid4().hex[:8]}", password=password
+        )
+        Wallet.objects.create(user=user)
+        token = Token.objects.create(user=user).key
+        modes = {
+            "hashing in request threads": {"LOGIN_HASH_WORKERS": 0},
+            f"hashing pool ({settings.LOGIN_HASH_WORKERS} workers, "
+            f"queue {settings.LOGIN_HASH_QUEUE})": {},
+        }
+
+        try:
+            with ExitStack() as stack:
+                # Not throttled, only the hashing is compared
+                for view in (LoginView, WalletViewSet):
+                    for throttle in view.throttle_classes:
+                        stack.enter_context(
+                            mock.patch.object(throttle, "rate", "1000000/day")
+                        )
+
+                for name, overrides in modes.items():
+                    with override_settings(**overrides):
+                        logins, reads = self.run(user, password, token, options)
+
+                    seconds = options["seconds"]
+                    self.stdout.write(name)
+                    self.stdout.write(
+                        f"  {self.report('logins', logins, seconds)}"
+                    )
+                    self.stdout.write(
+                        f"  {self.report('wallet reads', reads, seconds)}"
+                    )
+        finally:
+            Wallet.objects.filter(user=user).delete()
+            user.delete()
@@ -0,0 +1,103 @@
+from contextlib import ExitStack
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from redis import Redis
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from wallet_base.models import Wallet
+from wallet_base.views import (
+    WalletExtractionRequestViewSet,
+    WalletTransactionViewSet,
+    WalletViewSet,
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Count Redis commands and database queries per request of the wallet, "
+        "transaction list and extraction request endpoints, for a generated "
+        "user whose token and wallet are already cached. Everything runs in "
+        "a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=100)
+
+    def get_requests(self):
+        wallet_url = reverse("wallet:wallet-detail", args=["x"])
+        return {
+            "GET wallet": lambda client: client.get(wallet_url),
+            "GET transactions": lambda client: client.get(
+                reverse("wallet:transaction-list")
+            ),
+            # Refused, no credit: the validation lookups only
+            "POST request": lambda client: client.post(
+                reverse("wallet:request-list"),
+                {"payment_type": "alias", "nro": "benchmark.alias"},
+            ),
+        }
+
+    def count(self, send, client, requests):
+        commands = []
+        execute_command = Redis.execute_command
+
+        def counted(redis, *args, **options):
+            commands.append(args[0])
+            return execute_command(redis, *args, **options)
+
+        with mock.patch.object(
+            Redis, "execute_command", counted
+        ), CaptureQueriesContext(connection) as queries:
+            for i in range(requests):
+                send(client)
+
+        return len(commands) / requests, len(queries) / requests
+
+    def run(self, requests):
+        user = User.objects.create(username="benchmark_round_trips")
+        Wallet.objects.create(user=user)
+        # A host of ALLOWED_HOSTS
+        client = APIClient(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        client.credentials(
+            HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user).key}"
+        )
+
+        for name, send in self.get_requests().items():
+            # Caches filled by a first request
+            status_code = send(client).status_code
+            commands, queries = self.count(send, client, requests)
+            self.stdout.write(
+                f"{name} ({status_code}): {commands:.2f} Redis commands/request, "
+                f"{queries:.2f} queries/request"
+            )
+
+    def handle(self, *args, **options):
+        with ExitStack() as stack:
+            # Not throttled, the same Redis script runs either way
+            for view in (
+                WalletViewSet,
+                WalletTransactionViewSet,
+                WalletExtractionRequestViewSet,
+            ):
+                for throttle in view.throttle_classes:
+                    stack.enter_context(
+                        mock.patch.object(throttle, "rate", "1000000/day")
+                    )
+
+            try:
+                with transaction.atomic():
+                    self.run(options["requests"])
+                    raise Rollback
+            except Rollback:
+                pass
@@ -0,0 +1,105 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now as utcnow
+from django.utils.timezone import timedelta
+from rest_framework.renderers import JSONRenderer
+
+from wallet_base.models import WalletTransaction
+from wallet_base.serializers import (
+    WalletTransactionSerializer,
+    get_transaction_plan,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows/sec of WalletTransactionSerializer and the compiled "
+        "transaction plan on in-memory rows (no database access)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def build_rows(self, count):
+        now = utcnow()
+        settlement = WalletTransaction(
+            id=1,
+            description="Pedido de extracción",
+            status=WalletTransaction.STATUS_PROCESSED,
+            currency=WalletTransaction.CURRENCY_ARS,
+            amount=-1234.5,
+            datetime_available=now,
+            datetime_expiration=None,
+            datetime_added=now,
+        )
+        settlement.settlement = settlement
+        instances = []
+
+        for i in range(count):
+            instance = WalletTransaction(
+                id=i + 2,
+                description=None if i % 3 else f"credit {i}",
+                status=WalletTransaction.STATUS_AVAILABLE,
+                currency=WalletTransaction.CURRENCY_ARS,
+                amount=i * 1.1,
+                datetime_available=now - timedelta(days=i),
+                datetime_expiration=now + timedelta(days=i),
+                datetime_added=now - timedelta(seconds=i),
+            )
+            instance.settlement = settlement if i % 2 else None
+            instances.append(instance)
+
+        plan = get_transaction_plan()
+        rows = [
+            tuple(self.get_column(instance, column) for column in plan.columns)
+            for instance in instances
+        ]
+        return instances, rows
+
+    def get_column(self, instance, column):
+        prefix = get_transaction_plan().settlement_prefix
+
+        if column.startswith(prefix):
+            instance = instance.settlement
+            column = column[len(prefix) :]
+
+        return None if instance is None else getattr(instance, column)
+
+    def measure(self, function, repeat):
+        best = None
+
+        for i in range(repeat):
+            start = time.perf_counter()
+            data = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        return data, best
+
+    def handle(self, *args, **options):
+        instances, rows = self.build_rows(options["rows"])
+        plan = get_transaction_plan()
+
+        serializer_data, serializer_time = self.measure(
+            lambda: WalletTransactionSerializer(instances, many=True).data,
+            options["repeat"],
+        )
+        plan_data, plan_time = self.measure(
+            lambda: plan.serialize(rows), options["repeat"]
+        )
+
+        renderer = JSONRenderer()
+        identical = renderer.render(serializer_data) == renderer.render(
+            plan_data
+        )
+
+        self.stdout.write(
+            f"rows={options['rows']} identical_output={identical}\n"
+            f"WalletTransactionSerializer: "
+            f"{options['rows'] / serializer_time:,.0f} rows/sec\n"
+            f"WalletTransactionPlan: "
+            f"{options['rows'] / plan_time:,.0f} rows/sec "
+            f"({serializer_time / plan_time:.1f}x)"
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from wallet_base.partitions import MONTHS_AHEAD, create_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly WalletTransaction partitions from the current "
+        "month to --months ahead. Safe to run repeatedly (e.g. daily)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months", type=int, default=MONTHS_AHEAD)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            created = create_partitions(connection, options["months"])
+
+        for partition in created:
+            self.stdout.write(f"created {partition}")
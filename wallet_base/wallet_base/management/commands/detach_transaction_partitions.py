@@ -0,0 +1,75 @@
+import argparse
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from wallet_base.partitions import (
+    detach_partition,
+    get_partitions,
+    get_references,
+    has_open_transactions,
+)
+
+
+def month(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Detach the monthly WalletTransaction partitions older than --before. "
+        "Detached tables are kept, moved to --archive-schema, or dropped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--before", type=month, required=True)
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument("--archive-schema")
+        group.add_argument("--drop", action="store_true")
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Also detach partitions with pending or available rows.",
+        )
+
+    def handle(self, *args, **options):
+        partitions = sorted(
+            (month, name)
+            for month, name in get_partitions(connection).items()
+            if month < options["before"]
+        )
+
+        for _, partition in partitions:
+            # One transaction per partition, the ACCESS EXCLUSIVE lock on the
+            # table is held only while detaching that one
+            with transaction.atomic():
+                if not options["force"] and has_open_transactions(
+                    connection, partition
+                ):
+                    self.stderr.write(
+                        f"skipped {partition}: it has pending or available "
+                        f"transactions"
+                    )
+                    continue
+
+                references = get_references(connection, partition)
+
+                if references:
+                    self.stderr.write(
+                        f"skipped {partition}: referenced from "
+                        f"{', '.join(references)}"
+                    )
+                    continue
+
+                detach_partition(
+                    connection,
+                    partition,
+                    schema=options["archive_schema"],
+                    drop=options["drop"],
+                )
+
+            self.stdout.write(f"detached {partition}")
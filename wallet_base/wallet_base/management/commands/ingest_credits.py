@@ -0,0 +1,67 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from wallet_base.ingest import CHUNK_SIZE, READERS, ingest_credits
+from wallet_base.models import WalletTransaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Add credits from a CSV (with a header) or NDJSON file of "
+        "wallet_number, amount, delta_days and description, through COPY "
+        "and a set-based insert. Use - to read from stdin."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=sorted(READERS))
+        parser.add_argument(
+            "--pending",
+            action="store_true",
+            help="Add pending credits (as add_pending) instead of available.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument(
+            "--per-chunk",
+            action="store_true",
+            help="Commit each chunk on its own instead of all or nothing.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or (
+            "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+        )
+        stream = (
+            sys.stdin
+            if path == "-"
+            else open(path, newline="", encoding="utf-8")
+        )
+
+        with stream:
+            summary = ingest_credits(
+                READERS[file_format](stream),
+                status=(
+                    WalletTransaction.STATUS_PENDING
+                    if options["pending"]
+                    else WalletTransaction.STATUS_AVAILABLE
+                ),
+                chunk_size=options["chunk_size"],
+                atomic=not options["per_chunk"],
+            )
+
+        self.stdout.write(
+            f"rows: {summary['rows']}\n"
+            f"inserted: {summary['inserted']}\n"
+            f"unknown wallets: {len(summary['unknown'])}\n"
+            f"{summary['rows_per_second']:,.0f} rows/sec "
+            f"({summary['seconds']:.2f} s)"
+        )
+
+        if summary["unknown"]:
+            self.stderr.write(
+                "lines with unknown wallets: "
+                + ", ".join(map(str, summary["unknown"][:20]))
+                + (" ..." if len(summary["unknown"]) > 20 else "")
+            )
@@ -0,0 +1,147 @@
+import atexit
+import logging
+import os
+import socket
+import time
+from contextlib import contextmanager
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    delete_from_gateway,
+    push_to_gateway,
+)
+
+logger = logging.getLogger("wallet")
+
+registry = CollectorRegistry()
+
+settlement_phase_seconds = Histogram(
+    "wallet_settlement_phase_seconds",
+    "Duration of each update_transactions phase",
+    ["phase"],
+    registry=registry,
+)
+settlement_rows = Counter(
+    "wallet_settlement_rows",
+    "Transactions changed by each update_transactions phase",
+    ["phase"],
+    registry=registry,
+)
+settlement_backlog = Gauge(
+    "wallet_settlement_backlog",
+    "Transactions due for each phase, at the start and end of the last run",
+    ["phase", "point"],
+    registry=registry,
+)
+settlement_lock_wait_seconds = Histogram(
+    "wallet_settlement_lock_wait_seconds",
+    "Time spent claiming rows (SELECT ... FOR UPDATE SKIP LOCKED)",
+    ["phase"],
+    registry=registry,
+)
+settlement_run_seconds = Histogram(
+    "wallet_settlement_run_seconds",
+    "Duration of a whole update_transactions run",
+    registry=registry,
+)
+settlement_throughput = Gauge(
+    "wallet_settlement_rows_per_second",
+    "Transactions changed per second by the last run",
+    registry=registry,
+)
+settlement_last_run = Gauge(
+    "wallet_settlement_last_run_timestamp_seconds",
+    "End of the last update_transactions run",
+    registry=registry,
+)
+waf_blocked_requests = Counter(
+    "wallet_waf_blocked_requests",
+    "Requests blocked by the AWS WAF, rejected by the middleware or passed on "
+    "to the views (WAF_FAST_REJECT off)",
+    ["action"],
+    registry=registry,
+)
+login_hashing_rejected = Counter(
+    "wallet_login_hashing_rejected",
+    "Password hashes refused because the hashing pool was full",
+    registry=registry,
+)
+middleware_seconds = Histogram(
+    "wallet_middleware_seconds",
+    "Time spent in each middleware, without the ones after it, and in the "
+    "view (MIDDLEWARE_TIMING on)",
+    ["layer"],
+    registry=registry,
+)
+
+
+@contextmanager
+def timed(histogram):
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+# Jobs this process pushed metrics for
+pushed_jobs = set()
+
+
+def get_grouping_key():
+    return {"instance": f"{socket.gethostname()}-{os.getpid()}"}
+
+
+def push_metrics(job):
+    """Push the registry to the Pushgateway in METRICS_PUSHGATEWAY, if any.
+    Celery workers aren't scraped, so they push after each run. Every
+    process pushes its own totals, grouped by instance, and deletes them
+    when it exits (delete_pushed_metrics)."""
+
+    if not settings.METRICS_PUSHGATEWAY:
+        return
+
+    try:
+        push_to_gateway(
+            settings.METRICS_PUSHGATEWAY,
+            job=job,
+            registry=registry,
+            grouping_key=get_grouping_key(),
+        )
+    except Exception:
+        # Metrics must never make the task itself fail
+        logger.warning("metrics push failed", exc_info=True)
+    else:
+        pushed_jobs.add(job)
+
+
+@worker_process_shutdown.connect
+def delete_pushed_metrics(**kwargs):
+    """Delete the groups pushed by this process, otherwise the Pushgateway
+    would keep serving them long after it's gone."""
+
+    if not settings.METRICS_PUSHGATEWAY:
+        return
+
+    while pushed_jobs:
+        job = pushed_jobs.pop()
+
+        try:
+            delete_from_gateway(
+                settings.METRICS_PUSHGATEWAY,
+                job=job,
+                grouping_key=get_grouping_key(),
+            )
+        except Exception:
+            logger.warning("metrics delete failed", exc_info=True)
+
+
+# Pool processes get worker_process_shutdown, solo and threaded workers exit
+# normally
+atexit.register(delete_pushed_metrics)
@@ -1,11 +1,35 @@
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework import exceptions, status
+
+from wallet_base.metrics import waf_blocked_requests
+
+
 class HeaderMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        # What a view answers when AwsWafThrottleMixin refuses the request
+        self.throttled_data = {
+            "detail": str(exceptions.Throttled(wait=0).detail)
+        }
 
     def __call__(self, request):
         # AWS WAF usage by proxy example
         request.META["is_aws_waf_block"] = (
             request.headers.get("x-amzn-waf-rule") == "block"
         )
+
+        if request.META["is_aws_waf_block"]:
+            # Before sessions, authentication and throttles: nothing is read
+            # or written for traffic the WAF already blocked
+            if settings.WAF_FAST_REJECT:
+                waf_blocked_requests.labels("rejected").inc()
+                return JsonResponse(
+                    self.throttled_data,
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
+                )
+
+            waf_blocked_requests.labels("passed").inc()
+
         response = self.get_response(request)
         return response
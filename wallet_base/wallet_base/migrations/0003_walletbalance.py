@@ -0,0 +1,41 @@
+# Generated by Django 4.2.19 on 2026-10-16 23:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from wallet_base.triggers import install_balance_trigger, rebuild_balances
+
+
+def install_and_backfill(apps, schema_editor):
+    install_balance_trigger(schema_editor.connection)
+    rebuild_balances(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wallet_base", "0002_alter_leadpayment_nro"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WalletBalance",
+            fields=[
+                (
+                    "wallet",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="balance",
+                        serialize=False,
+                        to="wallet_base.wallet",
+                    ),
+                ),
+                ("available", models.FloatField(default=0.0)),
+                ("pending", models.FloatField(default=0.0)),
+                ("pending_negative", models.FloatField(default=0.0)),
+                ("paid_off", models.FloatField(default=0.0)),
+            ],
+        ),
+        migrations.RunPython(install_and_backfill, migrations.RunPython.noop),
+    ]
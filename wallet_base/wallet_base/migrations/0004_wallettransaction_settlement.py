@@ -0,0 +1,35 @@
+# Generated by Django 4.2.19 on 2026-10-16 23:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def forwards_settlement(apps, schema_editor):
+    WalletTransaction = apps.get_model("wallet_base", "WalletTransaction")
+    WalletTransaction.objects.filter(
+        object_name="wallet_wallettransaction",
+        object_id__in=WalletTransaction.objects.values("id"),
+    ).update(settlement_id=models.F("object_id"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wallet_base", "0003_walletbalance"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="wallettransaction",
+            name="settlement",
+            field=models.ForeignKey(
+                blank=True,
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="settled_transactions",
+                to="wallet_base.wallettransaction",
+            ),
+        ),
+        migrations.RunPython(forwards_settlement, migrations.RunPython.noop),
+    ]
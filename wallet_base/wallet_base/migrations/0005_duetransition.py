@@ -0,0 +1,94 @@
+# Generated by Django 4.2.19 on 2026-10-16 23:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils.timezone import now as utcnow
+
+
+def backfill_due_transitions(apps, schema_editor):
+    # Only future transitions, update_transactions still applies the ones
+    # already due
+    WalletTransaction = apps.get_model("wallet_base", "WalletTransaction")
+    DueTransition = apps.get_model("wallet_base", "DueTransition")
+    now = utcnow()
+    transitions = [
+        (
+            "s",
+            "datetime_available",
+            Q(status="p", amount__lt=0, datetime_available__gte=now),
+        ),
+        (
+            "a",
+            "datetime_available",
+            Q(status="p", amount__gte=0, datetime_available__gte=now),
+        ),
+        (
+            "e",
+            "datetime_expiration",
+            (Q(status="a") | Q(status="p", amount__gte=0))
+            & Q(datetime_expiration__gte=now),
+        ),
+    ]
+
+    for kind, field, condition in transitions:
+        rows = (
+            WalletTransaction.objects.filter(condition)
+            .values_list("id", field)
+            .iterator(chunk_size=2000)
+        )
+        DueTransition.objects.bulk_create(
+            (
+                DueTransition(
+                    wallet_transaction_id=pk, kind=kind, datetime_due=due
+                )
+                for pk, due in rows
+            ),
+            batch_size=2000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wallet_base", "0004_wallettransaction_settlement"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DueTransition",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("e", "Expire"),
+                            ("a", "Make available"),
+                            ("s", "Settle"),
+                        ],
+                        max_length=1,
+                    ),
+                ),
+                ("datetime_due", models.DateTimeField(db_index=True)),
+                (
+                    "wallet_transaction",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="wallet_base.wallettransaction",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(
+            backfill_due_transitions, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,200 @@
+# Generated by Django 4.2.19 on 2026-10-16 23:50
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+import wallet_base.models
+
+# Columns whose single-column index is replaced by the composite and partial
+# indexes (code keeps its unique index, only the LIKE one goes)
+UNINDEXED_COLUMNS = [
+    "amount",
+    "code",
+    "currency",
+    "datetime_added",
+    "datetime_available",
+    "datetime_expiration",
+    "object_id",
+    "object_name",
+    "status",
+    "wallet_id",
+]
+
+
+def get_single_column_indexes(schema_editor, table):
+    with schema_editor.connection.cursor() as cursor:
+        constraints = schema_editor.connection.introspection.get_constraints(
+            cursor, table
+        )
+
+    return {
+        name: constraint["columns"][0]
+        for name, constraint in constraints.items()
+        if constraint["index"]
+        and not constraint["unique"]
+        and not constraint["primary_key"]
+        and len(constraint["columns"]) == 1
+        and constraint["columns"][0] in UNINDEXED_COLUMNS
+        and not name.startswith("wallet_tx_")
+    }
+
+
+def drop_single_column_indexes(apps, schema_editor):
+    table = apps.get_model("wallet_base", "WalletTransaction")._meta.db_table
+
+    for name in get_single_column_indexes(schema_editor, table):
+        schema_editor.execute(
+            f"DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(name)}"
+        )
+
+
+def create_single_column_indexes(apps, schema_editor):
+    table = apps.get_model("wallet_base", "WalletTransaction")._meta.db_table
+
+    for column in UNINDEXED_COLUMNS:
+        if column == "code":
+            continue
+
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+            f"{schema_editor.quote_name(f'{table}_{column}_idx')} "
+            f"ON {schema_editor.quote_name(table)} "
+            f"({schema_editor.quote_name(column)})"
+        )
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY can't run in a transaction. Neither
+    # blocks writes to the table while it runs.
+    atomic = False
+
+    dependencies = [
+        ("wallet_base", "0005_duetransition"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="wallettransaction",
+            index=models.Index(
+                fields=["wallet", "status"],
+                include=("amount",),
+                name="wallet_tx_wallet_status_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="wallettransaction",
+            index=models.Index(
+                models.F("wallet"),
+                models.OrderBy(models.F("datetime_added"), descending=True),
+                models.OrderBy(models.F("id"), descending=True),
+                name="wallet_tx_wallet_added_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="wallettransaction",
+            index=models.Index(
+                condition=models.Q(("status", "a")),
+                fields=["datetime_expiration"],
+                name="wallet_tx_expiring_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="wallettransaction",
+            index=models.Index(
+                condition=models.Q(("amount__gte", 0), ("status", "p")),
+                fields=["datetime_available"],
+                name="wallet_tx_maturing_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="wallettransaction",
+            index=models.Index(
+                condition=models.Q(("amount__lt", 0), ("status", "p")),
+                fields=["wallet", "datetime_available"],
+                name="wallet_tx_settling_idx",
+            ),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    drop_single_column_indexes, create_single_column_indexes
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="wallettransaction",
+                    name="amount",
+                    field=models.FloatField(),
+                ),
+                migrations.AlterField(
+                    model_name="wallettransaction",
+                    name="code",
+                    field=models.CharField(
+                        default=wallet_base.models.uuid_md5,
+                        max_length=32,
+                        unique=True,
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="wallettransaction",
+                    name="currency",
+                    field=models.CharField(
+                        choices=[("ARS", "Peso - Argentino")],
+                        default="ARS",
+                        max_length=3,
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="wallettransaction",
+                    name="datetime_added",
+                    field=models.DateTimeField(auto_now_add=True),
+                ),
+                migrations.AlterField(
+                    model_name="wallettransaction",
+                    name="datetime_available",
+                    field=models.DateTimeField(blank=True, null=True),
+                ),
+                migrations.AlterField(
+                    model_name="wallettransaction",
+                    name="datetime_expiration",
+                    field=models.DateTimeField(blank=True, null=True),
+                ),
+                migrations.AlterField(
+                    model_name="wallettransaction",
+                    name="object_id",
+                    field=models.IntegerField(blank=True, default=0, null=True),
+                ),
+                migrations.AlterField(
+                    model_name="wallettransaction",
+                    name="object_name",
+                    field=models.CharField(
+                        blank=True, max_length=100, null=True
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="wallettransaction",
+                    name="status",
+                    field=models.CharField(
+                        choices=[
+                            ("p", "Pending"),
+                            ("a", "Available"),
+                            ("e", "Expired"),
+                            ("x", "Processed"),
+                            ("c", "Cancelled"),
+                        ],
+                        max_length=1,
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="wallettransaction",
+                    name="wallet",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        to="wallet_base.wallet",
+                    ),
+                ),
+            ],
+        ),
+    ]
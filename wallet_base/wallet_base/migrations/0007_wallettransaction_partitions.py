@@ -0,0 +1,54 @@
+# Generated by Django 4.2.19 on 2026-10-17 00:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from wallet_base.partitions import is_partitioned, partition_transactions
+
+
+def partition(apps, schema_editor):
+    if not is_partitioned(schema_editor.connection):
+        partition_transactions(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wallet_base", "0006_wallettransaction_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="duetransition",
+            name="wallet_transaction",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="wallet_base.wallettransaction",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="walletextractionrequest",
+            name="wallet_transaction",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="wallet_base.wallettransaction",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="wallettransaction",
+            name="settlement",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="settled_transactions",
+                to="wallet_base.wallettransaction",
+            ),
+        ),
+        # Copies every transaction, with writes to the table blocked meanwhile
+        migrations.RunPython(partition),
+    ]
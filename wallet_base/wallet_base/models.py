@@ -4,10 +4,13 @@ from uuid import uuid4
 from aesfield.field import AESField
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import FloatField, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now as utcnow
 
+from wallet_base.cache import cached_balance
+
 
 def uuid_md5():
     return uuid4().hex
@@ -36,6 +39,14 @@ class LeadPayment(models.Model):
         max_length=10, choices=PAYMENT_TYPE_CHOICES, db_index=True
     )
 
+    nro_censor_length = 5
+
+    def get_censored_nro(self):
+        if self.payment_type == self.PAYMENT_TYPE_ALIAS:
+            return self.nro[: self.nro_censor_length]  # first characters
+
+        return self.nro[-self.nro_censor_length :]  # last characters
+
 
 class WalletTransaction(models.Model):
     STATUS_PENDING = "p"
@@ -55,34 +66,74 @@ class WalletTransaction(models.Model):
     CURRENCY_ARS = "ARS"
     CURRENCY = ((CURRENCY_ARS, "Peso - Argentino"),)
 
-    wallet = models.ForeignKey("Wallet", on_delete=models.PROTECT)
-    code = models.CharField(
-        max_length=32, unique=True, default=uuid_md5, db_index=True
+    # Indexed by the composite indexes below, which all start with it
+    wallet = models.ForeignKey(
+        "Wallet", on_delete=models.PROTECT, db_index=False
     )
+    # Unique together with datetime_added in the database, the partition key,
+    # so only Django's unique validation checks it across months
+    code = models.CharField(max_length=32, unique=True, default=uuid_md5)
     description = models.CharField(
         max_length=250, null=True, blank=True, default=None
     )
-    object_id = models.IntegerField(
-        db_index=True, default=0, null=True, blank=True
+    object_id = models.IntegerField(default=0, null=True, blank=True)
+    object_name = models.CharField(max_length=100, null=True, blank=True)
+    # The table is partitioned (see partitions.py), foreign keys to it are
+    # enforced by Django and by detach_transaction_partitions only
+    settlement = models.ForeignKey(
+        "self",
+        on_delete=models.PROTECT,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        default=None,
+        related_name="settled_transactions",
     )
-    object_name = models.CharField(
-        max_length=100, null=True, blank=True, db_index=True
-    )
-    status = models.CharField(choices=STATUS, max_length=1, db_index=True)
+    status = models.CharField(choices=STATUS, max_length=1)
     currency = models.CharField(
-        choices=CURRENCY, max_length=3, db_index=True, default=CURRENCY_ARS
-    )
-    amount = models.FloatField(db_index=True)
-    datetime_available = models.DateTimeField(
-        null=True, blank=True, db_index=True
-    )
-    datetime_expiration = models.DateTimeField(
-        null=True, blank=True, db_index=True
+        choices=CURRENCY, max_length=3, default=CURRENCY_ARS
     )
-    datetime_added = models.DateTimeField(auto_now_add=True, db_index=True)
+    amount = models.FloatField()
+    datetime_available = models.DateTimeField(null=True, blank=True)
+    datetime_expiration = models.DateTimeField(null=True, blank=True)
+    datetime_added = models.DateTimeField(auto_now_add=True)
 
     class Meta(object):
         app_label = "wallet_base"
+        # One index per hot predicate (status "a" is available, "p" pending)
+        indexes = [
+            # Balances
+            models.Index(
+                fields=["wallet", "status"],
+                include=["amount"],
+                name="wallet_tx_wallet_status_idx",
+            ),
+            # Transaction history, newest first
+            models.Index(
+                "wallet",
+                models.F("datetime_added").desc(),
+                models.F("id").desc(),
+                name="wallet_tx_wallet_added_idx",
+            ),
+            # Expiry
+            models.Index(
+                fields=["datetime_expiration"],
+                condition=Q(status="a"),
+                name="wallet_tx_expiring_idx",
+            ),
+            # Pending credits becoming available
+            models.Index(
+                fields=["datetime_available"],
+                condition=Q(status="p", amount__gte=0),
+                name="wallet_tx_maturing_idx",
+            ),
+            # Settlements due, per wallet
+            models.Index(
+                fields=["wallet", "datetime_available"],
+                condition=Q(status="p", amount__lt=0),
+                name="wallet_tx_settling_idx",
+            ),
+        ]
 
 
 class WalletExtractionRequest(models.Model):
@@ -97,7 +148,7 @@ class WalletExtractionRequest(models.Model):
     )
 
     wallet_transaction = models.ForeignKey(
-        WalletTransaction, on_delete=models.PROTECT
+        WalletTransaction, on_delete=models.PROTECT, db_constraint=False
     )
     datetime_resolution = models.DateTimeField(
         null=True, blank=True, db_index=True
@@ -117,6 +168,44 @@ class WalletExtractionRequest(models.Model):
         ]
 
 
+def _balance_filters(prefix=""):
+    # Same buckets as WalletBalance and the Wallet.get_*_credit methods
+    return {
+        "available": Q(
+            **{f"{prefix}status": WalletTransaction.STATUS_AVAILABLE}
+        ),
+        "pending": Q(**{f"{prefix}status": WalletTransaction.STATUS_PENDING}),
+        "pending_negative": Q(
+            **{
+                f"{prefix}status": WalletTransaction.STATUS_PENDING,
+                f"{prefix}amount__lt": 0,
+            }
+        ),
+        "paid_off": Q(
+            **{
+                f"{prefix}status": WalletTransaction.STATUS_PROCESSED,
+                f"{prefix}amount__lt": 0,
+            }
+        ),
+    }
+
+
+def _balance_aggregates(prefix=""):
+    return {
+        name: Coalesce(
+            Sum(f"{prefix}amount", filter=bucket_filter),
+            Value(0.0),
+            output_field=FloatField(),
+        )
+        for name, bucket_filter in _balance_filters(prefix).items()
+    }
+
+
+class WalletQuerySet(models.QuerySet):
+    def with_balances(self):
+        return self.annotate(**_balance_aggregates("wallettransaction__"))
+
+
 class Wallet(models.Model):
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     datetime_created = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -141,12 +230,28 @@ class Wallet(models.Model):
         max_length=5, null=True, default="es-ar", db_index=True
     )
 
+    objects = WalletQuerySet.as_manager()
+
     class Meta(object):
         app_label = "wallet_base"
 
     def __str__(self):
         return self.wallet_number
 
+    @cached_balance
+    def get_balance_summary(self):
+        return WalletTransaction.objects.filter(wallet=self).aggregate(
+            **_balance_aggregates()
+        )
+
+    def get_balance(self):
+        try:
+            return self.balance
+        except WalletBalance.DoesNotExist:
+            # No transaction was ever written for this wallet
+            return WalletBalance(wallet=self)
+
+    @cached_balance
     def get_available_credit(
         self,
         status=[WalletTransaction.STATUS_AVAILABLE],
@@ -162,6 +267,7 @@ class Wallet(models.Model):
 
         return 0.0
 
+    @cached_balance
     def get_paid_credit_negative(self):
         wt_query = WalletTransaction.objects.filter(
             wallet=self,
@@ -176,6 +282,7 @@ class Wallet(models.Model):
 
         return 0.0
 
+    @cached_balance
     def get_pending_credit(self):
         wt_query = WalletTransaction.objects.filter(
             wallet=self,
@@ -189,6 +296,7 @@ class Wallet(models.Model):
 
         return 0.0
 
+    @cached_balance
     def get_pending_credit_negative(self):
         wt_query = WalletTransaction.objects.filter(
             wallet=self,
@@ -211,16 +319,20 @@ class Wallet(models.Model):
         available_delta_days=0,
         description="created manually",
     ):
-        return self.wallettransaction_set.create(
-            amount=amount,
-            status=WalletTransaction.STATUS_AVAILABLE,
-            datetime_available=utcnow()
-            + relativedelta(days=available_delta_days),
-            datetime_expiration=utcnow()
-            + relativedelta(years=expiration_delta_years),
-            currency=currency,
-            description=description,
-        )
+        with transaction.atomic():
+            wallet_transaction = self.wallettransaction_set.create(
+                amount=amount,
+                status=WalletTransaction.STATUS_AVAILABLE,
+                datetime_available=utcnow()
+                + relativedelta(days=available_delta_days),
+                datetime_expiration=utcnow()
+                + relativedelta(years=expiration_delta_years),
+                currency=currency,
+                description=description,
+            )
+            DueTransition.schedule([wallet_transaction])
+
+        return wallet_transaction
 
     def add_pending(
         self,
@@ -230,15 +342,115 @@ class Wallet(models.Model):
         available_delta_days=0,
         description="created manually",
     ):
-        return self.wallettransaction_set.create(
-            amount=amount,
-            status=WalletTransaction.STATUS_PENDING,
-            datetime_available=utcnow()
-            + relativedelta(days=available_delta_days),
-            datetime_expiration=utcnow()
-            + relativedelta(
-                years=expiration_delta_years, days=available_delta_days
-            ),
-            currency=currency,
-            description=description,
-        )
+        with transaction.atomic():
+            wallet_transaction = self.wallettransaction_set.create(
+                amount=amount,
+                status=WalletTransaction.STATUS_PENDING,
+                datetime_available=utcnow()
+                + relativedelta(days=available_delta_days),
+                datetime_expiration=utcnow()
+                + relativedelta(
+                    years=expiration_delta_years, days=available_delta_days
+                ),
+                currency=currency,
+                description=description,
+            )
+            DueTransition.schedule([wallet_transaction])
+
+        return wallet_transaction
+
+
+class WalletBalance(models.Model):
+    """Per-wallet totals kept up to date by the wallet_balance_apply trigger
+    (see wallet_base.triggers), so every write path updates it in the same
+    transaction, including queryset .update() calls."""
+
+    wallet = models.OneToOneField(
+        Wallet,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="balance",
+    )
+    available = models.FloatField(default=0.0)
+    pending = models.FloatField(default=0.0)
+    pending_negative = models.FloatField(default=0.0)
+    paid_off = models.FloatField(default=0.0)
+
+    class Meta(object):
+        app_label = "wallet_base"
+
+
+class DueTransition(models.Model):
+    """Timer for a status change of a wallet transaction, so the dispatcher
+    only reads what is due instead of scanning every transaction."""
+
+    KIND_EXPIRE = "e"
+    KIND_AVAILABLE = "a"
+    KIND_SETTLE = "s"
+
+    KIND = (
+        (KIND_EXPIRE, "Expire"),
+        (KIND_AVAILABLE, "Make available"),
+        (KIND_SETTLE, "Settle"),
+    )
+
+    wallet_transaction = models.ForeignKey(
+        WalletTransaction, on_delete=models.CASCADE, db_constraint=False
+    )
+    kind = models.CharField(choices=KIND, max_length=1)
+    datetime_due = models.DateTimeField(db_index=True)
+
+    class Meta(object):
+        app_label = "wallet_base"
+
+    @classmethod
+    def get_transitions(cls, wallet_transaction):
+        """(kind, datetime) of the changes update_transactions would
+        eventually apply to the transaction in its current state."""
+
+        status = wallet_transaction.status
+        amount = wallet_transaction.amount
+        transitions = []
+
+        if (
+            status == WalletTransaction.STATUS_PENDING
+            and wallet_transaction.datetime_available is not None
+        ):
+            transitions.append(
+                (
+                    cls.KIND_SETTLE if amount < 0 else cls.KIND_AVAILABLE,
+                    wallet_transaction.datetime_available,
+                )
+            )
+
+        if (
+            status == WalletTransaction.STATUS_AVAILABLE
+            or (status == WalletTransaction.STATUS_PENDING and amount >= 0)
+        ) and wallet_transaction.datetime_expiration is not None:
+            transitions.append(
+                (cls.KIND_EXPIRE, wallet_transaction.datetime_expiration)
+            )
+
+        return transitions
+
+    @classmethod
+    def schedule(cls, wallet_transactions, kinds=None, not_before=None):
+        due_transitions = []
+
+        for wallet_transaction in wallet_transactions:
+            for kind, datetime_due in cls.get_transitions(wallet_transaction):
+                if kinds is not None and kind not in kinds:
+                    continue
+
+                if not_before is not None:
+                    datetime_due = max(datetime_due, not_before)
+
+                due_transitions.append(
+                    cls(
+                        wallet_transaction=wallet_transaction,
+                        kind=kind,
+                        datetime_due=datetime_due,
+                    )
+                )
+
+        return cls.objects.bulk_create(due_transitions)
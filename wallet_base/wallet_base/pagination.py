@@ -0,0 +1,104 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from operator import attrgetter
+
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPaginator:
+    """Pages a queryset on (datetime_added, id), newest first.
+
+    Cursors are opaque to clients: they encode the boundary row and the
+    direction to move in, so every page is an index range scan of page_size
+    rows whatever its depth. key extracts (datetime_added, id) from a row,
+    which lets it page .values_list() querysets too.
+    """
+
+    NEXT = "n"
+    PREVIOUS = "p"
+
+    def __init__(
+        self,
+        queryset,
+        page_size,
+        count_cap=1000,
+        key=attrgetter("datetime_added", "id"),
+    ):
+        self.queryset = queryset
+        self.page_size = page_size
+        self.count_cap = count_cap
+        self.key = key
+
+    def encode_cursor(self, row, direction):
+        datetime_added, pk = self.key(row)
+        payload = json.dumps([datetime_added.isoformat(), pk, direction])
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = base64.urlsafe_b64decode(cursor.encode())
+            datetime_added, pk, direction = json.loads(payload)
+            datetime_added = datetime.fromisoformat(datetime_added)
+            pk = int(pk)
+        except (binascii.Error, TypeError, ValueError) as ex:
+            raise InvalidCursor(cursor) from ex
+
+        if direction not in (self.NEXT, self.PREVIOUS):
+            raise InvalidCursor(cursor)
+
+        return datetime_added, pk, direction
+
+    def page(self, cursor=None):
+        """Return (rows, next_cursor, previous_cursor) for the given cursor,
+        the first page when it is empty."""
+
+        direction = self.NEXT
+        queryset = self.queryset.order_by("-datetime_added", "-id")
+
+        if cursor:
+            datetime_added, pk, direction = self.decode_cursor(cursor)
+
+            if direction == self.NEXT:
+                queryset = queryset.filter(
+                    Q(datetime_added__lt=datetime_added)
+                    | Q(datetime_added=datetime_added, id__lt=pk)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(datetime_added__gt=datetime_added)
+                    | Q(datetime_added=datetime_added, id__gt=pk)
+                ).order_by("datetime_added", "id")
+
+        # One extra row tells whether there is anything past this page
+        rows = list(queryset[: self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+
+        if direction == self.PREVIOUS:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+
+        next_cursor = None
+        previous_cursor = None
+
+        if rows and has_next:
+            next_cursor = self.encode_cursor(rows[-1], self.NEXT)
+
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor(rows[0], self.PREVIOUS)
+
+        return rows, next_cursor, previous_cursor
+
+    def count(self):
+        """Return (count, is_capped), scanning at most count_cap + 1 rows."""
+
+        count = self.queryset.order_by()[: self.count_cap + 1].count()
+        return min(count, self.count_cap), count > self.count_cap
@@ -0,0 +1,324 @@
+import datetime
+
+from wallet_base.cache import bump_wallet_versions
+from wallet_base.models import (
+    DueTransition,
+    WalletExtractionRequest,
+    WalletTransaction,
+)
+from wallet_base.triggers import add_balances_sql, install_balance_trigger
+
+# WalletTransaction is range partitioned by month of datetime_added. Postgres
+# requires the partition key in every unique constraint, so the primary key is
+# (id, datetime_added) and code is unique per datetime_added; id still comes
+# from a single sequence. A foreign key constraint would have to reference
+# (id, datetime_added), so the ForeignKeys pointing at the table use
+# db_constraint=False: Django enforces them for the model API, and
+# detach_partition refuses months that are still referenced. Codes are only
+# unique per datetime_added in the database; across months they rely on
+# being random (uuid4) and on Django's unique validation.
+PARTITION_FORMAT = "{table}_p{month:%Y%m}"
+DEFAULT_PARTITION_FORMAT = "{table}_default"
+MONTHS_AHEAD = 3
+
+# Statuses whose rows still change or count towards a live balance
+OPEN_STATUSES = [
+    WalletTransaction.STATUS_PENDING,
+    WalletTransaction.STATUS_AVAILABLE,
+]
+
+
+def get_table():
+    return WalletTransaction._meta.db_table
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return PARTITION_FORMAT.format(table=get_table(), month=month)
+
+
+def is_partitioned(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+            [get_table()],
+        )
+        row = cursor.fetchone()
+
+    return row is not None and row[0] == "p"
+
+
+def get_partitions(connection):
+    """{month: partition name} of the monthly partitions attached to the
+    table, the default partition left out."""
+
+    prefix = PARTITION_FORMAT.split("{month")[0].format(table=get_table())
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            """,
+            [get_table()],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    return {
+        datetime.datetime.strptime(name[len(prefix) :], "%Y%m").date(): name
+        for name in names
+        if name.startswith(prefix)
+    }
+
+
+def _partition_sql(table, month, partition=None):
+    return (
+        f"CREATE TABLE {partition or partition_name(month)} "
+        f"PARTITION OF {table} FOR VALUES "
+        f"FROM ('{month.isoformat()}') "
+        f"TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def _index_sql(connection, table):
+    from django.db.backends.postgresql.schema import DatabaseSchemaEditor
+
+    editor = DatabaseSchemaEditor(connection, collect_sql=True)
+    statements = [
+        str(index.create_sql(WalletTransaction, editor))
+        for index in WalletTransaction._meta.indexes
+    ]
+    settlement = WalletTransaction._meta.get_field("settlement")
+    statements.append(
+        f"CREATE INDEX {table}_settlement_id_idx "
+        f"ON {table} ({settlement.column})"
+    )
+    return statements
+
+
+def partition_transactions(connection, months_ahead=MONTHS_AHEAD):
+    """Replace the plain WalletTransaction table with a partitioned one
+    holding the same rows, ids and balances. Must run in a transaction."""
+
+    table = get_table()
+    legacy = f"{table}_unpartitioned"
+    wallet = WalletTransaction._meta.get_field("wallet")
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        # Constraints of other tables pointing at the transactions, the
+        # settlement self reference included
+        cursor.execute(
+            """
+            SELECT conrelid::regclass::text, conname FROM pg_constraint
+            WHERE contype = 'f' AND confrelid = %s::regclass
+            """,
+            [legacy],
+        )
+
+        for relation, constraint in cursor.fetchall():
+            cursor.execute(
+                f"ALTER TABLE {relation} DROP CONSTRAINT {constraint}"
+            )
+
+        # Identity columns can't be partitioned (before Postgres 17), the id
+        # sequence carries on from the identity one
+        cursor.execute(
+            "SELECT last_value FROM pg_sequences "
+            "WHERE format('%%I.%%I', schemaname, sequencename)::regclass "
+            "= pg_get_serial_sequence(%s, 'id')::regclass",
+            [legacy],
+        )
+        last_id = cursor.fetchone()[0]
+        cursor.execute(f"ALTER TABLE {legacy} ALTER COLUMN id DROP IDENTITY")
+        cursor.execute(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE (datetime_added)"
+        )
+        cursor.execute(f"CREATE SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        cursor.execute(
+            f"ALTER TABLE {table} "
+            f"ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')"
+        )
+        cursor.execute(
+            f"SELECT setval('{table}_id_seq', "
+            f"COALESCE(GREATEST(MAX(id), %s), 0) + 1, false), "
+            f"MIN(datetime_added) FROM {legacy}",
+            [last_id],
+        )
+        oldest = cursor.fetchone()[1]
+
+        current = month_start(datetime.date.today())
+        month = month_start(oldest) if oldest else current
+
+        while month <= add_months(current, months_ahead):
+            cursor.execute(_partition_sql(table, month))
+            month = add_months(month, 1)
+
+        # Whatever is outside the monthly partitions, until one is created
+        cursor.execute(
+            f"CREATE TABLE {DEFAULT_PARTITION_FORMAT.format(table=table)} "
+            f"PARTITION OF {table} DEFAULT"
+        )
+        # Rows are copied before the balance trigger exists, balances stay as
+        # they are, and constraints and indexes are built once over the
+        # copied rows (their names are free once the old table is gone)
+        cursor.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+        cursor.execute(f"DROP TABLE {legacy}")
+        cursor.execute(
+            f"ALTER TABLE {table} ADD PRIMARY KEY (id, datetime_added)"
+        )
+        cursor.execute(
+            f"ALTER TABLE {table} "
+            f"ADD CONSTRAINT {table}_code_key UNIQUE (code, datetime_added)"
+        )
+        cursor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_wallet_id_fk "
+            f"FOREIGN KEY ({wallet.column}) "
+            f"REFERENCES {wallet.related_model._meta.db_table} (id) "
+            f"DEFERRABLE INITIALLY DEFERRED"
+        )
+
+        for statement in _index_sql(connection, table):
+            cursor.execute(statement)
+
+    install_balance_trigger(connection)
+
+
+def create_partitions(connection, months_ahead=MONTHS_AHEAD, start=None):
+    """Create the missing monthly partitions from start (the current month by
+    default) to months_ahead months later. Rows of those months already in
+    the default partition are moved into the new ones. Returns the names of
+    the partitions created."""
+
+    table = get_table()
+    default = DEFAULT_PARTITION_FORMAT.format(table=table)
+    existing = get_partitions(connection)
+    month = month_start(start or datetime.date.today())
+    last = add_months(month_start(datetime.date.today()), months_ahead)
+    created = []
+
+    with connection.cursor() as cursor:
+        # ALTER TABLE refuses tables with deferred foreign key checks pending
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        while month <= last:
+            if month not in existing:
+                partition = partition_name(month)
+                lower, upper = (
+                    month.isoformat(),
+                    add_months(month, 1).isoformat(),
+                )
+                # The default partition can't stay attached with rows that
+                # belong to the new range. Moving them bypasses the balance
+                # trigger: the rows, and so the totals, don't change.
+                cursor.execute(
+                    f"CREATE TABLE {partition} "
+                    f"(LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                )
+                cursor.execute(f"ALTER TABLE {default} DISABLE TRIGGER USER")
+                cursor.execute(
+                    f"""
+                    WITH moved AS (
+                        DELETE FROM {default}
+                        WHERE datetime_added >= %s AND datetime_added < %s
+                        RETURNING *
+                    )
+                    INSERT INTO {partition} SELECT * FROM moved
+                    """,
+                    [lower, upper],
+                )
+                cursor.execute(f"ALTER TABLE {default} ENABLE TRIGGER USER")
+                cursor.execute(
+                    f"ALTER TABLE {table} ATTACH PARTITION {partition} "
+                    f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+                )
+                created.append(partition)
+
+            month = add_months(month, 1)
+
+    return created
+
+
+def has_open_transactions(connection, partition):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {partition} WHERE status = ANY(%s))",
+            [OPEN_STATUSES],
+        )
+        return cursor.fetchone()[0]
+
+
+def get_references(connection, partition):
+    """Tables with rows that reference transactions of the partition and
+    would be left dangling by detaching it: extraction requests, and
+    transactions of other months settled by one of it."""
+
+    table = get_table()
+    request_table = WalletExtractionRequest._meta.db_table
+    request_column = WalletExtractionRequest._meta.get_field(
+        "wallet_transaction"
+    ).column
+    settlement_column = WalletTransaction._meta.get_field("settlement").column
+    checks = [
+        (
+            request_table,
+            f"SELECT 1 FROM {request_table} r "
+            f"JOIN {partition} p ON p.id = r.{request_column}",
+        ),
+        (
+            table,
+            f"SELECT 1 FROM {table} t "
+            f"JOIN {partition} p ON p.id = t.{settlement_column} "
+            f"WHERE t.tableoid <> '{partition}'::regclass",
+        ),
+    ]
+    references = []
+
+    with connection.cursor() as cursor:
+        for relation, sql in checks:
+            cursor.execute(f"SELECT EXISTS ({sql})")
+
+            if cursor.fetchone()[0]:
+                references.append(relation)
+
+    return references
+
+
+def detach_partition(connection, partition, schema=None, drop=False):
+    """Take a monthly partition out of the table. Its rows leave every query
+    and scan, their totals are taken out of WalletBalance (as
+    rebuild_balances would) and their DueTransitions are deleted. The table
+    is moved to schema, dropped, or kept as a plain table under its own
+    name. Check get_references first."""
+
+    table = get_table()
+    due_table = DueTransition._meta.db_table
+    due_column = DueTransition._meta.get_field("wallet_transaction").column
+
+    with connection.cursor() as cursor:
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute(
+            f"{add_balances_sql(partition, sign='-')} RETURNING b.wallet_id"
+        )
+        bump_wallet_versions(row[0] for row in cursor.fetchall())
+        cursor.execute(
+            f"DELETE FROM {due_table} "
+            f"WHERE {due_column} IN (SELECT id FROM {partition})"
+        )
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {partition}")
+
+        if drop:
+            cursor.execute(f"DROP TABLE {partition}")
+        elif schema:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+            cursor.execute(f"ALTER TABLE {partition} SET SCHEMA {schema}")
@@ -1 +1 @@
-from wallet_base.serializers.serializers import ExtractionSerializer, WalletTransactionSerializer  # noqa
+from wallet_base.serializers.serializers import ExtractionSerializer, WalletTransactionSerializer, get_transaction_plan  # noqa
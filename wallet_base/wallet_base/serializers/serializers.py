@@ -1,9 +1,13 @@
 import logging
+from functools import lru_cache
+from operator import itemgetter
 
 from django.db import transaction
-from django.utils.timezone import get_default_timezone
-from rest_framework import serializers
+from django.utils.timezone import get_default_timezone, is_aware, make_aware
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
+from wallet_base.cache import get_user_wallet_id, get_wallet
 from wallet_base.models import (
     LeadPayment,
     Wallet,
@@ -29,27 +33,123 @@ class WalletTransactionSerializer(serializers.ModelSerializer):
             "amount",
         ] + _datetime_fields
 
-    def __init__(self, *args, transaction_object_map=None, **kwargs):
+    def __init__(self, *args, resolve_settlement=True, **kwargs):
         super().__init__(*args, **kwargs)
 
         for datetime_field in self.Meta._datetime_fields:
             self.fields[datetime_field].timezone = get_default_timezone()
 
-        self.transaction_object_map = transaction_object_map
+        self.resolve_settlement = resolve_settlement
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data["object_serialized"] = None
-        if (
-            self.transaction_object_map is not None
-            and instance.object_name == "wallet_wallettransaction"
-        ):
+        if self.resolve_settlement and instance.settlement_id is not None:
             data["object_serialized"] = WalletTransactionSerializer(
-                self.transaction_object_map[instance.object_id]
+                instance.settlement, resolve_settlement=False
             ).data
         return data
 
 
+class WalletTransactionPlan:
+    """Serializes .values_list() rows exactly like WalletTransactionSerializer.
+
+    Per-field converters are built once per timezone and date format, so
+    serializing a page is a loop over tuples with no DRF field machinery.
+    """
+
+    field_names = WalletTransactionSerializer.Meta.fields
+    settlement_prefix = "settlement__"
+
+    def __init__(self, timezone, datetime_format):
+        self.timezone = timezone
+        self.datetime_format = datetime_format
+        self.columns = (
+            ["id", "datetime_added", "settlement_id"]
+            + self.field_names
+            + [self.settlement_prefix + name for name in self.field_names]
+        )
+        self.key = itemgetter(1, 0)
+        self.converters = self._compile(3)
+        self.settlement_converters = self._compile(3 + len(self.field_names))
+
+    def _to_datetime(self, value):
+        if not value:
+            return None
+
+        if self.datetime_format is None or isinstance(value, str):
+            return value
+
+        if is_aware(value):
+            value = value.astimezone(self.timezone)
+        else:
+            value = make_aware(value, self.timezone)
+
+        if self.datetime_format.lower() == ISO_8601:
+            value = value.isoformat()
+            if value.endswith("+00:00"):
+                value = value[:-6] + "Z"
+            return value
+
+        return value.strftime(self.datetime_format)
+
+    def _compile(self, offset):
+        by_name = {
+            "description": str,
+            "status": str,
+            "currency": str,
+            "amount": float,
+        }
+        converters = []
+
+        for index, name in enumerate(self.field_names, start=offset):
+            converter = by_name.get(name)
+
+            if name in WalletTransactionSerializer.Meta._datetime_fields:
+                converter = self._to_datetime
+
+            converters.append((name, index, converter))
+
+        return converters
+
+    def _convert(self, row, converters):
+        data = {}
+
+        for name, index, converter in converters:
+            value = row[index]
+            data[name] = None if value is None else converter(value)
+
+        return data
+
+    def serialize(self, rows):
+        data = []
+
+        for row in rows:
+            item = self._convert(row, self.converters)
+            item["object_serialized"] = None
+
+            if row[2] is not None:
+                item["object_serialized"] = self._convert(
+                    row, self.settlement_converters
+                )
+                item["object_serialized"]["object_serialized"] = None
+
+            data.append(item)
+
+        return data
+
+
+@lru_cache(maxsize=8)
+def _get_transaction_plan(timezone, datetime_format):
+    return WalletTransactionPlan(timezone, datetime_format)
+
+
+def get_transaction_plan():
+    return _get_transaction_plan(
+        get_default_timezone(), api_settings.DATETIME_FORMAT
+    )
+
+
 class ExtractionSerializer(serializers.ModelSerializer):
     ERROR_ALREADY_ORDERED = "1"
     ERROR_NO_CREDITS_EXTRACT = "2"
@@ -60,18 +160,19 @@ class ExtractionSerializer(serializers.ModelSerializer):
 
     def validate(self, validated_data):
         self.user = self.context["request"].user
-        self.wallet = Wallet.objects.filter(user=self.user).select_related(
-            "payment"
-        )[0]
+        # Cached, only create() needs the row
+        self.wallet = get_wallet(get_user_wallet_id(self.user.pk))
+
+        balance_summary = self.wallet.get_balance_summary()
 
-        if self.wallet.get_pending_credit_negative() != 0:
+        if balance_summary["pending_negative"] != 0:
             raise serializers.ValidationError(
                 {
                     "error_code": [self.ERROR_ALREADY_ORDERED],
                 }
             )
 
-        self.credit_amount = self.wallet.get_available_credit()
+        self.credit_amount = balance_summary["available"]
 
         if self.credit_amount <= 0:
             raise serializers.ValidationError(
@@ -83,12 +184,18 @@ class ExtractionSerializer(serializers.ModelSerializer):
         return validated_data
 
     def create(self, validated_data):
+        self.wallet = Wallet.objects.select_related("payment").get(
+            pk=self.wallet.pk
+        )
+
         if self.wallet.payment is None:
             self.wallet.payment = LeadPayment(user=self.user)
 
         self.wallet.payment.nro = validated_data["nro"]
         self.wallet.payment.payment_type = validated_data["payment_type"]
 
+        # No datetime_available and so no DueTransition: the settle date is
+        # set outside the API, and update_transactions settles it from then
         wallet_transaction = WalletTransaction(
             amount=self.credit_amount * -1,
             description="Pedido de extracción",
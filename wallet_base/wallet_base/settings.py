@@ -47,31 +47,79 @@ REST_FRAMEWORK = {
     ),
 }
 
-MIDDLEWARE = [
-    "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
-    "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
-    "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "wallet_base.middleware.header.HeaderMiddleware",
-]
+MIDDLEWARE_PROFILES = {
+    "full": [
+        # First, so WAF_FAST_REJECT refuses blocked requests before anything
+        # runs
+        "wallet_base.middleware.header.HeaderMiddleware",
+        "django.middleware.security.SecurityMiddleware",
+        "django.contrib.sessions.middleware.SessionMiddleware",
+        "django.middleware.common.CommonMiddleware",
+        "django.middleware.csrf.CsrfViewMiddleware",
+        "django.contrib.auth.middleware.AuthenticationMiddleware",
+        "django.contrib.messages.middleware.MessageMiddleware",
+        "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    ],
+    # Only what the token API needs: DRF authenticates the requests itself
+    # and its views are exempt from CSRF, nothing uses sessions or messages
+    "api": [
+        "wallet_base.middleware.header.HeaderMiddleware",
+        "django.middleware.security.SecurityMiddleware",
+        "django.middleware.common.CommonMiddleware",
+    ],
+}
+
+MIDDLEWARE = MIDDLEWARE_PROFILES[os.getenv("DJANGO_MIDDLEWARE_PROFILE", "full")]
+
+# Records wallet_middleware_seconds, the time spent in each middleware and in
+# the view, by putting a TimingMiddleware around each of them
+MIDDLEWARE_TIMING = os.getenv("MIDDLEWARE_TIMING", "0") == "1"
+
+if MIDDLEWARE_TIMING:
+    MIDDLEWARE = [
+        layer
+        for middleware in MIDDLEWARE
+        for layer in (
+            "wallet_base.middleware.timing.TimingMiddleware",
+            middleware,
+        )
+    ] + ["wallet_base.middleware.timing.TimingMiddleware"]
 
-ROOT_URLCONF = "wallet_base.urls"
+# wallet_base.urls_async serves the read endpoints with async views (ASGI)
+ROOT_URLCONF = os.getenv("DJANGO_ROOT_URLCONF", "wallet_base.urls")
 
 TEMPLATES = []
 
 WSGI_APPLICATION = "wallet_base.wsgi.application"
 
+# DB_POOL=1 takes connections from a pool per process (wallet_base.db) for
+# each request or task. Otherwise each thread keeps its own connection for
+# DB_CONN_MAX_AGE seconds. Either way they're checked before being reused.
+DB_POOL = os.getenv("DB_POOL", "0") == "1"
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": (
+            "wallet_base.db" if DB_POOL else "django.db.backends.postgresql"
+        ),
         "NAME": os.environ["DB_NAME"],
         "USER": os.environ["DB_USER"],
         "PASSWORD": os.environ["DB_PASSWORD"],
         "HOST": os.environ["DB_HOST"],
         "PORT": os.environ["DB_PORT"],
+        "CONN_MAX_AGE": (
+            0 if DB_POOL else int(os.getenv("DB_CONN_MAX_AGE", "60"))
+        ),
+        "CONN_HEALTH_CHECKS": True,
+        "POOL": {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            # Seconds to wait for a connection when max_size are in use
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+            "max_idle": int(os.getenv("DB_POOL_MAX_IDLE", "300")),
+            "max_lifetime": int(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+            "check_after": int(os.getenv("DB_POOL_CHECK_AFTER", "30")),
+        },
     }
 }
 
@@ -96,6 +144,51 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Transactions (wallets, when settling extractions) claimed per short
+# transaction by the update_transactions task
+WALLET_SETTLEMENT_BATCH_SIZE = int(
+    os.getenv("WALLET_SETTLEMENT_BATCH_SIZE", "1000")
+)
+
+# Sub-tasks started by the update_transactions_sharded coordinator
+WALLET_SETTLEMENT_SHARDS = int(os.getenv("WALLET_SETTLEMENT_SHARDS", "8"))
+
+# Metrics of wallet_base.metrics: Celery workers push them to this
+# Pushgateway (host:port) after each run, the API serves its own on /metrics/
+METRICS_PUSHGATEWAY = os.getenv("METRICS_PUSHGATEWAY", "")
+METRICS_ENDPOINT_ENABLED = os.getenv("METRICS_ENDPOINT_ENABLED", "0") == "1"
+
+# Requests the AWS WAF marks as blocked get a 429 from HeaderMiddleware,
+# instead of going through the throttles of each view
+WAF_FAST_REJECT = os.getenv("WAF_FAST_REJECT", "1") == "1"
+
+# Token authentication cache (seconds): entries are shared through Redis for
+# TOKEN_CACHE_TIMEOUT and kept in each process for TOKEN_LOCAL_CACHE_TIMEOUT,
+# the longest a deleted token or deactivated user stays valid elsewhere if
+# the pub/sub invalidation (see LOCAL_CACHE_TIMEOUT) is missed
+TOKEN_CACHE_TIMEOUT = int(os.getenv("TOKEN_CACHE_TIMEOUT", "60"))
+TOKEN_LOCAL_CACHE_TIMEOUT = int(os.getenv("TOKEN_LOCAL_CACHE_TIMEOUT", "5"))
+TOKEN_LOCAL_CACHE_SIZE = int(os.getenv("TOKEN_LOCAL_CACHE_SIZE", "10000"))
+
+# PBKDF2 hashes (logins) run in a pool of LOGIN_HASH_WORKERS threads per
+# process, with LOGIN_HASH_QUEUE more logins waiting; others get a 503. With
+# 0 workers they run in the request thread.
+PASSWORD_HASHERS = [
+    "wallet_base.hashers.PooledPBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+LOGIN_HASH_WORKERS = int(os.getenv("LOGIN_HASH_WORKERS", "1"))
+LOGIN_HASH_QUEUE = int(os.getenv("LOGIN_HASH_QUEUE", "4"))
+
+# Entries kept in each process by the two tier caches of wallet_base.cache
+# (user wallet ids, wallet fields, censored payments). Changes are pushed to
+# every process through Redis pub/sub, the timeout only bounds a missed one.
+LOCAL_CACHE_TIMEOUT = int(os.getenv("LOCAL_CACHE_TIMEOUT", "60"))
+LOCAL_CACHE_SIZE = int(os.getenv("LOCAL_CACHE_SIZE", "10000"))
+
 AES_KEYS = {
     "default": os.path.join(os.environ["AES_KEY_PATH"], "default"),
 }
@@ -104,6 +197,8 @@ AES_METHOD = "aesfield.default"
 # https://sentry.io/welcome/
 LOGGING = {
     "version": 1,
+    # gunicorn's loggers exist before Django is set up (preload_app)
+    "disable_existing_loggers": False,
     "root": {
         "level": "WARNING",
         "handlers": ["sentry"],
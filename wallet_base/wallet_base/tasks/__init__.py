@@ -1 +1 @@
-from wallet_base.tasks.tasks import update_transactions  # noqa
+from wallet_base.tasks.tasks import dispatch_due_transitions, update_transactions, update_transactions_sharded  # noqa
@@ -0,0 +1,144 @@
+from django.db import connection
+
+from wallet_base.models import (
+    Wallet,
+    WalletExtractionRequest,
+    WalletTransaction,
+)
+
+SETTLEMENT_OBJECT_NAME = "wallet_wallettransaction"
+
+
+def settle_transactions_sql():
+    wallet_table = Wallet._meta.db_table
+    transaction_table = WalletTransaction._meta.db_table
+    request_table = WalletExtractionRequest._meta.db_table
+    # Wallets are claimed whole, so a wallet is only ever settled by one
+    # worker and its settlements never split between chunks. SKIP LOCKED
+    # leaves the ones another worker or an extraction request holds for later.
+    # NO KEY UPDATE keeps other settlements out and, unlike FOR UPDATE,
+    # doesn't block the foreign key checks of transactions committed by the
+    # expiry phase meanwhile, which deadlocked with it.
+    # An available transaction belongs to the first settlement (by id) of its
+    # wallet added after it became available, which is the one that claimed
+    # it when settlements were processed one at a time in id order.
+    # Rows are only updated while they still have the status they were
+    # claimed with: one locked and committed meanwhile by the expiry phase is
+    # re-evaluated and left alone, and the counts come from the rows updated.
+    return f"""
+        WITH wallets AS (
+            SELECT w.id
+            FROM {wallet_table} w
+            WHERE EXISTS (
+                SELECT 1
+                FROM {transaction_table} t
+                WHERE t.wallet_id = w.id
+                    AND t.status = %(pending)s
+                    AND t.amount < 0
+                    AND t.datetime_available < %(now)s
+            )
+                AND mod(w.id, %(shards)s) = %(shard)s
+                AND (
+                    %(wallet_ids)s::bigint[] IS NULL
+                    OR w.id = ANY(%(wallet_ids)s::bigint[])
+                )
+            ORDER BY w.id
+            LIMIT %(batch_size)s
+            FOR NO KEY UPDATE SKIP LOCKED
+        ),
+        settlements AS (
+            SELECT id, wallet_id, datetime_added
+            FROM {transaction_table}
+            WHERE status = %(pending)s
+                AND amount < 0
+                AND datetime_available < %(now)s
+                AND wallet_id IN (SELECT id FROM wallets)
+        ),
+        claimed AS (
+            SELECT DISTINCT ON (t.id) t.id, s.id AS settlement_id
+            FROM {transaction_table} t
+            JOIN settlements s
+                ON s.wallet_id = t.wallet_id
+                AND t.datetime_available < s.datetime_added
+            WHERE t.status = %(available)s
+            ORDER BY t.id, s.id
+        ),
+        targets AS (
+            SELECT id, settlement_id, %(available)s AS status FROM claimed
+            UNION ALL
+            SELECT id, id, %(pending)s FROM settlements
+        ),
+        processed AS (
+            UPDATE {transaction_table} t
+            SET status = %(processed)s,
+                object_id = targets.settlement_id,
+                object_name = %(object_name)s,
+                settlement_id = targets.settlement_id
+            FROM targets
+            WHERE t.id = targets.id
+                AND t.status = targets.status
+            RETURNING t.id, t.wallet_id,
+                t.id = targets.settlement_id AS settlement
+        ),
+        requests AS (
+            UPDATE {request_table} r
+            SET status = %(request_processed)s,
+                datetime_resolution = %(resolution)s
+            FROM processed p
+            WHERE r.wallet_transaction_id = p.id
+                AND p.settlement
+            RETURNING p.wallet_id
+        ),
+        counts AS (
+            SELECT wallet_id, settlement::int AS settlements,
+                1 AS transactions, 0 AS requests
+            FROM processed
+            UNION ALL
+            SELECT wallet_id, 0, 0, 1 FROM requests
+        )
+        SELECT wallet_id, sum(settlements), sum(transactions), sum(requests)
+        FROM counts
+        GROUP BY wallet_id
+    """
+
+
+def settle_transactions(
+    now, resolution, batch_size=None, shard=0, shards=1, wallet_ids=None
+):
+    """Settle the pending negative transactions available before now of up to
+    batch_size wallets (all of them when None) in a single statement. Only
+    wallets whose id modulo shards is shard, and that are in wallet_ids when
+    given, are considered.
+
+    Returns {wallet_id: {"settlements", "transactions", "requests"}}, the
+    number of settlements, processed transactions (settlements included) and
+    processed extraction requests of each wallet.
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            settle_transactions_sql(),
+            {
+                "now": now,
+                "batch_size": batch_size,
+                "shard": shard,
+                "shards": shards,
+                "wallet_ids": wallet_ids,
+                "resolution": resolution,
+                "pending": WalletTransaction.STATUS_PENDING,
+                "available": WalletTransaction.STATUS_AVAILABLE,
+                "processed": WalletTransaction.STATUS_PROCESSED,
+                "object_name": SETTLEMENT_OBJECT_NAME,
+                "request_processed": WalletExtractionRequest.STATUS_PROCESSED,
+            },
+        )
+        rows = cursor.fetchall()
+
+    return {
+        wallet_id: {
+            "settlements": settlements,
+            "transactions": transactions,
+            "requests": requests,
+        }
+        for wallet_id, settlements, transactions, requests in rows
+    }
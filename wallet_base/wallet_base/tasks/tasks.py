@@ -1,78 +1,399 @@
+import json
 import logging
+import time
+import uuid
 
-from celery import shared_task
+from celery import group, shared_task
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Q
+from django.db.models.functions import Mod
 from django.utils.timezone import now as utcnow
+from django_redis import get_redis_connection
 
-from wallet_base.models import WalletExtractionRequest, WalletTransaction
+from wallet_base.cache import bump_wallet_versions
+from wallet_base.metrics import (
+    push_metrics,
+    settlement_backlog,
+    settlement_last_run,
+    settlement_lock_wait_seconds,
+    settlement_phase_seconds,
+    settlement_rows,
+    settlement_run_seconds,
+    settlement_throughput,
+    timed,
+)
+from wallet_base.models import DueTransition, WalletTransaction
+from wallet_base.tasks.settlement import settle_transactions
 
 logger = logging.getLogger("wallet")
 
+PHASE_EXPIRE = "expire"
+PHASE_MAKE_AVAILABLE = "make_available"
+PHASE_SETTLE = "settle"
 
-def _update_transactions():
-    now = utcnow()
+SHARDED_RUN_KEY = "update_transactions_sharded_%(run_id)s"
+# Long enough for the slowest shard
+SHARDED_RUN_TIMEOUT = 60 * 60 * 24
+
+
+def _update_in_chunks(queryset, batch_size, phase, **values):
+    updated_number = 0
+
+    while True:
+        # Rows are claimed and updated in short transactions, so other
+        # workers skip them instead of waiting and API writes are never
+        # blocked for long
+        with transaction.atomic():
+            with timed(settlement_lock_wait_seconds.labels(phase)):
+                rows = list(
+                    queryset.select_for_update(skip_locked=True)
+                    .order_by("id")
+                    .values_list("id", "wallet_id")[:batch_size]
+                )
 
-    with transaction.atomic():
-        matched_number_expired = WalletTransaction.objects.filter(
+            if rows:
+                # .update() skips post_save, so the balance cache is bumped
+                # here
+                bump_wallet_versions(wallet_id for _, wallet_id in rows)
+                WalletTransaction.objects.filter(
+                    id__in=[pk for pk, _ in rows]
+                ).update(**values)
+
+        updated_number += len(rows)
+
+        if len(rows) < batch_size:
+            return updated_number
+
+
+def _get_due(transaction_q, now):
+    # One queryset per phase, each matching one of the partial indexes
+    return {
+        PHASE_EXPIRE: transaction_q.filter(
             status=WalletTransaction.STATUS_AVAILABLE,
             datetime_expiration__lt=now,
-        ).update(status=WalletTransaction.STATUS_EXPIRED)
-
-        matched_number_available = WalletTransaction.objects.filter(
+        ),
+        PHASE_MAKE_AVAILABLE: transaction_q.filter(
             status=WalletTransaction.STATUS_PENDING,
             amount__gte=0,
             datetime_available__lt=now,
-        ).update(status=WalletTransaction.STATUS_AVAILABLE)
+        ),
+        PHASE_SETTLE: transaction_q.filter(
+            status=WalletTransaction.STATUS_PENDING,
+            amount__lt=0,
+            datetime_available__lt=now,
+        ),
+    }
+
+
+def _record_backlog(due, point):
+    for phase, queryset in due.items():
+        settlement_backlog.labels(phase, point).set(queryset.count())
+
+
+def _update_transactions(batch_size=None, shard=0, shards=1):
+    """Expire, make available and settle the transactions of the wallets
+    whose id modulo shards is shard (all of them by default)."""
+
+    start = time.perf_counter()
+    now = utcnow()
+    batch_size = batch_size or settings.WALLET_SETTLEMENT_BATCH_SIZE
+    transaction_q = WalletTransaction.objects.all()
+
+    if shards > 1:
+        transaction_q = transaction_q.alias(
+            wallet_shard=Mod("wallet_id", shards)
+        ).filter(wallet_shard=shard)
+
+    due = _get_due(transaction_q, now)
+    _record_backlog(due, "before")
+
+    with timed(settlement_phase_seconds.labels(PHASE_EXPIRE)):
+        matched_number_expired = _update_in_chunks(
+            due[PHASE_EXPIRE],
+            batch_size,
+            PHASE_EXPIRE,
+            status=WalletTransaction.STATUS_EXPIRED,
+        )
 
-    logger.debug(f"expired {matched_number_expired}")
-    logger.debug(f"made available {matched_number_available}")
+    with timed(settlement_phase_seconds.labels(PHASE_MAKE_AVAILABLE)):
+        matched_number_available = _update_in_chunks(
+            due[PHASE_MAKE_AVAILABLE],
+            batch_size,
+            PHASE_MAKE_AVAILABLE,
+            status=WalletTransaction.STATUS_AVAILABLE,
+        )
+
+    logger.debug("expired %s", matched_number_expired)
+    logger.debug("made available %s", matched_number_available)
+
+    settled = {}
+
+    with timed(settlement_phase_seconds.labels(PHASE_SETTLE)):
+        while True:
+            with transaction.atomic():
+                settled_chunk = settle_transactions(
+                    now, utcnow(), batch_size, shard, shards
+                )
+                bump_wallet_versions(settled_chunk)
+
+            settled.update(settled_chunk)
+
+            if len(settled_chunk) < batch_size:
+                break
+
+    settlements, transactions, requests = (
+        sum(counts[key] for counts in settled.values())
+        for key in ("settlements", "transactions", "requests")
+    )
+    _record_backlog(due, "after")
+    settlement_rows.labels(PHASE_EXPIRE).inc(matched_number_expired)
+    settlement_rows.labels(PHASE_MAKE_AVAILABLE).inc(matched_number_available)
+    settlement_rows.labels(PHASE_SETTLE).inc(transactions)
+    elapsed = time.perf_counter() - start
+    settlement_run_seconds.observe(elapsed)
+    settlement_throughput.set(
+        (matched_number_expired + matched_number_available + transactions)
+        / elapsed
+    )
+    settlement_last_run.set_to_current_time()
+
+    summary = {
+        "expired": matched_number_expired,
+        "made_available": matched_number_available,
+        "settled": settled,
+    }
 
-    transaction_q = WalletTransaction.objects.filter(
-        status=WalletTransaction.STATUS_PENDING,
-        amount__lt=0,
-        datetime_available__lt=now,
+    if not settled:
+        return summary
+
+    logger.debug("processing transactions_pending=%s", settlements)
+    logger.debug("processed %s", transactions)
+    logger.debug("processed requests %s", requests)
+    return summary
+
+
+def merge_summaries(summaries):
+    merged = {"expired": 0, "made_available": 0, "settled": {}}
+
+    for summary in summaries:
+        merged["expired"] += summary["expired"]
+        merged["made_available"] += summary["made_available"]
+        # Keys come back as strings once results go through a JSON backend
+        merged["settled"].update(
+            (int(wallet_id), counts)
+            for wallet_id, counts in summary["settled"].items()
+        )
+
+    return merged
+
+
+def _apply_due(queryset, **values):
+    """Update the transactions of queryset, return the (id, wallet_id) of
+    the updated ones."""
+
+    rows = list(
+        queryset.select_for_update()
+        .order_by("id")
+        .values_list("id", "wallet_id")
     )
 
-    for transaction_pending in transaction_q:
-        logger.debug(f"processing transaction_pending={transaction_pending.id}")
-        current_now = utcnow()
+    if rows:
+        bump_wallet_versions(wallet_id for _, wallet_id in rows)
+        WalletTransaction.objects.filter(id__in=[pk for pk, _ in rows]).update(
+            **values
+        )
+
+    return rows
+
+
+def _dispatch_due_transitions(batch_size=None):
+    """Apply the transitions whose DueTransition is due, in the same order
+    and with the same conditions as _update_transactions."""
 
+    now = utcnow()
+    batch_size = batch_size or settings.WALLET_SETTLEMENT_BATCH_SIZE
+    summary = {"expired": 0, "made_available": 0, "settled": {}}
+
+    while True:
         with transaction.atomic():
-            matched_number_transaction = WalletTransaction.objects.filter(
-                Q(
-                    datetime_available__lt=transaction_pending.datetime_added,
-                    wallet_id=transaction_pending.wallet_id,
+            due = list(
+                DueTransition.objects.select_for_update(skip_locked=True)
+                .filter(datetime_due__lt=now)
+                .order_by("datetime_due", "id")
+                .values_list("id", "kind", "wallet_transaction_id")[:batch_size]
+            )
+            DueTransition.objects.filter(
+                id__in=[pk for pk, _, _ in due]
+            ).delete()
+            due_ids = {kind: set() for kind, _ in DueTransition.KIND}
+
+            for _, kind, wallet_transaction_id in due:
+                due_ids[kind].add(wallet_transaction_id)
+
+            expired = _apply_due(
+                WalletTransaction.objects.filter(
+                    id__in=due_ids[DueTransition.KIND_EXPIRE],
                     status=WalletTransaction.STATUS_AVAILABLE,
+                    datetime_expiration__lt=now,
+                ),
+                status=WalletTransaction.STATUS_EXPIRED,
+            )
+            available = _apply_due(
+                WalletTransaction.objects.filter(
+                    id__in=due_ids[DueTransition.KIND_AVAILABLE],
+                    status=WalletTransaction.STATUS_PENDING,
+                    amount__gte=0,
+                    datetime_available__lt=now,
+                ),
+                status=WalletTransaction.STATUS_AVAILABLE,
+            )
+            settle_wallet_ids = list(
+                WalletTransaction.objects.filter(
+                    id__in=due_ids[DueTransition.KIND_SETTLE]
                 )
-                | Q(id=transaction_pending.id)
-            ).update(
-                status=WalletTransaction.STATUS_PROCESSED,
-                object_id=transaction_pending.id,
-                object_name="wallet_wallettransaction",
+                .values_list("wallet_id", flat=True)
+                .distinct()
             )
+            settled = {}
 
-            matched_number_request = (
-                transaction_pending.walletextractionrequest_set.update(
-                    status=WalletExtractionRequest.STATUS_PROCESSED,
-                    datetime_resolution=current_now,
+            if settle_wallet_ids:
+                settled = settle_transactions(
+                    now, utcnow(), wallet_ids=settle_wallet_ids
                 )
+                bump_wallet_versions(settled)
+
+            _reschedule(
+                now,
+                due_ids,
+                {
+                    DueTransition.KIND_EXPIRE: {pk for pk, _ in expired},
+                    DueTransition.KIND_AVAILABLE: {pk for pk, _ in available},
+                    DueTransition.KIND_SETTLE: set(),
+                },
             )
 
-        logger.debug(f"processed {matched_number_transaction}")
-        logger.debug(f"processed requests {matched_number_request}")
+        summary["expired"] += len(expired)
+        summary["made_available"] += len(available)
+        summary["settled"].update(settled)
+
+        if len(due) < batch_size:
+            break
+
+    return summary
+
+
+def _reschedule(now, due_ids, applied_ids):
+    # A transition that didn't apply either no longer matches the
+    # transaction (dropped) or was moved or blocked by a locked wallet, in
+    # which case it is queued again for the next run
+    for kind, wallet_transaction_ids in due_ids.items():
+        wallet_transaction_ids = wallet_transaction_ids - applied_ids[kind]
+
+        if wallet_transaction_ids:
+            DueTransition.schedule(
+                WalletTransaction.objects.filter(id__in=wallet_transaction_ids),
+                kinds=[kind],
+                not_before=now,
+            )
 
 
 @shared_task(ignore_result=True)
-def update_transactions():
+def update_transactions(batch_size=None):
     """Task to be configured to run periodically e.g. using cron or django celery beat."""
 
     logger.info("update transactions STARTED")
 
     try:
-        _update_transactions()
+        _update_transactions(batch_size)
     except Exception:
         logger.exception("update transactions ERROR")
         return
+    finally:
+        push_metrics("update_transactions")
 
     logger.info("update transactions DONE")
+
+
+def _collect_shard_summary(run_id, shards, shard, summary):
+    """Keep the summary of one shard (None if it failed) of a sharded run,
+    the last shard to finish merges them and logs the totals."""
+
+    key = cache.make_key(SHARDED_RUN_KEY % {"run_id": run_id})
+    client = get_redis_connection("default")
+    pipeline = client.pipeline()
+    pipeline.rpush(key, json.dumps({"shard": shard, "summary": summary}))
+    pipeline.expire(key, SHARDED_RUN_TIMEOUT)
+    finished = pipeline.execute()[0]
+
+    if finished < shards:
+        return
+
+    results = [json.loads(result) for result in client.lrange(key, 0, -1)]
+    client.delete(key)
+    merge_update_transactions(
+        [result["summary"] for result in results if result["summary"]],
+        sorted(result["shard"] for result in results if not result["summary"]),
+    )
+
+
+@shared_task(ignore_result=True)
+def update_transactions_shard(run_id, shard, shards, batch_size=None):
+    summary = None
+
+    try:
+        summary = _update_transactions(batch_size, shard, shards)
+    except Exception:
+        logger.exception(f"update transactions shard {shard} ERROR")
+    finally:
+        push_metrics("update_transactions")
+        _collect_shard_summary(run_id, shards, shard, summary)
+
+
+def merge_update_transactions(summaries, failed_shards):
+    summary = merge_summaries(summaries)
+    logger.info(
+        f"update transactions DONE, expired {summary['expired']}, "
+        f"made available {summary['made_available']}, "
+        f"settled wallets {len(summary['settled'])}, "
+        f"failed shards {failed_shards}"
+    )
+    return summary
+
+
+@shared_task(ignore_result=True)
+def update_transactions_sharded(shards=None, batch_size=None):
+    """Coordinator version of update_transactions: splits the wallets in
+    shards by id and processes them in parallel, one sub-task each.
+
+    The shards merge their counts in Redis rather than through a chord, so
+    no result backend is needed, and a failed shard doesn't lose the
+    others' counts.
+    """
+
+    shards = shards or settings.WALLET_SETTLEMENT_SHARDS
+    run_id = uuid.uuid4().hex
+    logger.info(f"update transactions STARTED, {shards} shards")
+    group(
+        update_transactions_shard.s(run_id, shard, shards, batch_size)
+        for shard in range(shards)
+    ).apply_async()
+
+
+@shared_task(ignore_result=True)
+def dispatch_due_transitions(batch_size=None):
+    """Task to be run every few seconds e.g. using django celery beat.
+    update_transactions keeps catching what was changed without scheduling a
+    DueTransition, so it can run much less often."""
+
+    try:
+        summary = _dispatch_due_transitions(batch_size)
+    except Exception:
+        logger.exception("dispatch due transitions ERROR")
+        return
+
+    logger.debug(
+        f"dispatched expired {summary['expired']}, "
+        f"made available {summary['made_available']}, "
+        f"settled wallets {len(summary['settled'])}"
+    )
@@ -1,3 +1,6 @@
+import csv
+import io
+import json
 import os
 from unittest import mock
 
@@ -17,6 +20,7 @@ from wallet_base.models import (
     WalletExtractionRequest,
     WalletTransaction,
 )
+from wallet_base.tasks import update_transactions
 
 
 class WalletTestCase(TestCase):
@@ -102,6 +106,7 @@ class WalletTestCase(TestCase):
         WalletTransaction.objects.filter(code="555").update(
             object_name="wallet_wallettransaction",
             object_id=transaction_base.id,
+            settlement=transaction_base,
         )
         response = self.client.get(reverse("wallet:transaction-list"))
         response_data = response.json()
@@ -119,6 +124,52 @@ class WalletTestCase(TestCase):
             -456789.116,
         )
 
+    def test_transaction_list_settlement_queries(self):
+        self.login()
+        transaction_base = WalletTransaction.objects.get(code="555")
+        settlements = WalletTransaction.objects.bulk_create(
+            [
+                WalletTransaction(
+                    code=f"settlement{i}",
+                    wallet_id=transaction_base.wallet_id,
+                    status=WalletTransaction.STATUS_PROCESSED,
+                    amount=-i,
+                )
+                for i in range(60)
+            ]
+        )
+        WalletTransaction.objects.bulk_create(
+            [
+                WalletTransaction(
+                    code=f"settled{i}",
+                    wallet_id=transaction_base.wallet_id,
+                    status=WalletTransaction.STATUS_PROCESSED,
+                    amount=i,
+                    object_name="wallet_wallettransaction",
+                    object_id=settlement.id,
+                    settlement=settlement,
+                )
+                for i, settlement in enumerate(settlements)
+            ]
+        )
+        self.client.get(reverse("wallet:transaction-list"))
+        # count and the page joined to its settlements (the token is cached)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("wallet:transaction-list"))
+        response_data = response.json()
+        settled = [
+            row
+            for row in response_data["object_list"]
+            if row["object_serialized"] is not None
+        ]
+        self.assertEqual(len(settled), 50)
+        self.assertEqual(
+            settled[0]["object_serialized"]["amount"], -settled[0]["amount"]
+        )
+        self.assertIs(
+            settled[0]["object_serialized"]["object_serialized"], None
+        )
+
     def test_transaction_exclude_cancelled(self):
         self.login()
         WalletTransaction.objects.filter(code="555").update(
@@ -193,6 +244,42 @@ class WalletTestCase(TestCase):
         self.assertEqual(response_data["current_payment_nro"], ".test")
         self.assertEqual(response_data["current_payment_type"], "cbu")
 
+    def test_wallet_not_modified(self):
+        self.login()
+        url = reverse("wallet:wallet-detail", args=["x"])
+        response = self.client.get(url)
+        etag = response["ETag"]
+
+        # no token, wallet or balance read
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+        Wallet.objects.get(code="123").add_available(10)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["available"], 12010.0)
+
+    def test_transaction_list_not_modified(self):
+        self.login()
+        url = reverse("wallet:transaction-list")
+        etag = self.client.get(url)["ETag"]
+        self.assertNotEqual(self.client.get(url, {"page": 2})["ETag"], etag)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        WalletTransaction.objects.filter(code="555").update(
+            datetime_expiration=utcnow()
+        )
+        update_transactions()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["object_list"][0]["status"], "e")
+
     def test_wallet_total_balance(self):
         self.login()
         response_data = self.client.get(
@@ -693,6 +780,132 @@ class WalletTestCase(TestCase):
         self.assertIs(response_data["next_page_number"], None)
         self.assertIs(response_data["previous_page_number"], None)
 
+    def test_request_transaction_cursor_paging(self):
+        self.login()
+
+        transaction_base = WalletTransaction.objects.get(code="555")
+        WalletTransaction.objects.bulk_create(
+            [
+                WalletTransaction(
+                    code=i,
+                    wallet_id=transaction_base.wallet_id,
+                    currency=transaction_base.currency,
+                    status=WalletTransaction.STATUS_AVAILABLE,
+                    amount=i,
+                )
+                for i in range(60)
+            ]
+        )
+        already_in_fixture = 1
+
+        response = self.client.get(
+            reverse("wallet:transaction-list"), {"cursor": ""}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_page = response.json()
+        self.assertEqual(len(first_page["object_list"]), 50)
+        self.assertIs(first_page["prev_cursor"], None)
+        self.assertIsNotNone(first_page["next_cursor"])
+        self.assertIs(first_page["count"], None)
+        self.assertEqual(first_page["page_size"], 50)
+
+        response = self.client.get(
+            reverse("wallet:transaction-list"),
+            {"cursor": first_page["next_cursor"], "count": "1"},
+        )
+        second_page = response.json()
+        self.assertEqual(
+            len(second_page["object_list"]), 10 + already_in_fixture
+        )
+        self.assertIs(second_page["next_cursor"], None)
+        self.assertIsNotNone(second_page["prev_cursor"])
+        self.assertEqual(second_page["count"], 60 + already_in_fixture)
+        self.assertIs(second_page["count_capped"], False)
+        amounts = [
+            row["amount"]
+            for row in first_page["object_list"] + second_page["object_list"]
+        ]
+        self.assertEqual(len(set(amounts)), 60 + already_in_fixture)
+        self.assertEqual(amounts[-1], 12000.0)
+
+        response = self.client.get(
+            reverse("wallet:transaction-list"),
+            {"cursor": second_page["prev_cursor"]},
+        )
+        previous_page = response.json()
+        self.assertEqual(
+            previous_page["object_list"], first_page["object_list"]
+        )
+        self.assertIs(previous_page["prev_cursor"], None)
+        self.assertEqual(
+            previous_page["next_cursor"], first_page["next_cursor"]
+        )
+
+        response = self.client.get(
+            reverse("wallet:transaction-list"), {"cursor": "not-a-cursor"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_transaction_export(self):
+        self.login()
+        transaction_base = WalletTransaction.objects.get(code="555")
+        WalletTransaction.objects.bulk_create(
+            [
+                WalletTransaction(
+                    code=i,
+                    wallet_id=transaction_base.wallet_id,
+                    status=WalletTransaction.STATUS_AVAILABLE,
+                    amount=i,
+                    settlement=transaction_base if i == 0 else None,
+                )
+                for i in range(120)
+            ]
+        )
+        WalletTransaction.objects.filter(code="xxxx").update(
+            status=WalletTransaction.STATUS_AVAILABLE
+        )
+        WalletTransaction.objects.filter(code="1").update(
+            status=WalletTransaction.STATUS_CANCELLED
+        )
+
+        response = self.client.get(reverse("wallet:transaction-export"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 120 + 2 - 1)
+        self.assertEqual(rows, self.export_list_pages())
+        settled = [row for row in rows if row["object_serialized"]]
+        self.assertEqual(len(settled), 1)
+        self.assertEqual(settled[0]["object_serialized"]["amount"], 12000.0)
+
+        response = self.client.get(
+            reverse("wallet:transaction-export"), {"export_format": "csv"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        content = b"".join(response.streaming_content).decode()
+        csv_rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(csv_rows), len(rows))
+        self.assertEqual(csv_rows[0]["amount"], str(rows[0]["amount"]))
+        self.assertEqual(csv_rows[-1]["settlement_amount"], "")
+
+        response = self.client.get(
+            reverse("wallet:transaction-export"), {"export_format": "xml"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def export_list_pages(self):
+        rows = []
+        cursor = ""
+        while cursor is not None:
+            response_data = self.client.get(
+                reverse("wallet:transaction-list"), {"cursor": cursor}
+            ).json()
+            rows.extend(response_data["object_list"])
+            cursor = response_data["next_cursor"]
+        return rows
+
     @mock.patch("wallet_base.serializers.serializers.logger.warning")
     def test_request_transaction_invalid_already_requested(
         self, logger_warning
@@ -750,6 +963,10 @@ class WalletTestCase(TestCase):
         response = self.client.get(reverse("wallet:transaction-list"))
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_transaction_export_auth(self):
+        response = self.client.get(reverse("wallet:transaction-export"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
     def test_wallet_auth(self):
         response = self.client.get(reverse("wallet:wallet-detail", args=["x"]))
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
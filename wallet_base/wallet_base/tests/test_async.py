@@ -0,0 +1,134 @@
+import os
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.testcases import TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from wallet_base.models import Wallet
+from wallet_base.views.async_views import _run_query
+
+
+# The async views query from worker threads with their own connections, which
+# can't see the data of a TestCase transaction
+class AsyncViewTestCase(TransactionTestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.all()[0]
+        self.token = Token.objects.create(user=self.user).key
+        wallet = Wallet.objects.get(code="123")
+
+        for i in range(60):
+            wallet.add_available(i)
+
+    def login(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token}")
+
+    def assertSameAsSync(self, url, data=None):
+        sync_response = self.client.get(url, data)
+
+        with override_settings(ROOT_URLCONF="wallet_base.urls_async"):
+            async_response = self.client.get(url, data)
+
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.json(), sync_response.json())
+        return async_response
+
+    def test_wallet(self):
+        self.login()
+        response = self.assertSameAsSync(
+            reverse("wallet:wallet-detail", args=["x"])
+        )
+        self.assertEqual(response.json()["available"], 12000.0 + 1770.0)
+        self.assertTrue(response.has_header("ETag"))
+
+    def test_transaction_list(self):
+        self.login()
+        url = reverse("wallet:transaction-list")
+        response = self.assertSameAsSync(url)
+        self.assertEqual(response.json()["count"], 61)
+        self.assertEqual(len(response.json()["object_list"]), 50)
+        self.assertSameAsSync(url, {"page": 2})
+        self.assertSameAsSync(url, {"page": "last"})
+        self.assertSameAsSync(url, {"page": 3})
+        self.assertSameAsSync(url, {"page": "x"})
+
+    def test_transaction_list_cursor(self):
+        self.login()
+        url = reverse("wallet:transaction-list")
+        response = self.assertSameAsSync(url, {"cursor": "", "count": "1"})
+        self.assertEqual(response.json()["count"], 61)
+        next_cursor = response.json()["next_cursor"]
+        response = self.assertSameAsSync(url, {"cursor": next_cursor})
+        self.assertEqual(len(response.json()["object_list"]), 11)
+        response = self.assertSameAsSync(url, {"cursor": "x"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(ROOT_URLCONF="wallet_base.urls_async")
+    def test_not_modified(self):
+        self.login()
+        url = reverse("wallet:transaction-list")
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Wallet.objects.get(code="123").add_pending(1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(ROOT_URLCONF="wallet_base.urls_async")
+    def test_auth(self):
+        response = self.client.get(reverse("wallet:transaction-list"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(reverse("wallet:wallet-detail", args=["x"]))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(ROOT_URLCONF="wallet_base.urls_async")
+    async def test_asgi(self):
+        url = reverse("wallet:transaction-list")
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.get(
+            url, {"page": 2}, headers={"authorization": f"Token {self.token}"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["count"], 61)
+        self.assertEqual(len(response.json()["object_list"]), 11)
+
+    def test_query_thread_connection_closed(self):
+        connections = []
+
+        def query():
+            try:
+                _run_query(Wallet.objects.count)
+                connections.append(connection.connection)
+            finally:
+                connection.close()
+
+        # Not left open for CONN_MAX_AGE
+        thread = threading.Thread(target=query)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(connections, [None])
+
+    def test_other_routes(self):
+        for name in ("wallet-login", "wallet-metrics"):
+            self.assertEqual(
+                reverse(name, urlconf="wallet_base.urls_async"), reverse(name)
+            )
@@ -0,0 +1,118 @@
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test.testcases import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from wallet_base.authentication import CachedTokenAuthentication
+from wallet_base.cache import LocalCache, token_cache
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = User.objects.all()[0]
+        self.token = Token.objects.create(user=self.user)
+        self.authentication = CachedTokenAuthentication()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def authenticate(self):
+        return self.authentication.authenticate_credentials(self.token.key)
+
+    def test_cached(self):
+        with self.assertNumQueries(1):
+            user, token = self.authenticate()
+
+        with self.assertNumQueries(0):
+            cached_user, cached_token = self.authenticate()
+
+        self.assertEqual(cached_user, user)
+        self.assertEqual(cached_token, token)
+        # Each request gets its own instance
+        self.assertIsNot(cached_user, self.authenticate()[0])
+
+        token_cache.clear()
+
+        # Still in Redis
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_password_not_cached(self):
+        self.user.set_password("secret")
+        self.user.save()
+        user, token = self.authenticate()
+        cached = cache.get(token_cache.make_key(self.token.key))
+
+        self.assertNotIn(self.user.password.encode(), cached)
+        self.assertNotIn(b"secret", cached)
+
+        with self.assertNumQueries(0):
+            cached_user, cached_token = self.authenticate()
+            self.assertEqual(cached_user.username, self.user.username)
+            self.assertTrue(cached_user.is_active)
+            self.assertEqual(cached_token.key, self.token.key)
+            self.assertIs(cached_token.user, cached_user)
+
+        self.assertIn("password", cached_user.get_deferred_fields())
+
+    def test_token_deleted(self):
+        url = reverse("wallet:wallet-detail", args=["x"])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        self.token.delete()
+
+        self.assertEqual(
+            self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED
+        )
+
+    def test_user_deactivated(self):
+        self.authenticate()
+
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_invalid_token_not_cached(self):
+        for i in range(2):
+            with self.assertNumQueries(1), self.assertRaises(
+                AuthenticationFailed
+            ):
+                self.authentication.authenticate_credentials("invalid")
+
+
+class LocalCacheTestCase(TestCase):
+    @mock.patch("wallet_base.cache.time.monotonic")
+    def test_lru_and_timeout(self, monotonic):
+        monotonic.return_value = 100
+        local_cache = LocalCache(max_size=2, timeout=5)
+        local_cache.set("a", 1)
+        local_cache.set("b", 2)
+        local_cache.get("a")
+        local_cache.set("c", 3)
+
+        # b was the least recently used
+        self.assertIsNone(local_cache.get("b"))
+        self.assertEqual(local_cache.get("a"), 1)
+        self.assertEqual(local_cache.get("c"), 3)
+
+        monotonic.return_value = 106
+        self.assertIsNone(local_cache.get("a"))
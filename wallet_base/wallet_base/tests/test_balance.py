@@ -0,0 +1,170 @@
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.testcases import TestCase
+from django.urls import reverse
+from django.utils.timezone import now as utcnow
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from wallet_base.models import Wallet, WalletBalance, WalletTransaction
+from wallet_base.tasks import update_transactions
+from wallet_base.triggers import rebuild_balances
+
+
+class WalletBalanceTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.wallet = Wallet.objects.get(code="123")
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.all()[0]
+        cls.user.set_password("test")
+        cls.user.save()
+
+    def login(self):
+        response = self.client.post(
+            reverse("wallet-login"),
+            {"username": self.user.username, "password": "test"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Token {response.data['token']}"
+        )
+
+    def assertBalanceMatchesHistory(self):
+        balance = WalletBalance.objects.get(wallet=self.wallet)
+        history = Wallet.objects.with_balances().get(pk=self.wallet.pk)
+        self.assertEqual(balance.available, history.available)
+        self.assertEqual(balance.pending, history.pending)
+        self.assertEqual(balance.pending_negative, history.pending_negative)
+        self.assertEqual(balance.paid_off, history.paid_off)
+
+    def test_fixture_balance(self):
+        balance = WalletBalance.objects.get(wallet=self.wallet)
+        self.assertEqual(balance.available, 12000.0)
+        self.assertEqual(balance.pending, 0.0)
+        self.assertBalanceMatchesHistory()
+
+    def test_add_available_and_pending(self):
+        self.wallet.add_available(100.5)
+        self.wallet.add_pending(30)
+        balance = WalletBalance.objects.get(wallet=self.wallet)
+        self.assertEqual(balance.available, 12100.5)
+        self.assertEqual(balance.pending, 30.0)
+        self.assertBalanceMatchesHistory()
+
+    def test_queryset_update_and_delete(self):
+        WalletTransaction.objects.filter(code="555").update(
+            status=WalletTransaction.STATUS_PENDING, amount=-5
+        )
+        self.assertBalanceMatchesHistory()
+        WalletTransaction.objects.filter(code="555").update(
+            status=WalletTransaction.STATUS_PROCESSED
+        )
+        self.assertBalanceMatchesHistory()
+        self.assertEqual(
+            WalletBalance.objects.get(wallet=self.wallet).paid_off, -5.0
+        )
+        WalletTransaction.objects.filter(code="555").delete()
+        self.assertBalanceMatchesHistory()
+
+    def test_extraction_and_settlement(self):
+        self.login()
+        self.client.post(
+            reverse("wallet:request-list"),
+            {"payment_type": "alias", "nro": "martin.nieva.test"},
+        )
+        balance = WalletBalance.objects.get(wallet=self.wallet)
+        self.assertEqual(balance.pending_negative, -12000.0)
+        self.assertBalanceMatchesHistory()
+        WalletTransaction.objects.filter(
+            status=WalletTransaction.STATUS_PENDING
+        ).update(datetime_available=utcnow())
+        update_transactions()
+        balance = WalletBalance.objects.get(wallet=self.wallet)
+        self.assertEqual(balance.available, 0.0)
+        self.assertEqual(balance.pending_negative, 0.0)
+        self.assertEqual(balance.paid_off, -12000.0)
+        self.assertBalanceMatchesHistory()
+
+    def test_rebuild(self):
+        WalletBalance.objects.all().delete()
+        rebuild_balances(connection)
+        self.assertBalanceMatchesHistory()
+
+    def test_wallet_without_transactions(self):
+        WalletBalance.objects.all().delete()
+        wallet = Wallet.objects.select_related("balance").get(code="123")
+        self.assertEqual(wallet.get_balance().available, 0.0)
+
+    def test_balance_summary(self):
+        self.wallet.add_pending(-30)
+        self.wallet.add_pending(45.5)
+        WalletTransaction.objects.filter(code="xxxx").update(
+            status=WalletTransaction.STATUS_PROCESSED, amount=-200
+        )
+        with self.assertNumQueries(1):
+            summary = self.wallet.get_balance_summary()
+        self.assertEqual(
+            summary,
+            {
+                "available": self.wallet.get_available_credit(),
+                "pending": self.wallet.get_pending_credit(),
+                "pending_negative": self.wallet.get_pending_credit_negative(),
+                "paid_off": self.wallet.get_paid_credit_negative(),
+            },
+        )
+        self.assertEqual(summary["pending"], 15.5)
+        self.assertEqual(summary["paid_off"], -200.0)
+
+    def test_with_balances(self):
+        other_wallet = Wallet.objects.create(
+            user=User.objects.create(username="other")
+        )
+        other_wallet.add_available(7)
+        with self.assertNumQueries(1):
+            wallets = {
+                wallet.code: wallet
+                for wallet in Wallet.objects.with_balances().order_by("id")
+            }
+        self.assertEqual(wallets["123"].available, 12000.0)
+        self.assertEqual(wallets["123"].pending, 0.0)
+        self.assertEqual(wallets[other_wallet.code].available, 7.0)
+        self.assertEqual(wallets[other_wallet.code].paid_off, 0.0)
+
+    def test_retrieve_query_count_independent_of_history(self):
+        self.login()
+        url = reverse("wallet:wallet-detail", args=["x"])
+        self.client.get(url)
+        # wallet with payment and balance by primary key (the token is cached)
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        WalletTransaction.objects.bulk_create(
+            [
+                WalletTransaction(
+                    wallet=self.wallet,
+                    code=f"bulk{i}",
+                    status=WalletTransaction.STATUS_AVAILABLE,
+                    amount=1,
+                )
+                for i in range(100)
+            ]
+        )
+        with self.assertNumQueries(1):
+            response_data = self.client.get(url).json()
+        self.assertEqual(response_data["available"], 12100.0)
@@ -0,0 +1,176 @@
+import json
+import os
+import pickle
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test.testcases import TestCase
+from django.utils.timezone import now as utcnow
+from django_redis import get_redis_connection
+
+from wallet_base.cache import (
+    INVALIDATION_CHANNEL,
+    get_balance_cache_stats,
+    get_censored_payment,
+    get_user_wallet_id,
+    get_wallet,
+    get_wallet_version,
+    payment_cache,
+    user_wallet_cache,
+    wallet_cache,
+)
+from wallet_base.models import LeadPayment, Wallet, WalletTransaction
+from wallet_base.tasks import update_transactions
+
+
+class BalanceCacheTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.wallet = Wallet.objects.get(code="123")
+
+    def test_hit_and_miss(self):
+        stats = get_balance_cache_stats()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.wallet.get_available_credit(), 12000.0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.wallet.get_available_credit(), 12000.0)
+        new_stats = get_balance_cache_stats()
+        self.assertEqual(new_stats["miss"], stats["miss"] + 1)
+        self.assertEqual(new_stats["hit"], stats["hit"] + 1)
+
+    def test_explicit_status_not_cached(self):
+        self.wallet.get_available_credit()
+        with self.assertNumQueries(1):
+            self.wallet.get_available_credit(
+                status=[WalletTransaction.STATUS_CANCELLED]
+            )
+
+    def test_invalidated_by_save(self):
+        self.assertEqual(self.wallet.get_pending_credit(), 0.0)
+        version = get_wallet_version(self.wallet.pk)
+        self.wallet.add_pending(10)
+        self.assertNotEqual(get_wallet_version(self.wallet.pk), version)
+        self.assertEqual(self.wallet.get_pending_credit(), 10.0)
+        transaction = WalletTransaction.objects.get(code="555")
+        transaction.amount = 11000
+        transaction.save()
+        self.assertEqual(self.wallet.get_available_credit(), 11000.0)
+        transaction.delete()
+        self.assertEqual(self.wallet.get_available_credit(), 0.0)
+
+    def test_invalidated_by_task(self):
+        transaction = self.wallet.add_pending(10)
+        WalletTransaction.objects.filter(pk=transaction.pk).update(
+            datetime_available=utcnow()
+        )
+        self.assertEqual(self.wallet.get_pending_credit(), 10.0)
+        self.assertEqual(self.wallet.get_available_credit(), 12000.0)
+        update_transactions()
+        self.assertEqual(self.wallet.get_pending_credit(), 0.0)
+        self.assertEqual(self.wallet.get_available_credit(), 12010.0)
+
+    def test_version_restarts_after_eviction(self):
+        version = get_wallet_version(self.wallet.pk)
+        cache.delete(f"wallet_version_{self.wallet.pk}")
+        self.assertNotEqual(get_wallet_version(self.wallet.pk), version)
+
+
+class TwoTierCacheTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        cache.clear()
+
+        for two_tier_cache in (user_wallet_cache, wallet_cache, payment_cache):
+            two_tier_cache.clear()
+
+        self.wallet = Wallet.objects.get(code="123")
+        self.client = get_redis_connection("default")
+
+    def test_local_hit(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_wallet_id(self.wallet.user_id), 1)
+
+        with mock.patch.object(
+            self.client, "execute_command", wraps=self.client.execute_command
+        ) as execute_command, self.assertNumQueries(0):
+            self.assertEqual(get_user_wallet_id(self.wallet.user_id), 1)
+
+        execute_command.assert_not_called()
+        user_wallet_cache.clear()
+
+        # Still in Redis
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_wallet_id(self.wallet.user_id), 1)
+
+    def test_invalidated_by_other_process(self):
+        self.assertEqual(get_user_wallet_id(self.wallet.user_id), 1)
+        key = user_wallet_cache.make_key(self.wallet.user_id)
+        # What invalidate() does in another process after a change
+        cache.set(key, pickle.dumps(2))
+        self.client.publish(
+            INVALIDATION_CHANNEL,
+            json.dumps({"prefix": user_wallet_cache.prefix, "keys": [key]}),
+        )
+        deadline = time.monotonic() + 5
+
+        while get_user_wallet_id(self.wallet.user_id) != 2:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_wallet(self):
+        with self.assertNumQueries(1):
+            wallet = get_wallet(self.wallet.pk)
+
+        self.assertEqual(wallet.pk, self.wallet.pk)
+        self.assertEqual(wallet.wallet_number, self.wallet.wallet_number)
+        self.assertIsNone(wallet.payment_id)
+
+        payment = LeadPayment.objects.create(
+            user=self.wallet.user,
+            nro="1234567890",
+            payment_type=LeadPayment.PAYMENT_TYPE_CBU,
+        )
+        self.wallet.payment = payment
+        self.wallet.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_wallet(self.wallet.pk).payment_id, payment.pk)
+
+        with self.assertNumQueries(0):
+            get_wallet(self.wallet.pk)
+
+    def test_censored_payment(self):
+        payment = LeadPayment.objects.create(
+            user=self.wallet.user,
+            nro="martin.nieva",
+            payment_type=LeadPayment.PAYMENT_TYPE_ALIAS,
+        )
+        self.assertEqual(get_censored_payment(payment.pk), ("marti", "alias"))
+        # Only the censored nro is stored
+        self.assertEqual(
+            pickle.loads(cache.get(payment_cache.make_key(payment.pk))),
+            ("marti", "alias"),
+        )
+
+        payment.nro = "1234567890"
+        payment.payment_type = LeadPayment.PAYMENT_TYPE_CBU
+        payment.save()
+
+        self.assertEqual(get_censored_payment(payment.pk), ("67890", "cbu"))
@@ -0,0 +1,142 @@
+import copy
+from unittest import mock
+
+from django.db import connection
+from django.db.utils import load_backend
+from django.test.testcases import TestCase
+
+from wallet_base.db.pool import (
+    ConnectionPool,
+    PoolTimeout,
+    close_pools,
+    inherited,
+)
+
+
+class ConnectionPoolTestCase(TestCase):
+    def setUp(self):
+        settings_dict = copy.deepcopy(connection.settings_dict)
+        settings_dict["ENGINE"] = "wallet_base.db"
+        settings_dict["CONN_MAX_AGE"] = 0
+        settings_dict["POOL"] = {"min_size": 1, "max_size": 2}
+        self.wrapper = load_backend("wallet_base.db").DatabaseWrapper(
+            settings_dict, "pool_test"
+        )
+        self.params = self.wrapper.get_connection_params()
+
+    def tearDown(self):
+        self.wrapper.close()
+        close_pools()
+
+    def connect(self):
+        return self.wrapper.Database.connect(**self.params)
+
+    def get_pid(self, raw_connection):
+        with raw_connection.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            return cursor.fetchone()[0]
+
+    def test_wrapper_reuses_connection(self):
+        self.wrapper.ensure_connection()
+        raw_connection = self.wrapper.connection
+        pid = self.get_pid(raw_connection)
+        # What the end of a request does
+        self.wrapper.close_if_unusable_or_obsolete()
+        self.assertIsNone(self.wrapper.connection)
+        self.assertFalse(raw_connection.closed)
+
+        self.wrapper.ensure_connection()
+
+        self.assertIs(self.wrapper.connection, raw_connection)
+        self.assertEqual(self.get_pid(self.wrapper.connection), pid)
+        self.assertEqual(
+            self.wrapper.get_pool().stats(), {"size": 1, "idle": 0}
+        )
+
+    def test_transaction_rolled_back(self):
+        self.wrapper.ensure_connection()
+        self.wrapper.set_autocommit(False)
+
+        with self.wrapper.cursor() as cursor:
+            cursor.execute("CREATE TEMPORARY TABLE pool_test (id int)")
+
+        self.wrapper.close()
+        self.wrapper.ensure_connection()
+
+        self.assertTrue(self.wrapper.get_autocommit())
+
+        with self.wrapper.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('pool_test')")
+            self.assertIsNone(cursor.fetchone()[0])
+
+    def test_max_size(self):
+        pool = ConnectionPool(max_size=2, timeout=0.05)
+        first = pool.get(self.connect)
+        pool.get(self.connect)
+
+        with self.assertRaises(PoolTimeout):
+            pool.get(self.connect)
+
+        pool.put(first)
+        self.assertIs(pool.get(self.connect), first)
+        pool.close()
+
+    def test_health_check(self):
+        pool = ConnectionPool(check_after=0)
+        raw_connection = pool.get(self.connect)
+        pool.put(raw_connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_terminate_backend(%s)",
+                [self.get_pid(raw_connection)],
+            )
+
+        new_connection = pool.get(self.connect)
+
+        self.assertIsNot(new_connection, raw_connection)
+        self.assertTrue(raw_connection.closed)
+        self.assertEqual(pool.stats(), {"size": 1, "idle": 0})
+        pool.put(new_connection)
+        pool.close()
+
+    @mock.patch("wallet_base.db.pool.time.monotonic")
+    def test_idle_recycling(self, monotonic):
+        monotonic.return_value = 100
+        pool = ConnectionPool(min_size=1, max_idle=60, max_lifetime=300)
+        connections = [pool.get(self.connect) for i in range(3)]
+
+        for raw_connection in connections[:2]:
+            pool.put(raw_connection)
+
+        self.assertEqual(pool.stats(), {"size": 3, "idle": 2})
+
+        monotonic.return_value = 200
+        pool.put(connections[2])
+
+        # The two idle since 100 closed, down to min_size
+        self.assertEqual(pool.stats(), {"size": 1, "idle": 1})
+        self.assertTrue(connections[0].closed)
+        self.assertTrue(connections[1].closed)
+
+        monotonic.return_value = 500
+        raw_connection = pool.get(self.connect)
+        pool.put(raw_connection)
+
+        # Older than max_lifetime
+        self.assertTrue(raw_connection.closed)
+        self.assertEqual(pool.stats(), {"size": 0, "idle": 0})
+
+    def test_forked(self):
+        self.wrapper.ensure_connection()
+        raw_connection = self.wrapper.connection
+        self.wrapper.pid = -1
+
+        self.wrapper.close()
+
+        self.assertIn(raw_connection, inherited)
+        self.assertEqual(
+            self.wrapper.get_pool().stats(), {"size": 1, "idle": 0}
+        )
+        inherited.remove(raw_connection)
+        raw_connection.close()
@@ -0,0 +1,173 @@
+import io
+import json
+import os
+import tempfile
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DataError, connection
+from django.test.testcases import TestCase
+from django.utils.timezone import now as utcnow
+
+from wallet_base.ingest import ingest_credits, read_csv, read_ndjson
+from wallet_base.models import (
+    DueTransition,
+    Wallet,
+    WalletBalance,
+    WalletTransaction,
+)
+from wallet_base.triggers import rebuild_balances
+
+
+class IngestCreditsTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        self.wallet = Wallet.objects.get(code="123")
+        self.other = Wallet.objects.create(
+            user=User.objects.create(username="other")
+        )
+        self.now = utcnow()
+
+    def get_balances(self):
+        return list(WalletBalance.objects.order_by("wallet_id").values())
+
+    def assertBalancesRebuilt(self):
+        balances = self.get_balances()
+        rebuild_balances(connection)
+        self.assertEqual(self.get_balances(), balances)
+
+    def assertScheduled(self, wallet_transactions):
+        for wallet_transaction in wallet_transactions:
+            self.assertCountEqual(
+                DueTransition.objects.filter(
+                    wallet_transaction=wallet_transaction
+                ).values_list("kind", "datetime_due"),
+                DueTransition.get_transitions(wallet_transaction),
+            )
+
+    def test_csv(self):
+        available = self.wallet.get_available_credit()
+        stream = io.StringIO(
+            "wallet_number,amount,delta_days,description\n"
+            f"{self.wallet.wallet_number},10,0,campaign\n"
+            "missing,5,0,nobody\n"
+            f"{self.other.wallet_number},7.5,,partner\n"
+        )
+
+        summary = ingest_credits(read_csv(stream), now=self.now)
+
+        self.assertEqual(summary["rows"], 3)
+        self.assertEqual(summary["inserted"], 2)
+        self.assertEqual(summary["unknown"], [2])
+        self.assertGreater(summary["rows_per_second"], 0)
+
+        credit = self.wallet.wallettransaction_set.get(description="campaign")
+        self.assertEqual(credit.status, WalletTransaction.STATUS_AVAILABLE)
+        self.assertEqual(credit.amount, 10)
+        self.assertEqual(credit.datetime_available, self.now)
+        self.assertEqual(
+            credit.datetime_expiration, self.now + relativedelta(years=3)
+        )
+        self.assertEqual(len(credit.code), 32)
+        self.assertEqual(self.wallet.get_available_credit(), available + 10)
+        self.assertEqual(self.other.get_available_credit(), 7.5)
+        self.assertScheduled(
+            WalletTransaction.objects.filter(datetime_added=self.now)
+        )
+        self.assertBalancesRebuilt()
+
+    def test_ndjson_pending_per_chunk(self):
+        rows = [
+            {"wallet_number": self.wallet.wallet_number, "amount": 1},
+            {
+                "wallet_number": self.other.wallet_number,
+                "amount": 2,
+                "delta_days": 5,
+            },
+            {
+                "wallet_number": self.other.wallet_number,
+                "amount": -1,
+                "delta_days": 1,
+            },
+        ]
+        stream = io.StringIO("\n".join(json.dumps(row) for row in rows))
+
+        summary = ingest_credits(
+            read_ndjson(stream),
+            status=WalletTransaction.STATUS_PENDING,
+            chunk_size=2,
+            atomic=False,
+            now=self.now,
+        )
+
+        self.assertEqual(summary["inserted"], 3)
+        credit = self.other.wallettransaction_set.get(amount=2)
+        self.assertEqual(credit.status, WalletTransaction.STATUS_PENDING)
+        self.assertEqual(
+            credit.datetime_available, self.now + relativedelta(days=5)
+        )
+        self.assertEqual(
+            credit.datetime_expiration,
+            self.now + relativedelta(years=3, days=5),
+        )
+        self.assertEqual(self.other.get_pending_credit(), 1)
+        self.assertEqual(self.other.get_pending_credit_negative(), -1)
+        self.assertScheduled(self.other.wallettransaction_set.all())
+        self.assertBalancesRebuilt()
+
+    def test_all_or_nothing(self):
+        rows = [
+            [self.wallet.wallet_number, 1, 0, "first"],
+            [self.wallet.wallet_number, "bad", 0, "second"],
+        ]
+        balances = self.get_balances()
+
+        with self.assertRaises(DataError):
+            ingest_credits(iter(rows), chunk_size=1)
+
+        self.assertFalse(
+            WalletTransaction.objects.filter(description="first").exists()
+        )
+        self.assertEqual(self.get_balances(), balances)
+
+    def test_per_chunk(self):
+        rows = [
+            [self.wallet.wallet_number, 1, 0, "first"],
+            [self.wallet.wallet_number, "bad", 0, "second"],
+        ]
+
+        with self.assertRaises(DataError):
+            ingest_credits(iter(rows), chunk_size=1, atomic=False)
+
+        # The first chunk is kept
+        self.assertTrue(
+            WalletTransaction.objects.filter(description="first").exists()
+        )
+        self.assertBalancesRebuilt()
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson") as file:
+            file.write(
+                json.dumps(
+                    {"wallet_number": self.wallet.wallet_number, "amount": 3}
+                )
+            )
+            file.flush()
+            out = io.StringIO()
+            call_command("ingest_credits", file.name, "--pending", stdout=out)
+
+        self.assertIn("inserted: 1", out.getvalue())
+        self.assertIn("rows/sec", out.getvalue())
+        self.assertEqual(
+            self.wallet.wallettransaction_set.get(amount=3).status,
+            WalletTransaction.STATUS_PENDING,
+        )
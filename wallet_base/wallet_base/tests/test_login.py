@@ -0,0 +1,155 @@
+import base64
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from django.test.testcases import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from wallet_base.cache import user_token_cache
+from wallet_base.hashers import PooledPBKDF2PasswordHasher, get_hashing_pool
+from wallet_base.metrics import registry
+from wallet_base.views.views import LoginThrottle, LoginThrottleUsername
+
+
+class LoginTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        cache.clear()
+        user_token_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.all()[0]
+        self.user.set_password("test")
+        self.user.save()
+
+    def login(self, password="test", username=None, **extra):
+        return self.client.post(
+            reverse("wallet-login"),
+            {"username": username or self.user.username, "password": password},
+            **extra,
+        )
+
+    def test_token(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.login()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = Token.objects.get(user=self.user)
+        self.assertEqual(response.data["token"], token.key)
+
+        # The user's lookup only
+        with self.assertNumQueries(1):
+            self.assertEqual(self.login().data["token"], token.key)
+
+        token.delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            key = self.login().data["token"]
+
+        self.assertNotEqual(key, token.key)
+        self.assertEqual(Token.objects.get(user=self.user).key, key)
+
+    def test_username_throttled_before_hashing(self):
+        with mock.patch.object(
+            PooledPBKDF2PasswordHasher,
+            "encode",
+            autospec=True,
+            side_effect=PooledPBKDF2PasswordHasher.encode,
+        ) as encode:
+            for i in range(10):
+                response = self.login("wrong", REMOTE_ADDR=f"10.0.0.{i}")
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+
+            response = self.login(REMOTE_ADDR="10.0.1.1")
+
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(encode.call_count, 10)
+        # Other usernames aren't
+        response = self.login(username="other", REMOTE_ADDR="10.0.1.1")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch.object(LoginThrottle, "rate", "0/min")
+    @mock.patch.object(LoginThrottleUsername, "rate", "0/min")
+    def test_basic_authentication_not_hashed(self):
+        credentials = base64.b64encode(
+            f"{self.user.username}:test".encode()
+        ).decode()
+
+        with mock.patch.object(
+            PooledPBKDF2PasswordHasher, "encode", autospec=True
+        ) as encode:
+            response = self.login(HTTP_AUTHORIZATION=f"Basic {credentials}")
+
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        encode.assert_not_called()
+
+    def test_list_body(self):
+        response = self.client.post(
+            reverse("wallet-login"), [self.user.username], format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ip_throttled(self):
+        for i in range(20):
+            self.login("wrong", username=f"user{i}")
+
+        response = self.login()
+
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        response = self.login(REMOTE_ADDR="10.0.1.1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(LOGIN_HASH_WORKERS=1, LOGIN_HASH_QUEUE=1)
+    def test_hashing_pool_full(self):
+        pool = get_hashing_pool()
+        rejected = (
+            registry.get_sample_value("wallet_login_hashing_rejected_total")
+            or 0.0
+        )
+
+        # Two logins hashing or waiting for the pool
+        for i in range(2):
+            pool.slots.acquire()
+
+        try:
+            response = self.login()
+        finally:
+            for i in range(2):
+                pool.slots.release()
+
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertEqual(
+            registry.get_sample_value("wallet_login_hashing_rejected_total"),
+            rejected + 1,
+        )
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+    @override_settings(LOGIN_HASH_WORKERS=0)
+    def test_hashing_in_request_thread(self):
+        self.assertIsNone(get_hashing_pool())
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.assertTrue(self.user.check_password("test"))
@@ -0,0 +1,132 @@
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.testcases import TestCase
+from django.urls import reverse
+from rest_framework import status
+
+from wallet_base.metrics import delete_pushed_metrics, registry
+from wallet_base.models import Wallet
+from wallet_base.tasks import update_transactions
+
+
+class SettlementMetricsTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def get_sample(self, name, **labels):
+        return registry.get_sample_value(name, labels) or 0.0
+
+    def test_phase_metrics(self):
+        wallet = Wallet.objects.get(code="123")
+        wallet.add_pending(5)
+        wallet.add_pending(6)
+        wallet.add_pending(-1)
+        rows = {
+            phase: self.get_sample("wallet_settlement_rows_total", phase=phase)
+            for phase in ("expire", "make_available", "settle")
+        }
+        runs = self.get_sample("wallet_settlement_run_seconds_count")
+        update_transactions()
+        self.assertEqual(
+            self.get_sample(
+                "wallet_settlement_rows_total", phase="make_available"
+            ),
+            rows["make_available"] + 2,
+        )
+        # The settlement and the three available transactions it claims
+        self.assertEqual(
+            self.get_sample("wallet_settlement_rows_total", phase="settle"),
+            rows["settle"] + 4,
+        )
+        self.assertEqual(
+            self.get_sample("wallet_settlement_rows_total", phase="expire"),
+            rows["expire"],
+        )
+        self.assertEqual(
+            self.get_sample(
+                "wallet_settlement_backlog",
+                phase="make_available",
+                point="before",
+            ),
+            2,
+        )
+        self.assertEqual(
+            self.get_sample(
+                "wallet_settlement_backlog", phase="settle", point="before"
+            ),
+            1,
+        )
+        self.assertEqual(
+            self.get_sample(
+                "wallet_settlement_backlog", phase="settle", point="after"
+            ),
+            0,
+        )
+        self.assertEqual(
+            self.get_sample("wallet_settlement_run_seconds_count"), runs + 1
+        )
+        self.assertGreater(
+            self.get_sample(
+                "wallet_settlement_lock_wait_seconds_count",
+                phase="make_available",
+            ),
+            0,
+        )
+        self.assertGreater(
+            self.get_sample("wallet_settlement_rows_per_second"), 0
+        )
+
+    @mock.patch("wallet_base.metrics.push_to_gateway")
+    def test_push(self, push_to_gateway):
+        update_transactions()
+        push_to_gateway.assert_not_called()
+
+        with override_settings(METRICS_PUSHGATEWAY="localhost:9091"):
+            update_transactions()
+
+        push_to_gateway.assert_called_once()
+        self.assertEqual(
+            push_to_gateway.call_args.kwargs["job"], "update_transactions"
+        )
+
+    @mock.patch("wallet_base.metrics.delete_from_gateway")
+    @mock.patch("wallet_base.metrics.push_to_gateway")
+    @override_settings(METRICS_PUSHGATEWAY="localhost:9091")
+    def test_push_deleted_on_exit(self, push_to_gateway, delete_from_gateway):
+        update_transactions()
+        delete_pushed_metrics()
+
+        delete_from_gateway.assert_called_once_with(
+            "localhost:9091",
+            job="update_transactions",
+            grouping_key=push_to_gateway.call_args.kwargs["grouping_key"],
+        )
+        delete_pushed_metrics()
+        delete_from_gateway.assert_called_once()
+
+    @mock.patch(
+        "wallet_base.metrics.push_to_gateway", side_effect=OSError("down")
+    )
+    @mock.patch("wallet_base.tasks.tasks.logger")
+    @override_settings(METRICS_PUSHGATEWAY="localhost:9091")
+    def test_push_failure_does_not_fail_task(self, logger, push_to_gateway):
+        update_transactions()
+        logger.exception.assert_not_called()
+
+    def test_endpoint(self):
+        response = self.client.get(reverse("wallet-metrics"))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        with override_settings(METRICS_ENDPOINT_ENABLED=True):
+            response = self.client.get(reverse("wallet-metrics"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b"wallet_settlement_run_seconds", response.content)
@@ -0,0 +1,117 @@
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from django.test.testcases import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from wallet_base.metrics import registry
+
+TIMING = "wallet_base.middleware.timing.TimingMiddleware"
+
+
+def with_timing(middleware):
+    return [layer for name in middleware for layer in (TIMING, name)] + [TIMING]
+
+
+class MiddlewareProfileTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.all()[0]
+        self.user.set_password("test")
+        self.user.save()
+
+    def login(self):
+        response = self.client.post(
+            reverse("wallet-login"),
+            {"username": self.user.username, "password": "test"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Token {response.data['token']}"
+        )
+
+    def get_layer(self, layer, sample="count"):
+        return (
+            registry.get_sample_value(
+                f"wallet_middleware_seconds_{sample}", {"layer": layer}
+            )
+            or 0.0
+        )
+
+    @override_settings(MIDDLEWARE=settings.MIDDLEWARE_PROFILES["api"])
+    def test_api_profile(self):
+        self.login()
+
+        response = self.client.get(reverse("wallet:wallet-detail", args=["x"]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # No CSRF token needed
+        response = self.client.post(
+            reverse("wallet:request-list"),
+            {"payment_type": "alias", "nro": "martin.nieva.test"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get(
+            reverse("wallet:wallet-detail", args=["x"]),
+            HTTP_X_AMZN_WAF_RULE="block",
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+
+        self.client.credentials()
+        response = self.client.get(reverse("wallet:wallet-detail", args=["x"]))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_timing(self):
+        layers = [
+            name.rsplit(".", 1)[1]
+            for name in settings.MIDDLEWARE_PROFILES["full"]
+        ] + ["view"]
+        counts = {layer: self.get_layer(layer) for layer in layers}
+
+        # The client loads the middleware on its first request
+        with override_settings(
+            MIDDLEWARE=with_timing(settings.MIDDLEWARE_PROFILES["full"])
+        ):
+            self.login()
+            response = self.client.get(
+                reverse("wallet:wallet-detail", args=["x"])
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        for layer in layers:
+            # The login and the request
+            self.assertEqual(self.get_layer(layer), counts[layer] + 2, layer)
+            self.assertGreaterEqual(self.get_layer(layer, "sum"), 0, layer)
+
+    def test_timing_rejected(self):
+        view = self.get_layer("view")
+        header = self.get_layer("HeaderMiddleware")
+
+        with override_settings(
+            MIDDLEWARE=with_timing(settings.MIDDLEWARE_PROFILES["api"])
+        ):
+            self.client.get(
+                reverse("wallet:wallet-detail", args=["x"]),
+                HTTP_X_AMZN_WAF_RULE="block",
+            )
+
+        self.assertEqual(self.get_layer("HeaderMiddleware"), header + 1)
+        self.assertEqual(self.get_layer("view"), view)
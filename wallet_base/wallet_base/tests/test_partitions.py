@@ -0,0 +1,237 @@
+import datetime
+import os
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test.testcases import TestCase
+from django.utils.timezone import now as utcnow
+
+from wallet_base.models import (
+    DueTransition,
+    Wallet,
+    WalletBalance,
+    WalletExtractionRequest,
+    WalletTransaction,
+)
+from wallet_base.partitions import (
+    add_months,
+    create_partitions,
+    get_partitions,
+    get_references,
+    month_start,
+    partition_name,
+)
+from wallet_base.triggers import rebuild_balances
+
+
+class PartitionTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        self.wallet = Wallet.objects.get(code="123")
+        # Before the fixture transactions, which are in the default partition
+        self.old_month = datetime.date(2020, 1, 1)
+        self.available = self.wallet.get_available_credit()
+
+    def get_partition(self, wallet_transaction):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT tableoid::regclass::text "
+                f"FROM {WalletTransaction._meta.db_table} WHERE id = %s",
+                [wallet_transaction.id],
+            )
+            return cursor.fetchone()[0]
+
+    def get_balance(self):
+        return WalletBalance.objects.values().get(wallet=self.wallet)
+
+    def get_datetime(self, month):
+        return datetime.datetime.combine(
+            month, datetime.time(), datetime.timezone.utc
+        )
+
+    def add_old(self, amount, status):
+        wallet_transaction = self.wallet.add_available(amount)
+        WalletTransaction.objects.filter(pk=wallet_transaction.pk).update(
+            status=status, datetime_added=self.get_datetime(self.old_month)
+        )
+        return wallet_transaction
+
+    def test_monthly_partition(self):
+        wallet_transaction = self.wallet.add_available(10)
+        self.assertEqual(
+            self.get_partition(wallet_transaction),
+            partition_name(month_start(utcnow())),
+        )
+        self.assertEqual(
+            WalletTransaction.objects.get(code=wallet_transaction.code),
+            wallet_transaction,
+        )
+        self.assertEqual(
+            self.wallet.get_available_credit(), self.available + 10
+        )
+
+    def test_create_partitions(self):
+        out = StringIO()
+        call_command("create_transaction_partitions", months=5, stdout=out)
+        self.assertIn(
+            add_months(month_start(datetime.date.today()), 5),
+            get_partitions(connection),
+        )
+
+        out = StringIO()
+        call_command("create_transaction_partitions", months=5, stdout=out)
+        self.assertEqual(out.getvalue(), "")
+
+    def test_create_partitions_moves_default_rows(self):
+        wallet_transaction = self.add_old(
+            10, WalletTransaction.STATUS_AVAILABLE
+        )
+        self.assertEqual(
+            self.get_partition(wallet_transaction),
+            f"{WalletTransaction._meta.db_table}_default",
+        )
+        balance = self.get_balance()
+
+        created = create_partitions(connection, start=self.old_month)
+
+        self.assertEqual(created[0], partition_name(self.old_month))
+        self.assertEqual(
+            self.get_partition(wallet_transaction),
+            partition_name(self.old_month),
+        )
+        self.assertEqual(self.get_balance(), balance)
+        self.assertEqual(
+            self.wallet.get_available_credit(), self.available + 10
+        )
+
+    def test_detach(self):
+        available = self.add_old(10, WalletTransaction.STATUS_AVAILABLE)
+        create_partitions(connection, start=self.old_month)
+        before = add_months(self.old_month, 1).strftime("%Y-%m")
+
+        err = StringIO()
+        call_command(
+            "detach_transaction_partitions",
+            f"--before={before}",
+            stdout=StringIO(),
+            stderr=err,
+        )
+        self.assertIn("skipped", err.getvalue())
+        self.assertTrue(WalletTransaction.objects.filter(pk=available.pk))
+
+        WalletTransaction.objects.filter(pk=available.pk).update(
+            status=WalletTransaction.STATUS_EXPIRED
+        )
+        balance = self.get_balance()
+        out = StringIO()
+        call_command(
+            "detach_transaction_partitions",
+            f"--before={before}",
+            archive_schema="wallet_archive",
+            stdout=out,
+        )
+
+        self.assertIn(partition_name(self.old_month), out.getvalue())
+        self.assertNotIn(self.old_month, get_partitions(connection))
+        self.assertFalse(WalletTransaction.objects.filter(pk=available.pk))
+        self.assertEqual(self.get_balance(), balance)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) FROM wallet_archive."
+                f"{partition_name(self.old_month)}"
+            )
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def detach(self):
+        create_partitions(connection, start=self.old_month)
+        out = StringIO()
+        err = StringIO()
+        call_command(
+            "detach_transaction_partitions",
+            f"--before={add_months(self.old_month, 1).strftime('%Y-%m')}",
+            "--drop",
+            stdout=out,
+            stderr=err,
+        )
+        return out.getvalue(), err.getvalue()
+
+    def test_detach_referenced(self):
+        extraction = self.add_old(-5, WalletTransaction.STATUS_PROCESSED)
+        extraction_request = WalletExtractionRequest.objects.create(
+            wallet_transaction=extraction,
+            status=WalletExtractionRequest.STATUS_PROCESSED,
+            operator=self.wallet.user,
+        )
+
+        out, err = self.detach()
+
+        self.assertIn(
+            WalletExtractionRequest._meta.db_table,
+            get_references(connection, partition_name(self.old_month)),
+        )
+        self.assertIn("referenced", err)
+        self.assertTrue(WalletTransaction.objects.filter(pk=extraction.pk))
+
+        # A credit of a later month settled by it
+        extraction_request.delete()
+        credit = self.wallet.add_available(1)
+        WalletTransaction.objects.filter(pk=credit.pk).update(
+            settlement=extraction
+        )
+
+        self.assertEqual(
+            get_references(connection, partition_name(self.old_month)),
+            [WalletTransaction._meta.db_table],
+        )
+
+        # Settled within the month
+        WalletTransaction.objects.filter(pk=credit.pk).update(settlement=None)
+        old_credit = self.add_old(10, WalletTransaction.STATUS_PROCESSED)
+        WalletTransaction.objects.filter(pk=old_credit.pk).update(
+            settlement=extraction
+        )
+        out, err = self.detach()
+
+        self.assertIn(partition_name(self.old_month), out)
+        self.assertFalse(WalletTransaction.objects.filter(pk=extraction.pk))
+
+    def test_detach_balances(self):
+        self.add_old(-5, WalletTransaction.STATUS_PROCESSED)
+        expired = self.add_old(10, WalletTransaction.STATUS_EXPIRED)
+        DueTransition.objects.create(
+            wallet_transaction=expired,
+            kind=DueTransition.KIND_EXPIRE,
+            datetime_due=utcnow(),
+        )
+        paid = self.wallet.get_paid_credit_negative()
+
+        self.detach()
+
+        self.assertEqual(self.wallet.get_paid_credit_negative(), paid + 5)
+        balance = self.get_balance()
+        rebuild_balances(connection)
+        self.assertEqual(self.get_balance(), balance)
+        self.assertFalse(
+            DueTransition.objects.filter(wallet_transaction_id=expired.pk)
+        )
+
+    def test_pruning(self):
+        month = month_start(datetime.date.today())
+        queryset = WalletTransaction.objects.filter(
+            datetime_added__gte=self.get_datetime(month),
+            datetime_added__lt=self.get_datetime(add_months(month, 1)),
+        )
+        plan = queryset.explain()
+
+        self.assertIn(partition_name(month), plan)
+        self.assertNotIn(partition_name(add_months(month, 1)), plan)
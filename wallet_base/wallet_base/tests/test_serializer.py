@@ -0,0 +1,63 @@
+import os
+
+from django.conf import settings
+from django.test.testcases import TestCase
+from django.utils.timezone import now as utcnow
+from rest_framework.renderers import JSONRenderer
+
+from wallet_base.models import WalletTransaction
+from wallet_base.serializers import (
+    WalletTransactionSerializer,
+    get_transaction_plan,
+)
+
+
+class WalletTransactionPlanTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def test_same_output_as_serializer(self):
+        transaction_base = WalletTransaction.objects.get(code="555")
+        settlement = WalletTransaction.objects.create(
+            wallet_id=transaction_base.wallet_id,
+            code="settlement",
+            description=None,
+            status=WalletTransaction.STATUS_PROCESSED,
+            amount=-456789.116,
+        )
+        settlement.settlement = settlement
+        settlement.save()
+        WalletTransaction.objects.create(
+            wallet_id=transaction_base.wallet_id,
+            code="settled",
+            description="gift ñ",
+            status=WalletTransaction.STATUS_PROCESSED,
+            amount=3,
+            datetime_available=utcnow(),
+            settlement=settlement,
+        )
+        queryset = WalletTransaction.objects.order_by("id")
+        plan = get_transaction_plan()
+        renderer = JSONRenderer()
+
+        with self.assertNumQueries(1):
+            plan_data = plan.serialize(queryset.values_list(*plan.columns))
+
+        self.assertEqual(
+            renderer.render(plan_data),
+            renderer.render(
+                WalletTransactionSerializer(
+                    queryset.select_related("settlement"), many=True
+                ).data
+            ),
+        )
+        self.assertIsInstance(plan_data[-1]["object_serialized"], dict)
+        self.assertIs(plan_data[0]["object_serialized"], None)
+
+    def test_plan_is_cached(self):
+        self.assertIs(get_transaction_plan(), get_transaction_plan())
@@ -1,16 +1,52 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
 from unittest import mock
 
+from celery import current_app
 from django.conf import settings
-from django.test.testcases import TestCase
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.test.testcases import TestCase, TransactionTestCase
 from django.utils.timezone import now as utcnow
 from django.utils.timezone import timedelta
+from django_redis import get_redis_connection
 
-from wallet_base.models import WalletExtractionRequest, WalletTransaction
-from wallet_base.tasks import update_transactions
+from wallet_base.models import (
+    DueTransition,
+    Wallet,
+    WalletExtractionRequest,
+    WalletTransaction,
+)
+from wallet_base.tasks import update_transactions, update_transactions_sharded
+from wallet_base.tasks.settlement import settle_transactions
+from wallet_base.tasks.tasks import (
+    _dispatch_due_transitions,
+    _update_transactions,
+    merge_summaries,
+    merge_update_transactions,
+)
 
 
-class WalletTaskTestCase(TestCase):
+class TransactionStateMixin:
+    def get_state(self):
+        return (
+            list(
+                WalletTransaction.objects.order_by("id").values_list(
+                    "id", "status", "object_id", "object_name", "settlement_id"
+                )
+            ),
+            list(
+                WalletExtractionRequest.objects.order_by("id").values_list(
+                    "id", "status"
+                )
+            ),
+        )
+
+
+class WalletTaskTestCase(TransactionStateMixin, TestCase):
     fixture_base = os.path.join(
         settings.BASE_DIR, "wallet_base", "tests", "initial_data"
     )
@@ -235,3 +271,434 @@ class WalletTaskTestCase(TestCase):
         update_transactions()
         self.assertEqual(logger_mock.debug.call_count, 2)
         self.assertEqual(logger_mock.info.call_count, 2)
+
+    def settle_one_by_one(self, now):
+        # Settlement as it used to be done, one pending transaction at a time
+        for transaction_pending in WalletTransaction.objects.filter(
+            status=WalletTransaction.STATUS_PENDING,
+            amount__lt=0,
+            datetime_available__lt=now,
+        ).order_by("id"):
+            WalletTransaction.objects.filter(
+                Q(
+                    datetime_available__lt=transaction_pending.datetime_added,
+                    wallet_id=transaction_pending.wallet_id,
+                    status=WalletTransaction.STATUS_AVAILABLE,
+                )
+                | Q(id=transaction_pending.id)
+            ).update(
+                status=WalletTransaction.STATUS_PROCESSED,
+                object_id=transaction_pending.id,
+                object_name="wallet_wallettransaction",
+                settlement_id=transaction_pending.id,
+            )
+            transaction_pending.walletextractionrequest_set.update(
+                status=WalletExtractionRequest.STATUS_PROCESSED,
+                datetime_resolution=now,
+            )
+
+    def assertSettlementMatchesOneByOne(self, batch_size=None):
+        now = utcnow()
+        operator = User.objects.all()[0]
+        wallets = [
+            Wallet.objects.get(code="123"),
+            Wallet.objects.create(
+                user=User.objects.create(username="settlement")
+            ),
+        ]
+        WalletTransaction.objects.filter(code="555").update(
+            datetime_available=now - timedelta(days=30)
+        )
+
+        for wallet in wallets:
+            for days in range(10, 0, -1):
+                WalletTransaction.objects.create(
+                    wallet=wallet,
+                    status=WalletTransaction.STATUS_AVAILABLE,
+                    amount=days,
+                    datetime_available=now - timedelta(days=days),
+                )
+
+            # Settlements added between the available ones, the last one
+            # not due yet
+            for days, due in ((7, True), (4, True), (8, True), (2, False)):
+                settlement = WalletTransaction.objects.create(
+                    wallet=wallet,
+                    status=WalletTransaction.STATUS_PENDING,
+                    amount=-days,
+                    datetime_available=now + timedelta(hours=-1 if due else 1),
+                )
+                WalletTransaction.objects.filter(pk=settlement.pk).update(
+                    datetime_added=now - timedelta(days=days, hours=-1)
+                )
+                WalletExtractionRequest.objects.create(
+                    wallet_transaction=settlement,
+                    status=WalletExtractionRequest.STATUS_PENDING,
+                    operator=operator,
+                )
+
+        with transaction.atomic():
+            self.settle_one_by_one(now)
+            expected = self.get_state()
+            transaction.set_rollback(True)
+
+        settled = _update_transactions(batch_size)["settled"]
+        self.assertEqual(self.get_state(), expected)
+        self.assertEqual(
+            settled,
+            {
+                wallets[0].id: {
+                    "settlements": 3,
+                    "transactions": 3 + 7 + 1,
+                    "requests": 3,
+                },
+                wallets[1].id: {
+                    "settlements": 3,
+                    "transactions": 3 + 7,
+                    "requests": 3,
+                },
+            },
+        )
+        self.assertEqual(
+            WalletTransaction.objects.filter(
+                status=WalletTransaction.STATUS_AVAILABLE
+            ).count(),
+            2 * 3,
+        )
+
+    def test_settlement_matches_one_by_one(self):
+        self.assertSettlementMatchesOneByOne()
+
+    def test_settlement_matches_one_by_one_in_chunks(self):
+        self.assertSettlementMatchesOneByOne(batch_size=1)
+
+    def test_update_in_chunks(self):
+        wallet = Wallet.objects.get(code="123")
+
+        for amount in range(5):
+            wallet.add_pending(amount)
+
+        _update_transactions(batch_size=2)
+
+        self.assertEqual(
+            WalletTransaction.objects.filter(
+                status=WalletTransaction.STATUS_AVAILABLE
+            ).count(),
+            6,
+        )
+
+    def run_sharded(self, shards):
+        current_app.conf.task_always_eager = True
+        self.addCleanup(setattr, current_app.conf, "task_always_eager", False)
+        wallets = [Wallet.objects.get(code="123")] + [
+            Wallet.objects.create(user=User.objects.create(username=f"u{i}"))
+            for i in range(4)
+        ]
+
+        for wallet in wallets:
+            wallet.add_available(10)
+            wallet.add_pending(5)
+            wallet.add_pending(-1)
+
+        with mock.patch(
+            "wallet_base.tasks.tasks.merge_update_transactions",
+            wraps=merge_update_transactions,
+        ) as merge:
+            update_transactions_sharded(shards=shards, batch_size=1)
+
+        merge.assert_called_once()
+        summaries, failed_shards = merge.call_args.args
+        return wallets, merge_summaries(summaries), failed_shards
+
+    def test_sharded(self):
+        wallets, summary, failed_shards = self.run_sharded(3)
+        self.assertEqual(failed_shards, [])
+        self.assertEqual(summary["expired"], 0)
+        self.assertEqual(summary["made_available"], 5)
+        self.assertEqual(
+            summary["settled"],
+            {
+                wallet.pk: {
+                    "settlements": 1,
+                    "transactions": 3 + (wallet.code == "123"),
+                    "requests": 0,
+                }
+                for wallet in wallets
+            },
+        )
+        self.assertFalse(
+            WalletTransaction.objects.filter(
+                status=WalletTransaction.STATUS_PENDING
+            ).exists()
+        )
+
+    def test_sharded_failed_shard(self):
+        def update(batch_size, shard, shards):
+            if shard == 1:
+                raise DatabaseError("shard failed")
+
+            return _update_transactions(batch_size, shard, shards)
+
+        with mock.patch(
+            "wallet_base.tasks.tasks._update_transactions", side_effect=update
+        ):
+            wallets, summary, failed_shards = self.run_sharded(3)
+
+        self.assertEqual(failed_shards, [1])
+        self.assertEqual(
+            sorted(summary["settled"]),
+            [wallet.pk for wallet in wallets if wallet.pk % 3 != 1],
+        )
+        self.assertEqual(get_redis_connection("default").keys("*sharded*"), [])
+
+    def test_settlement_nothing_due(self):
+        self.assertEqual(
+            _update_transactions(),
+            {"expired": 0, "made_available": 0, "settled": {}},
+        )
+
+
+class WalletTaskLockTestCase(TransactionTestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        self.wallet = Wallet.objects.get(code="123")
+        self.other_wallet = Wallet.objects.create(
+            user=User.objects.create(username="other")
+        )
+        self.other_wallet.add_available(10)
+
+    @contextmanager
+    def hold_lock(self, queryset):
+        # Another worker (or request) holding the rows in its transaction
+        locked = threading.Event()
+        release = threading.Event()
+
+        def lock():
+            try:
+                with transaction.atomic():
+                    list(queryset.select_for_update())
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=lock)
+        thread.start()
+        locked.wait(10)
+
+        try:
+            yield
+        finally:
+            release.set()
+            thread.join()
+
+    def test_settlement_skips_locked_wallets(self):
+        settlement = self.wallet.add_pending(-5)
+        other_settlement = self.other_wallet.add_pending(-5)
+
+        with self.hold_lock(Wallet.objects.filter(pk=self.wallet.pk)):
+            settled = _update_transactions(batch_size=1)["settled"]
+
+        self.assertEqual(list(settled), [self.other_wallet.pk])
+        settlement.refresh_from_db()
+        other_settlement.refresh_from_db()
+        self.assertEqual(settlement.status, WalletTransaction.STATUS_PENDING)
+        self.assertEqual(
+            other_settlement.status, WalletTransaction.STATUS_PROCESSED
+        )
+        self.assertEqual(
+            list(_update_transactions()["settled"]), [self.wallet.pk]
+        )
+        settlement.refresh_from_db()
+        self.assertEqual(settlement.status, WalletTransaction.STATUS_PROCESSED)
+
+    def test_update_skips_locked_transactions(self):
+        pending = self.wallet.add_pending(5)
+        other_pending = self.other_wallet.add_pending(5)
+
+        with self.hold_lock(WalletTransaction.objects.filter(pk=pending.pk)):
+            _update_transactions(batch_size=1)
+
+        pending.refresh_from_db()
+        other_pending.refresh_from_db()
+        self.assertEqual(pending.status, WalletTransaction.STATUS_PENDING)
+        self.assertEqual(
+            other_pending.status, WalletTransaction.STATUS_AVAILABLE
+        )
+
+    def wait_for_lock(self):
+        with connection.cursor() as cursor:
+            for i in range(100):
+                cursor.execute(
+                    "SELECT 1 FROM pg_stat_activity "
+                    "WHERE wait_event_type = 'Lock'"
+                )
+
+                if cursor.fetchone():
+                    return
+
+                time.sleep(0.05)
+
+        self.fail("no query waiting on a lock")
+
+    def test_settlement_rechecks_claimed_credits(self):
+        credit = self.other_wallet.wallettransaction_set.get()
+        settlement = self.other_wallet.add_pending(-5)
+        expired = threading.Event()
+        release = threading.Event()
+        settled = {}
+
+        def expire():
+            # The expiry phase of another worker, which locked the credit
+            # after the settlement took its snapshot
+            try:
+                with transaction.atomic():
+                    WalletTransaction.objects.filter(pk=credit.pk).update(
+                        status=WalletTransaction.STATUS_EXPIRED
+                    )
+                    expired.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        def settle():
+            try:
+                settled.update(
+                    settle_transactions(
+                        utcnow(), utcnow(), wallet_ids=[self.other_wallet.pk]
+                    )
+                )
+            finally:
+                connection.close()
+
+        expire_thread = threading.Thread(target=expire)
+        expire_thread.start()
+        expired.wait(10)
+        settle_thread = threading.Thread(target=settle)
+        settle_thread.start()
+
+        try:
+            self.wait_for_lock()
+        finally:
+            release.set()
+            expire_thread.join()
+            settle_thread.join()
+
+        credit.refresh_from_db()
+        settlement.refresh_from_db()
+        self.assertEqual(credit.status, WalletTransaction.STATUS_EXPIRED)
+        self.assertIsNone(credit.settlement_id)
+        self.assertEqual(settlement.status, WalletTransaction.STATUS_PROCESSED)
+        self.assertEqual(
+            settled,
+            {
+                self.other_wallet.pk: {
+                    "settlements": 1,
+                    "transactions": 1,
+                    "requests": 0,
+                }
+            },
+        )
+
+
+class DueTransitionTestCase(TransactionStateMixin, TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        self.wallet = Wallet.objects.get(code="123")
+
+    def get_due(self, wallet_transaction):
+        return sorted(
+            DueTransition.objects.filter(
+                wallet_transaction=wallet_transaction
+            ).values_list("kind", "datetime_due")
+        )
+
+    def test_scheduled(self):
+        available = self.wallet.add_available(10)
+        pending = self.wallet.add_pending(5)
+        settlement = self.wallet.add_pending(-1, available_delta_days=1)
+        self.assertEqual(
+            self.get_due(available),
+            [(DueTransition.KIND_EXPIRE, available.datetime_expiration)],
+        )
+        self.assertEqual(
+            self.get_due(pending),
+            [
+                (DueTransition.KIND_AVAILABLE, pending.datetime_available),
+                (DueTransition.KIND_EXPIRE, pending.datetime_expiration),
+            ],
+        )
+        self.assertEqual(
+            self.get_due(settlement),
+            [(DueTransition.KIND_SETTLE, settlement.datetime_available)],
+        )
+
+    def test_dispatch(self):
+        pending = self.wallet.add_pending(5)
+        not_due = self.wallet.add_pending(7, available_delta_days=1)
+        summary = _dispatch_due_transitions()
+        self.assertEqual(summary["made_available"], 1)
+        pending.refresh_from_db()
+        not_due.refresh_from_db()
+        self.assertEqual(pending.status, WalletTransaction.STATUS_AVAILABLE)
+        self.assertEqual(not_due.status, WalletTransaction.STATUS_PENDING)
+        self.assertEqual(
+            [kind for kind, _ in self.get_due(pending)],
+            [DueTransition.KIND_EXPIRE],
+        )
+        self.assertEqual(len(self.get_due(not_due)), 2)
+
+    def test_dispatch_only_reads_due(self):
+        for amount in range(10):
+            self.wallet.add_available(amount)
+
+        # Nothing due, only the lookup of due transitions (in its savepoint)
+        # whatever the number of transactions
+        with self.assertNumQueries(3):
+            _dispatch_due_transitions()
+
+    def test_dispatch_moved(self):
+        pending = self.wallet.add_pending(5)
+        datetime_available = utcnow() + timedelta(hours=1)
+        WalletTransaction.objects.filter(pk=pending.pk).update(
+            datetime_available=datetime_available
+        )
+        self.assertEqual(_dispatch_due_transitions()["made_available"], 0)
+        self.assertIn(
+            (DueTransition.KIND_AVAILABLE, datetime_available),
+            self.get_due(pending),
+        )
+
+    def test_dispatch_matches_update_transactions(self):
+        other_wallet = Wallet.objects.create(
+            user=User.objects.create(username="dispatch")
+        )
+
+        for wallet in (self.wallet, other_wallet):
+            wallet.add_available(3, expiration_delta_years=0)
+            wallet.add_available(4)
+            wallet.add_pending(5)
+            wallet.add_pending(6, available_delta_days=1)
+            wallet.add_pending(-2)
+
+        with transaction.atomic():
+            expected_summary = _update_transactions()
+            expected = self.get_state()
+            transaction.set_rollback(True)
+
+        self.assertEqual(_dispatch_due_transitions(), expected_summary)
+        self.assertEqual(self.get_state(), expected)
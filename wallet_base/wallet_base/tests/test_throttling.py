@@ -0,0 +1,204 @@
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from django.test.testcases import TestCase
+from django.urls import reverse
+from django_redis import get_redis_connection
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.throttling import SimpleRateThrottle, UserRateThrottle
+from rest_framework.views import APIView
+
+from wallet_base.metrics import registry
+from wallet_base.throttling import (
+    UniversalAwsWafThrottle,
+    UserRateAwsAwfThrottle,
+)
+
+
+class UniversalThrottle(UniversalAwsWafThrottle):
+    rate = "3/m"
+    scope = "test_universal"
+
+
+class UserThrottle(UserRateAwsAwfThrottle):
+    rate = "2/m"
+    scope = "test_user"
+
+
+class ReferenceUniversalThrottle(SimpleRateThrottle):
+    rate = "3/m"
+    scope = "reference_universal"
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            "scope": self.scope,
+            "ident": self.get_ident(request),
+        }
+
+
+class ReferenceUserThrottle(UserRateThrottle):
+    rate = "2/m"
+    scope = "reference_user"
+
+
+class ThrottledView(APIView):
+    throttle_classes = [UniversalThrottle, UserThrottle]
+
+
+class ReferenceView(APIView):
+    throttle_classes = [ReferenceUniversalThrottle, ReferenceUserThrottle]
+
+
+class SlidingWindowThrottleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="throttled")
+        self.factory = APIRequestFactory()
+        self.start = 1760000000.0
+
+    def get_request(self, **extra):
+        request = Request(self.factory.get("/", **extra))
+        request.user = self.user
+        return request
+
+    def check(self, view, now, **extra):
+        request = self.get_request(**extra)
+        results = []
+
+        with mock.patch.object(
+            SimpleRateThrottle, "timer", mock.Mock(return_value=now)
+        ):
+            for throttle in view.get_throttles():
+                allowed = throttle.allow_request(request, view)
+                results.append((allowed, None if allowed else throttle.wait()))
+
+        return results
+
+    def test_matches_simple_rate_throttle(self):
+        offsets = [0, 1, 2, 3, 30, 59.999, 60, 60.5, 61, 61, 62.001, 200]
+
+        for offset in offsets:
+            now = self.start + offset
+            results = self.check(ThrottledView(), now)
+            reference = self.check(ReferenceView(), now)
+
+            for (allowed, wait), (expected, expected_wait) in zip(
+                results, reference
+            ):
+                self.assertEqual(allowed, expected, offset)
+
+                if expected_wait is None:
+                    self.assertIsNone(wait)
+                else:
+                    self.assertAlmostEqual(wait, expected_wait, places=3)
+
+    def test_one_round_trip(self):
+        client = get_redis_connection("default")
+        self.check(ThrottledView(), self.start)
+
+        with mock.patch.object(
+            client, "execute_command", wraps=client.execute_command
+        ) as execute_command:
+            self.check(ThrottledView(), self.start + 1)
+
+        self.assertEqual(
+            [call.args[0] for call in execute_command.call_args_list],
+            ["EVALSHA"],
+        )
+
+    def test_compact_history(self):
+        for offset in range(3):
+            self.check(ThrottledView(), self.start + offset)
+
+        client = get_redis_connection("default")
+        key = cache.make_key(
+            UniversalThrottle().get_cache_key(self.get_request(), None)
+        )
+        # A 6 byte timestamp per request
+        self.assertEqual(client.strlen(key), 3 * 6)
+        self.assertAlmostEqual(client.pttl(key), 60000, delta=5000)
+
+    def test_waf_block(self):
+        results = self.check(ThrottledView(), self.start, is_aws_waf_block=True)
+
+        self.assertEqual(results, [(False, 0), (False, 0)])
+        # Not counted
+        for offset in range(2):
+            self.assertEqual(
+                self.check(ThrottledView(), self.start + offset),
+                [(True, None), (True, None)],
+            )
+
+        self.assertEqual(
+            self.check(ThrottledView(), self.start + 2),
+            [(True, None), (False, 58.0)],
+        )
+
+
+class WafFastRejectTestCase(TestCase):
+    fixture_base = os.path.join(
+        settings.BASE_DIR, "wallet_base", "tests", "initial_data"
+    )
+    fixtures = [
+        os.path.join(fixture_base, "user.json"),
+        os.path.join(fixture_base, "wallet.json"),
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        token = Token.objects.create(user=User.objects.all()[0])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.url = reverse("wallet:wallet-detail", args=["x"])
+
+    def get_blocked(self, action):
+        return (
+            registry.get_sample_value(
+                "wallet_waf_blocked_requests_total", {"action": action}
+            )
+            or 0.0
+        )
+
+    def get(self):
+        return self.client.get(self.url, HTTP_X_AMZN_WAF_RULE="block")
+
+    def test_rejected_without_queries_or_cache_writes(self):
+        client = get_redis_connection("default")
+        blocked = self.get_blocked("rejected")
+
+        with mock.patch.object(
+            client, "execute_command", wraps=client.execute_command
+        ) as execute_command, self.assertNumQueries(0):
+            response = self.get()
+
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(
+            response.json()["detail"],
+            "Request was throttled. Expected available in 0 seconds.",
+        )
+        execute_command.assert_not_called()
+        self.assertEqual(self.get_blocked("rejected"), blocked + 1)
+
+    @override_settings(WAF_FAST_REJECT=False)
+    def test_throttled_by_views(self):
+        blocked = self.get_blocked("passed")
+        response = self.get()
+
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(
+            response.json()["detail"],
+            "Request was throttled. Expected available in 0 seconds.",
+        )
+        self.assertEqual(self.get_blocked("passed"), blocked + 1)
+        self.assertEqual(get_redis_connection("default").keys("*throttle*"), [])
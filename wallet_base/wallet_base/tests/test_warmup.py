@@ -0,0 +1,65 @@
+import importlib
+import os
+from unittest import mock
+
+from django.test.testcases import TestCase
+from django_redis import get_redis_connection
+
+from wallet_base import gunicorn_conf
+from wallet_base.serializers.serializers import _get_transaction_plan
+from wallet_base.warmup import warmup
+
+
+class WarmupTestCase(TestCase):
+    def test_no_connections(self):
+        client = get_redis_connection("default")
+        _get_transaction_plan.cache_clear()
+
+        with mock.patch.object(
+            client, "execute_command", wraps=client.execute_command
+        ) as execute_command, self.assertNumQueries(0):
+            warmup()
+
+        execute_command.assert_not_called()
+        self.assertEqual(_get_transaction_plan.cache_info().currsize, 1)
+
+
+class GunicornConfTestCase(TestCase):
+    def load(self, **environ):
+        with mock.patch.dict(os.environ, environ), mock.patch.object(
+            os, "sched_getaffinity", return_value={0, 1}
+        ):
+            conf = importlib.reload(gunicorn_conf)
+            self.environ = dict(os.environ)
+
+        return conf
+
+    def tearDown(self):
+        importlib.reload(gunicorn_conf)
+
+    def test_profiles(self):
+        conf = self.load(GUNICORN_PROFILE="sync")
+        self.assertEqual(conf.worker_class, "sync")
+        self.assertEqual(conf.workers, 5)
+        self.assertEqual(conf.threads, 1)
+        self.assertTrue(conf.preload_app)
+
+        conf = self.load(GUNICORN_PROFILE="gthread", GUNICORN_THREADS="8")
+        self.assertEqual(conf.worker_class, "gthread")
+        self.assertEqual(conf.workers, 3)
+        self.assertEqual(conf.threads, 8)
+
+        with mock.patch.dict(os.environ):
+            os.environ.pop("DJANGO_ROOT_URLCONF", None)
+            conf = self.load(GUNICORN_PROFILE="async", GUNICORN_WORKERS="2")
+
+        self.assertEqual(
+            self.environ["DJANGO_ROOT_URLCONF"], "wallet_base.urls_async"
+        )
+        self.assertEqual(conf.worker_class, "uvicorn.workers.UvicornWorker")
+        self.assertEqual(conf.wsgi_app, "wallet_base.asgi:application")
+        self.assertEqual(conf.workers, 2)
+
+    def test_unknown_profile(self):
+        with self.assertRaises(RuntimeError):
+            self.load(GUNICORN_PROFILE="gevent")
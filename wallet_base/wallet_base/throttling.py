@@ -1,5 +1,147 @@
+import hashlib
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
 from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 
+# Sliding window log, like SimpleRateThrottle's, for several keys at once.
+# Each key holds its request timestamps (ms) packed 6 bytes apiece, newest
+# first, instead of a pickled list of floats. Keys are handled in order, as
+# DRF checks throttles one after the other: a request is recorded for every
+# key that allows it, whatever the other keys decide.
+SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+local results = {}
+
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[2 * i])
+    local duration = tonumber(ARGV[2 * i + 1])
+    local history = redis.call("GET", key) or ""
+    local count = 0
+    local oldest = 0
+
+    while count * 6 < #history do
+        local timestamp = struct.unpack(">i6", history, count * 6 + 1)
+
+        if timestamp <= now - duration then
+            break
+        end
+
+        oldest = timestamp
+        count = count + 1
+    end
+
+    local allowed = 0
+
+    if count < limit then
+        allowed = 1
+        redis.call(
+            "SET", key,
+            struct.pack(">i6", now) .. string.sub(history, 1, count * 6),
+            "PX", duration
+        )
+    end
+
+    results[i] = {allowed, count, oldest}
+end
+
+return results
+"""
+
+_script = None
+
+
+def get_sliding_window_script():
+    global _script
+
+    if _script is None:
+        _script = get_redis_connection("default").register_script(
+            SLIDING_WINDOW_LUA
+        )
+
+    return _script
+
+
+class SlidingWindowThrottleMixin:
+    """Evaluates every sliding window throttle of the view in one Redis round
+    trip (an EVALSHA), atomically, on the first allow_request of the request.
+    The other throttles read their result from the request."""
+
+    def get_sliding_window_throttles(self, request, view):
+        throttles = [
+            throttle
+            for throttle in view.get_throttles()
+            if isinstance(throttle, SlidingWindowThrottleMixin)
+        ]
+
+        if not any(type(throttle) is type(self) for throttle in throttles):
+            throttles.append(self)
+
+        return [
+            (throttle, key)
+            for throttle in throttles
+            if throttle.rate is not None
+            and (key := throttle.get_cache_key(request, view)) is not None
+        ]
+
+    def evaluate(self, request, view):
+        throttles = self.get_sliding_window_throttles(request, view)
+        now = self.timer()
+        args = [int(now * 1000)]
+
+        for throttle, key in throttles:
+            args += [throttle.num_requests, throttle.duration * 1000]
+
+        results = get_sliding_window_script()(
+            keys=[cache.make_key(key) for throttle, key in throttles],
+            args=args,
+        )
+        request._sliding_window_results = {
+            key: (now, *result)
+            for (throttle, key), result in zip(throttles, results)
+        }
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+
+        if self.key is None:
+            return True
+
+        if self.key not in getattr(request, "_sliding_window_results", {}):
+            self.evaluate(request, view)
+
+        # Each key is evaluated once per request
+        self.now, allowed, self.count, oldest = (
+            request._sliding_window_results.pop(self.key)
+        )
+        self.oldest = oldest / 1000
+
+        if allowed:
+            return self.throttle_success()
+
+        return self.throttle_failure()
+
+    def throttle_success(self):
+        # Already recorded by the script
+        return True
+
+    def wait(self):
+        # SimpleRateThrottle.wait, from the count and oldest timestamp
+        if self.count:
+            remaining_duration = self.duration - (self.now - self.oldest)
+        else:
+            remaining_duration = self.duration
+
+        available_requests = self.num_requests - self.count + 1
+
+        if available_requests <= 0:
+            return None
+
+        return remaining_duration / float(available_requests)
+
 
 class AwsWafThrottleMixin:
     is_waf_blocked = False
@@ -11,20 +153,24 @@ class AwsWafThrottleMixin:
         return super().wait(*args, **kwargs)
 
     def allow_request(self, request, view):
-        allow_request = super().allow_request(request, view)
         self.is_waf_blocked = request.META.get("is_aws_waf_block", False)
 
+        # Refused without recording it in the throttle history
         if self.is_waf_blocked:
             return self.throttle_failure()
 
-        return allow_request
+        return super().allow_request(request, view)
 
 
-class AnonRateAwsWafThrottle(AwsWafThrottleMixin, AnonRateThrottle):
+class AnonRateAwsWafThrottle(
+    AwsWafThrottleMixin, SlidingWindowThrottleMixin, AnonRateThrottle
+):
     pass
 
 
-class UserRateAwsAwfThrottle(AwsWafThrottleMixin, UserRateThrottle):
+class UserRateAwsAwfThrottle(
+    AwsWafThrottleMixin, SlidingWindowThrottleMixin, UserRateThrottle
+):
     pass
 
 
@@ -34,3 +180,22 @@ class UniversalAwsWafThrottle(AnonRateAwsWafThrottle):
             "scope": self.scope,
             "ident": self.get_ident(request),
         }
+
+
+class UsernameAwsWafThrottle(AnonRateAwsWafThrottle):
+    """Keyed by the username a login posts, whatever the client."""
+
+    def get_cache_key(self, request, view):
+        # The serializer rejects anything but an object
+        if not isinstance(request.data, dict):
+            return None
+
+        username = request.data.get("username")
+
+        if not username:
+            return None
+
+        return self.cache_format % {
+            "scope": self.scope,
+            "ident": hashlib.sha256(str(username).encode()).hexdigest(),
+        }
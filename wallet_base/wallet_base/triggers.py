@@ -0,0 +1,137 @@
+from wallet_base.models import WalletBalance, WalletTransaction
+
+BALANCE_COLUMNS = ["available", "pending", "pending_negative", "paid_off"]
+# Set (locally) by bulk writers that update the balances themselves, with
+# add_balances_sql, instead of once per row
+BULK_SETTING = "wallet.bulk_balances"
+
+
+def _contributions(row, sign=""):
+    # One expression per WalletBalance column, mirroring the filters used by
+    # Wallet.get_available_credit, get_pending_credit,
+    # get_pending_credit_negative and get_paid_credit_negative.
+    amount = f"{sign}{row}.amount"
+    return [
+        f"CASE WHEN {row}.status = '{WalletTransaction.STATUS_AVAILABLE}' "
+        f"THEN {amount} ELSE 0 END",
+        f"CASE WHEN {row}.status = '{WalletTransaction.STATUS_PENDING}' "
+        f"THEN {amount} ELSE 0 END",
+        f"CASE WHEN {row}.status = '{WalletTransaction.STATUS_PENDING}' "
+        f"AND {row}.amount < 0 THEN {amount} ELSE 0 END",
+        f"CASE WHEN {row}.status = '{WalletTransaction.STATUS_PROCESSED}' "
+        f"AND {row}.amount < 0 THEN {amount} ELSE 0 END",
+    ]
+
+
+def _upsert(row, sign=""):
+    balance_table = WalletBalance._meta.db_table
+    values = ", ".join(_contributions(row, sign))
+    updates = ", ".join(
+        f"{column} = b.{column} + EXCLUDED.{column}"
+        for column in BALANCE_COLUMNS
+    )
+    return (
+        f"INSERT INTO {balance_table} AS b "
+        f"(wallet_id, {', '.join(BALANCE_COLUMNS)}) "
+        f"VALUES ({row}.wallet_id, {values}) "
+        f"ON CONFLICT (wallet_id) DO UPDATE SET {updates};"
+    )
+
+
+def balance_trigger_sql():
+    transaction_table = WalletTransaction._meta.db_table
+    return [
+        f"""
+        CREATE OR REPLACE FUNCTION wallet_balance_apply() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('{BULK_SETTING}', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                {_upsert("OLD", sign="-")}
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                {_upsert("NEW")}
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        f"DROP TRIGGER IF EXISTS wallet_balance_insert_delete "
+        f"ON {transaction_table};",
+        f"DROP TRIGGER IF EXISTS wallet_balance_update ON {transaction_table};",
+        f"""
+        CREATE TRIGGER wallet_balance_insert_delete
+        AFTER INSERT OR DELETE ON {transaction_table}
+        FOR EACH ROW EXECUTE FUNCTION wallet_balance_apply();
+        """,
+        # Skipping rows whose status, amount and wallet didn't change keeps
+        # unrelated updates (descriptions, object_id...) from adding float
+        # rounding noise to the totals.
+        f"""
+        CREATE TRIGGER wallet_balance_update
+        AFTER UPDATE ON {transaction_table}
+        FOR EACH ROW
+        WHEN (
+            OLD.status IS DISTINCT FROM NEW.status
+            OR OLD.amount IS DISTINCT FROM NEW.amount
+            OR OLD.wallet_id IS DISTINCT FROM NEW.wallet_id
+        )
+        EXECUTE FUNCTION wallet_balance_apply();
+        """,
+    ]
+
+
+def add_balances_sql(relation, sign=""):
+    """Upsert adding the totals of relation, rows of the transaction table
+    (e.g. an INSERT ... RETURNING * CTE), to the balances, or subtracting
+    them with sign="-"."""
+
+    balance_table = WalletBalance._meta.db_table
+    sums = ", ".join(
+        f"SUM({contribution})"
+        for contribution in _contributions(relation, sign)
+    )
+    updates = ", ".join(
+        f"{column} = b.{column} + EXCLUDED.{column}"
+        for column in BALANCE_COLUMNS
+    )
+    return (
+        f"INSERT INTO {balance_table} AS b "
+        f"(wallet_id, {', '.join(BALANCE_COLUMNS)}) "
+        f"SELECT wallet_id, {sums} FROM {relation} GROUP BY wallet_id "
+        f"ON CONFLICT (wallet_id) DO UPDATE SET {updates}"
+    )
+
+
+def rebuild_balances_sql():
+    transaction_table = WalletTransaction._meta.db_table
+    balance_table = WalletBalance._meta.db_table
+    sums = ", ".join(
+        f"COALESCE(SUM({contribution}), 0)"
+        for contribution in _contributions(transaction_table)
+    )
+    updates = ", ".join(
+        f"{column} = EXCLUDED.{column}" for column in BALANCE_COLUMNS
+    )
+    return (
+        f"INSERT INTO {balance_table} "
+        f"(wallet_id, {', '.join(BALANCE_COLUMNS)}) "
+        f"SELECT wallet_id, {sums} FROM {transaction_table} "
+        f"GROUP BY wallet_id "
+        f"ON CONFLICT (wallet_id) DO UPDATE SET {updates};"
+    )
+
+
+def install_balance_trigger(connection):
+    if connection.vendor != "postgresql":
+        return
+
+    with connection.cursor() as cursor:
+        for statement in balance_trigger_sql():
+            cursor.execute(statement)
+
+
+def rebuild_balances(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(rebuild_balances_sql())
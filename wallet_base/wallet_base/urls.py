@@ -6,6 +6,7 @@ from wallet_base.views import (
     WalletExtractionRequestViewSet,
     WalletTransactionViewSet,
     WalletViewSet,
+    metrics_view,
 )
 
 router = routers.DefaultRouter()
@@ -19,4 +20,5 @@ router.register(r"request", WalletExtractionRequestViewSet, basename="request")
 urlpatterns = [
     re_path(r"api/v1/", include((router.urls, "wallet"), namespace="wallet")),
     re_path(r"login/", LoginView.as_view(), name="wallet-login"),
+    re_path(r"metrics/", metrics_view, name="wallet-metrics"),
 ]
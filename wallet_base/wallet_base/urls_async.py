@@ -0,0 +1,35 @@
+from django.urls import include, re_path
+
+from wallet_base.urls import router
+from wallet_base.urls import urlpatterns as sync_urlpatterns
+from wallet_base.views.async_views import (
+    AsyncWalletTransactionView,
+    AsyncWalletView,
+)
+
+# Same routes and names as wallet_base.urls, with the read endpoints served
+# by async views. Used by the ASGI deployment (DJANGO_ROOT_URLCONF).
+async_patterns = [
+    re_path(
+        r"^wallet/(?P<pk>[^/.]+)/$",
+        AsyncWalletView.as_view(),
+        name="wallet-detail",
+    ),
+    re_path(
+        r"^transaction/$",
+        AsyncWalletTransactionView.as_view(),
+        name="transaction-list",
+    ),
+]
+
+urlpatterns = [
+    re_path(
+        r"api/v1/",
+        include((async_patterns + router.urls, "wallet"), namespace="wallet"),
+    ),
+] + [
+    # The others (login, metrics), whatever their order
+    pattern
+    for pattern in sync_urlpatterns
+    if getattr(pattern, "namespace", None) != "wallet"
+]
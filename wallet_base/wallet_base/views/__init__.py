@@ -1 +1 @@
-from wallet_base.views.views import WalletViewSet, WalletTransactionViewSet, WalletExtractionRequestViewSet, LoginView  # noqa
+from wallet_base.views.views import WalletViewSet, WalletTransactionViewSet, WalletExtractionRequestViewSet, LoginView, metrics_view  # noqa
@@ -0,0 +1,165 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.db import connection
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views import View
+from rest_framework import response
+
+from wallet_base.serializers import get_transaction_plan
+from wallet_base.views.views import (
+    WalletTransactionViewSet,
+    WalletViewSet,
+    wallet_etag,
+)
+
+
+def _run_query(function, *args):
+    try:
+        return function(*args)
+    finally:
+        # Executor threads don't see request_finished and close_old_connections
+        # would keep their connection for CONN_MAX_AGE, one per thread. Close
+        # it (or give it back to the pool, with DB_POOL) after each query.
+        connection.close()
+
+
+def run_query(function, *args):
+    return sync_to_async(_run_query, thread_sensitive=False)(function, *args)
+
+
+async def gather_queries(*functions):
+    """Run independent ORM calls at the same time, each one in its own
+    thread and therefore on its own database connection."""
+
+    return await asyncio.gather(
+        *(run_query(function) for function in functions)
+    )
+
+
+class AsyncViewSetView(View):
+    """Async version of one viewset action.
+
+    Authentication, permissions, throttling and error responses still come
+    from the synchronous viewset (run in a thread), only the handler is
+    async: subclasses define it as handle(viewset, *args, **kwargs).
+    """
+
+    viewset_class = None
+    action = None
+
+    def get_viewset(self, request, *args, **kwargs):
+        viewset = self.viewset_class(action_map={"get": self.action})
+        viewset.args = args
+        viewset.kwargs = kwargs
+        viewset.request = viewset.initialize_request(request, *args, **kwargs)
+        viewset.headers = viewset.default_response_headers
+        return viewset
+
+    def check_request(self, viewset, *args, **kwargs):
+        viewset.initial(viewset.request, *args, **kwargs)
+        return wallet_etag(viewset.request)
+
+    async def get(self, request, *args, **kwargs):
+        viewset = self.get_viewset(request, *args, **kwargs)
+
+        try:
+            etag = await sync_to_async(self.check_request)(
+                viewset, *args, **kwargs
+            )
+            etag = quote_etag(etag) if etag is not None else None
+            view_response = get_conditional_response(viewset.request, etag=etag)
+
+            if view_response is None:
+                view_response = await self.handle(viewset, *args, **kwargs)
+
+            if etag is not None:
+                view_response.headers.setdefault("ETag", etag)
+        except Exception as exc:
+            view_response = viewset.handle_exception(exc)
+
+        return viewset.finalize_response(
+            viewset.request, view_response, *args, **kwargs
+        )
+
+
+class AsyncWalletView(AsyncViewSetView):
+    viewset_class = WalletViewSet
+    action = "retrieve"
+
+    async def handle(self, viewset, *args, **kwargs):
+        data = await run_query(
+            lambda: viewset.get_wallet_data(viewset.get_wallet(viewset.request))
+        )
+        return response.Response(data)
+
+
+class AsyncWalletTransactionView(AsyncViewSetView):
+    viewset_class = WalletTransactionViewSet
+    action = "list"
+
+    async def handle(self, viewset, *args, **kwargs):
+        request = viewset.request
+        viewset.object_list = viewset.get_queryset()
+
+        if viewset.cursor_kwarg in request.GET:
+            return await self.handle_cursor(viewset)
+
+        plan = get_transaction_plan()
+        paginator = viewset.get_paginator(
+            viewset.object_list, viewset.paginate_by
+        )
+        page = request.GET.get(viewset.page_kwarg) or 1
+
+        try:
+            page_number = int(page)
+        except ValueError:
+            page_number = None
+
+        # The count and a known page are independent, fetch them together
+        if page_number is not None and page_number > 0:
+            bottom = (page_number - 1) * viewset.paginate_by
+            rows_q = viewset.object_list.values_list(*plan.columns)[
+                bottom : bottom + viewset.paginate_by
+            ]
+            paginator.count, rows = await gather_queries(
+                viewset.object_list.count, lambda: list(rows_q)
+            )
+        else:
+            paginator.count = await run_query(viewset.object_list.count)
+            rows = None
+
+        if page == "last":
+            page_number = paginator.num_pages
+
+        try:
+            page_obj = paginator.page(page_number)
+        except (InvalidPage, TypeError):
+            return response.Response(viewset.get_page_data([], paginator))
+
+        if rows is None:
+            rows = await run_query(
+                lambda: list(page_obj.object_list.values_list(*plan.columns))
+            )
+
+        return response.Response(
+            viewset.get_page_data(plan.serialize(rows), paginator, page_obj)
+        )
+
+    async def handle_cursor(self, viewset):
+        request = viewset.request
+        paginator = viewset.get_cursor_paginator()
+
+        if viewset.is_count_requested(request):
+            page, (count, count_capped) = await gather_queries(
+                lambda: viewset.get_cursor_page(paginator, request),
+                paginator.count,
+            )
+            return response.Response(
+                viewset.get_cursor_data(page, count, count_capped)
+            )
+
+        page = await run_query(viewset.get_cursor_page, paginator, request)
+        return response.Response(viewset.get_cursor_data(page))
@@ -1,25 +1,61 @@
-from django.http import Http404
+import csv
+import hashlib
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic import ListView
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from rest_framework import (
-    authentication,
+    exceptions,
     mixins,
     permissions,
     response,
     viewsets,
 )
 from rest_framework.authtoken.views import ObtainAuthToken
-
-from wallet_base.models import LeadPayment, Wallet, WalletTransaction
-from wallet_base.serializers import (
-    ExtractionSerializer,
-    WalletTransactionSerializer,
+from rest_framework.decorators import action
+
+from wallet_base.authentication import CachedTokenAuthentication
+from wallet_base.cache import (
+    get_censored_payment,
+    get_user_token_key,
+    get_user_wallet_id,
+    get_wallet,
+    get_wallet_version,
 )
+from wallet_base.metrics import registry
+from wallet_base.models import WalletTransaction
+from wallet_base.pagination import InvalidCursor, KeysetPaginator
+from wallet_base.serializers import ExtractionSerializer, get_transaction_plan
 from wallet_base.throttling import (
     UniversalAwsWafThrottle,
+    UsernameAwsWafThrottle,
     UserRateAwsAwfThrottle,
 )
 
 
+def wallet_etag(request, *args, **kwargs):
+    # Everything these responses show belongs to the user's wallet, so its
+    # change version (bumped on every transaction write) plus the requested
+    # URL identify the representation without querying it.
+    wallet_id = get_user_wallet_id(request.user.pk)
+
+    if wallet_id is None:
+        return None
+
+    path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"{wallet_id}-{get_wallet_version(wallet_id)}-{path_hash[:12]}"
+
+
+class EchoBuffer:
+    def write(self, value):
+        return value
+
+
 class ExtractionThrottle(UniversalAwsWafThrottle):
     rate = "3/day"
     scope = "extraction_day"
@@ -50,56 +86,86 @@ class TransactionThrottleMyAccount(UserRateAwsAwfThrottle):
     scope = "transaction_my_account_day"
 
 
+class LoginThrottle(UniversalAwsWafThrottle):
+    rate = "20/min"
+    scope = "login_minute"
+
+
+class LoginThrottleUsername(UsernameAwsWafThrottle):
+    rate = "10/min"
+    scope = "login_username_minute"
+
+
+def metrics_view(request):
+    if not settings.METRICS_ENDPOINT_ENABLED:
+        raise Http404
+
+    return HttpResponse(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST
+    )
+
+
 class LoginView(ObtainAuthToken):
-    pass
+    # No Basic or session authentication either, which would hash a password
+    # before the throttles run
+    authentication_classes = []
+    # Before the serializer, so refused attempts never reach the hasher
+    throttle_classes = [LoginThrottle, LoginThrottleUsername]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data["user"]
+        return response.Response({"token": get_user_token_key(user)})
 
 
 class WalletViewSet(viewsets.ViewSet):
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     throttle_classes = [WalletThrottle, WalletThrottleMyAccount]
 
-    nro_censor_length = 5
+    def get_wallet(self, request):
+        # Cached field values, the balance is read by get_wallet_data
+        return get_wallet(get_user_wallet_id(request.user.pk))
 
-    def retrieve(self, request, pk):
-        wallet = Wallet.objects.filter(
-            user=request.user,
-        ).select_related(
-            "payment"
-        )[0]
-        available = wallet.get_available_credit()
-        paid_off = wallet.get_paid_credit_negative()
-        not_available = wallet.get_pending_credit()
+    def get_wallet_data(self, wallet):
+        balance = wallet.get_balance()
+        available = balance.available
+        paid_off = balance.paid_off
+        not_available = balance.pending
         nro = None
         payment_type = ""
 
-        if wallet.payment is not None:
-            nro = wallet.payment.nro
-            payment_type = wallet.payment.payment_type
+        if wallet.payment_id is not None:
+            nro, payment_type = get_censored_payment(wallet.payment_id)
 
-            if payment_type == LeadPayment.PAYMENT_TYPE_ALIAS:
-                nro = nro[: self.nro_censor_length]  # first characters
-            else:
-                nro = nro[-self.nro_censor_length :]  # last characters
+        return {
+            "available": available,
+            "not_available": not_available,
+            "total_balance": available + not_available,
+            "paid_off": paid_off,
+            "current_payment_nro": nro,
+            "current_payment_type": payment_type,
+        }
 
-        return response.Response(
-            {
-                "available": available,
-                "not_available": not_available,
-                "total_balance": available + not_available,
-                "paid_off": paid_off,
-                "current_payment_nro": nro,
-                "current_payment_type": payment_type,
-            }
-        )
+    @method_decorator(condition(etag_func=wallet_etag))
+    def retrieve(self, request, pk):
+        return response.Response(self.get_wallet_data(self.get_wallet(request)))
 
 
 class WalletTransactionViewSet(ListView, viewsets.ViewSet):
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     throttle_classes = [TransactionThrottle, TransactionThrottleMyAccount]
     ordering = "-datetime_added"
     paginate_by = 50
+    cursor_kwarg = "cursor"
+    count_cap = 1000
+    export_chunk_size = 2000
+    export_content_types = {
+        "ndjson": "application/x-ndjson",
+        "csv": "text/csv",
+    }
 
     @property
     def queryset(self):
@@ -115,59 +181,152 @@ class WalletTransactionViewSet(ListView, viewsets.ViewSet):
             ],
         )
 
-    def list(self, request):
-        self.object_list = self.get_queryset()
+    def serialize_page(self, object_list):
+        plan = get_transaction_plan()
+        return plan.serialize(object_list.values_list(*plan.columns))
+
+    def get_page_data(self, object_list, paginator, page_obj=None):
         next_page_number = None
         previous_page_number = None
 
+        if page_obj is not None and page_obj.has_next():
+            next_page_number = page_obj.next_page_number()
+
+        if page_obj is not None and page_obj.has_previous():
+            previous_page_number = page_obj.previous_page_number()
+
+        return {
+            "object_list": object_list,
+            "num_pages": paginator.num_pages,
+            "count": paginator.count,
+            "page_size": self.paginate_by,
+            "next_page_number": next_page_number,
+            "previous_page_number": previous_page_number,
+        }
+
+    def get_cursor_paginator(self):
+        plan = get_transaction_plan()
+        return KeysetPaginator(
+            self.object_list.values_list(*plan.columns),
+            self.paginate_by,
+            count_cap=self.count_cap,
+            key=plan.key,
+        )
+
+    def get_cursor_page(self, paginator, request):
+        try:
+            return paginator.page(request.GET[self.cursor_kwarg])
+        except InvalidCursor:
+            raise exceptions.ParseError("Invalid cursor.")
+
+    def is_count_requested(self, request):
+        return request.GET.get("count") == "1"
+
+    def get_cursor_data(self, page, count=None, count_capped=None):
+        object_list, next_cursor, previous_cursor = page
+        return {
+            "object_list": get_transaction_plan().serialize(object_list),
+            "count": count,
+            "count_capped": count_capped,
+            "page_size": self.paginate_by,
+            "next_cursor": next_cursor,
+            "prev_cursor": previous_cursor,
+        }
+
+    @method_decorator(condition(etag_func=wallet_etag))
+    def list(self, request):
+        self.object_list = self.get_queryset()
+
+        if self.cursor_kwarg in request.GET:
+            return self.list_cursor(request)
+
         try:
             pagination = self.get_context_data()
         except Http404:
             paginator = self.get_paginator(self.object_list, self.paginate_by)
+            return response.Response(self.get_page_data([], paginator))
+
+        return response.Response(
+            self.get_page_data(
+                self.serialize_page(pagination["object_list"]),
+                pagination["paginator"],
+                pagination["page_obj"],
+            )
+        )
+
+    def list_cursor(self, request):
+        paginator = self.get_cursor_paginator()
+        page = self.get_cursor_page(paginator, request)
+
+        if self.is_count_requested(request):
             return response.Response(
-                {
-                    "object_list": [],
-                    "num_pages": paginator.num_pages,
-                    "count": self.object_list.count(),
-                    "page_size": self.paginate_by,
-                    "next_page_number": next_page_number,
-                    "previous_page_number": previous_page_number,
-                }
+                self.get_cursor_data(page, *paginator.count())
             )
 
-        transaction_q = WalletTransaction.objects.filter(
-            id__in=self.object_list.filter(
-                object_name="wallet_wallettransaction", object_id__isnull=False
-            ).values_list("object_id", flat=True)
+        return response.Response(self.get_cursor_data(page))
+
+    def iter_export_pages(self):
+        plan = get_transaction_plan()
+        # Named server-side cursor on postgres, rows arrive chunk by chunk
+        rows = (
+            self.queryset.order_by("-datetime_added", "-id")
+            .values_list(*plan.columns)
+            .iterator(chunk_size=self.export_chunk_size)
         )
 
-        transaction_object_map = {
-            request.id: request for request in transaction_q
-        }
+        while True:
+            chunk = list(islice(rows, self.export_chunk_size))
+
+            if not chunk:
+                return
+
+            yield plan.serialize(chunk)
+
+    def iter_ndjson(self):
+        for page in self.iter_export_pages():
+            yield "".join(
+                json.dumps(item, ensure_ascii=False, separators=(",", ":"))
+                + "\n"
+                for item in page
+            )
 
-        serializer = WalletTransactionSerializer(
-            pagination["object_list"],
-            many=True,
-            transaction_object_map=transaction_object_map,
+    def iter_csv(self):
+        field_names = get_transaction_plan().field_names
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(
+            field_names + [f"settlement_{name}" for name in field_names]
         )
-        page_obj = pagination["page_obj"]
 
-        if page_obj.has_next():
-            next_page_number = page_obj.next_page_number()
+        for page in self.iter_export_pages():
+            yield "".join(
+                writer.writerow(
+                    [item[name] for name in field_names]
+                    + [
+                        (item["object_serialized"] or {}).get(name)
+                        for name in field_names
+                    ]
+                )
+                for item in page
+            )
 
-        if page_obj.has_previous():
-            previous_page_number = page_obj.previous_page_number()
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        export_format = request.GET.get("export_format", "ndjson")
 
-        return response.Response(
-            {
-                "object_list": serializer.data,
-                "num_pages": pagination["paginator"].num_pages,
-                "count": self.object_list.count(),
-                "page_size": self.paginate_by,
-                "next_page_number": next_page_number,
-                "previous_page_number": previous_page_number,
-            }
+        if export_format not in self.export_content_types:
+            raise exceptions.ParseError("Invalid export format.")
+
+        streaming_content = (
+            self.iter_csv() if export_format == "csv" else self.iter_ndjson()
+        )
+        export_response = StreamingHttpResponse(
+            streaming_content,
+            content_type=self.export_content_types[export_format],
+        )
+        export_response["Content-Disposition"] = (
+            f'attachment; filename="transactions.{export_format}"'
         )
+        return export_response
 
 
 class WalletExtractionRequestViewSet(
@@ -175,7 +334,7 @@ class WalletExtractionRequestViewSet(
     viewsets.GenericViewSet,
     viewsets.ViewSet,
 ):
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     throttle_classes = [ExtractionThrottle, ExtractionThrottleMyAccount]
     serializer_class = ExtractionSerializer
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.urls import get_resolver, resolve, reverse
+from rest_framework.settings import api_settings
+
+from wallet_base.serializers import (
+    ExtractionSerializer,
+    WalletTransactionSerializer,
+    get_transaction_plan,
+)
+
+# Named routes of both URL confs (wallet_base.urls and urls_async)
+WARMUP_ROUTES = [
+    ("wallet:wallet-detail", ["x"]),
+    ("wallet:transaction-list", []),
+    ("wallet:transaction-export", []),
+    ("wallet:request-list", []),
+    ("wallet-login", []),
+    ("wallet-metrics", []),
+]
+
+
+def warmup():
+    """Do the work a first request would, without the database or Redis:
+    resolve every route, build the serializers and the transaction plan and
+    load DRF's settings and the password hashers. Run by the gunicorn master
+    once the app is preloaded (see wallet_base.gunicorn_conf), so workers
+    share it instead of each paying for it on its first requests."""
+
+    get_resolver(settings.ROOT_URLCONF)
+
+    for name, args in WARMUP_ROUTES:
+        resolve(reverse(name, args=args))
+
+    for setting in (
+        "DEFAULT_RENDERER_CLASSES",
+        "DEFAULT_PARSER_CLASSES",
+        "DEFAULT_CONTENT_NEGOTIATION_CLASS",
+        "DEFAULT_METADATA_CLASS",
+        "DEFAULT_VERSIONING_CLASS",
+        "DEFAULT_PAGINATION_CLASS",
+        "EXCEPTION_HANDLER",
+    ):
+        getattr(api_settings, setting)
+
+    get_transaction_plan()
+    WalletTransactionSerializer().fields
+    ExtractionSerializer().fields
+    get_hashers()